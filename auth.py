@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+
+class AuthEngine:
+    # bcrypt releases the GIL while hashing, so a thread pool is enough to spread
+    # concurrent logins across cores without the callers serializing on each other.
+    # bcrypt, asyncio and the pool are only loaded by the first hash or check, so processes
+    # that never handle a password (searches, the read-only CLI) don't pay for them at startup.
+    def __init__(self, max_workers=None, rounds=12):
+        self.max_workers = max_workers or int(os.getenv("AUTH_WORKERS", 0)) or os.cpu_count() or 1
+        self.rounds = rounds
+        self.executor = None
+        self.metrics = {"hash": LatencyStats(), "check": LatencyStats()}
+        self._lock = threading.Lock()
+
+    def submit_hash(self, password):
+        return self._pool().submit(self._timed, "hash", self._hash, password)
+
+    def submit_check(self, password, hashed_password):
+        return self._pool().submit(self._timed, "check", self._check, password, hashed_password)
+
+    def hash_password(self, password):
+        return self.submit_hash(password).result()
+
+    def check_password(self, password, hashed_password):
+        return self.submit_check(password, hashed_password).result()
+
+    async def hash_password_async(self, password):
+        import asyncio
+        return await asyncio.wrap_future(self.submit_hash(password))
+
+    async def check_password_async(self, password, hashed_password):
+        import asyncio
+        return await asyncio.wrap_future(self.submit_check(password, hashed_password))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def _pool(self):
+        with self._lock:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+            return self.executor
+
+    def _hash(self, password):
+        import bcrypt
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+
+    def _check(self, password, hashed_password):
+        if isinstance(hashed_password, str):  # Hashes restored from a JSON backup come back as str
+            hashed_password = hashed_password.encode('utf-8')
+        import bcrypt
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+    def _timed(self, kind, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.metrics[kind].record(time.perf_counter() - start)
+
+
+class LatencyStats:
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window = window
+        self.samples = []  # Ring buffer of the most recent latencies for percentiles
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            if len(self.samples) < self.window:
+                self.samples.append(seconds)
+            else:
+                self.samples[self.count % self.window] = seconds
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self.samples)
+            count, total, peak = self.count, self.total, self.max
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+        return {"count": count, "mean": total / count if count else 0.0, "p50": percentile(0.5),
+                "p99": percentile(0.99), "max": peak}
+
+
+_auth_engine = None
+
+
+def get_auth_engine():
+    global _auth_engine
+    if _auth_engine is None:
+        _auth_engine = AuthEngine()
+    return _auth_engine
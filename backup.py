@@ -0,0 +1,204 @@
+import json
+import os
+import re
+import threading
+from collections.abc import MutableMapping
+
+FORMAT = "library-backup"
+VERSION = 1
+
+
+def book_record(key, book):
+    if book is None:
+        return {"type": "book", "key": key, "deleted": True}
+    return {"type": "book", "key": key, "title": book.title, "author": book.author, "genre": book.genre,
+            "total_copies": book.total_copies, "available_copies": book.available_copies,
+            "rating_count": book.rating_count, "rating_sum": book.rating_sum,
+            "rating_histogram": list(book.rating_histogram), "reviews": list(book.reviews)}
+
+
+def user_record(username, user):
+    if user is None:
+        return {"type": "user", "key": username, "deleted": True}
+    hashed_password = user.hashed_password
+    if isinstance(hashed_password, bytes):
+        hashed_password = hashed_password.decode('utf-8')
+    return {"type": "user", "key": username, "hashed_password": hashed_password,
+            "security_questions": user.security_questions, "security_answers": user.security_answers,
+            "email": user.email, "borrowed_log": user.borrowed_log.to_list()}
+
+
+def borrow_record(username, index, entry):
+    # One new borrowed_log entry, so a lend or return doesn't rewrite the user's whole history. index is its
+    # position in the log, so replaying it over a snapshot that already has it changes nothing.
+    title, action, timestamp = entry
+    return {"type": "borrow", "key": username, "index": index, "entry": [title, int(action), timestamp]}
+
+
+def loan_record(loan_id, loan):
+    if loan is None:
+        return {"type": "loan", "key": loan_id, "deleted": True}
+    return {"type": "loan", "key": loan_id, "username": loan.username, "book": loan.key,
+            "lent_at": loan.lent_at, "due_at": loan.due_at, "reminder_stage": loan.reminder_stage}
+
+
+def hold_record(key, username, deadline):
+    # A copy set aside for a user from the waitlist. It is already out of available_copies, so it has to be
+    # restored along with the catalog. A deadline of None means the hold was collected or released.
+    record_key = json.dumps([key, username])
+    if deadline is None:
+        return {"type": "hold", "key": record_key, "deleted": True}
+    return {"type": "hold", "key": record_key, "book": key, "username": username, "deadline": deadline}
+
+
+def session_record(logged_in_user):
+    return {"type": "session", "logged_in_user": logged_in_user.username if logged_in_user else None}
+
+
+def snapshot_records(books, users, logged_in_user, loans=(), journal_generation=None, holds=()):
+    # Generator over the live catalog so a full backup never holds a second copy of it.
+    # A checkpoint records the first journal generation that is not yet folded into it.
+    header = {"type": "header", "format": FORMAT, "version": VERSION}
+    if journal_generation is not None:
+        header["journal_generation"] = journal_generation
+    yield header
+    for key, book in books.items():
+        yield book_record(key, book)
+    for username, user in users.items():
+        yield user_record(username, user)
+    for loan in loans:
+        yield loan_record(loan.loan_id, loan)
+    for key, username, deadline in holds:
+        yield hold_record(key, username, deadline)
+    yield session_record(logged_in_user)
+
+
+def write_snapshot(filename, records):
+    # Written next to the target and renamed over it, so a crash never leaves a half-written backup
+    tmp_filename = f"{filename}.tmp"
+    count = 0
+    with open(tmp_filename, 'w') as file:
+        for record in records:
+            file.write(json.dumps(record, separators=(',', ':')))
+            file.write('\n')
+            count += 1
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filename, filename)
+    return count
+
+
+def append_records(filename, records):
+    count = 0
+    with open(filename, 'a') as file:
+        for record in records:
+            file.write(json.dumps(record, separators=(',', ':')))
+            file.write('\n')
+            count += 1
+        file.flush()
+        os.fsync(file.fileno())
+    return count
+
+
+def is_snapshot(filename):
+    # Backups written before the JSON Lines format are a single indented JSON document
+    try:
+        with open(filename, 'r') as file:
+            first_line = file.readline()
+        return json.loads(first_line).get("format") == FORMAT
+    except (ValueError, AttributeError):
+        return False
+
+
+def read_records(filename):
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+# Records are written with "type" and "key" first, so the offset index can read them off the
+# start of each line without decoding the rest of the record
+RECORD_PREFIX = re.compile(rb'^\{"type":"(book|user)","key":("(?:[^"\\]|\\.)*")(,"deleted":true)?')
+
+
+def index_records(filename):
+    # One pass over the raw bytes recording where the latest record for each key starts; loans and holds
+    # are few and are returned decoded, keyed by their record keys
+    book_offsets, user_offsets, loans, holds, logged_in_user, record_count = {}, {}, {}, {}, None, 0
+    with open(filename, 'rb') as file:
+        offset = 0
+        for line in file:
+            match = RECORD_PREFIX.match(line)
+            if match:
+                record_type, key, deleted = match.group(1), json.loads(match.group(2)), match.group(3)
+            elif line.strip():
+                record = json.loads(line)
+                record_type, key, deleted = record["type"].encode(), record.get("key"), record.get("deleted")
+                if record_type == b"session":
+                    logged_in_user = record["logged_in_user"]
+                elif record_type in (b"loan", b"hold"):
+                    target = loans if record_type == b"loan" else holds
+                    record_count += 1
+                    if deleted:
+                        target.pop(key, None)
+                    else:
+                        target[key] = record
+            else:
+                record_type = None
+
+            if record_type in (b"book", b"user"):
+                offsets = book_offsets if record_type == b"book" else user_offsets
+                record_count += 1
+                if deleted:
+                    offsets.pop(key, None)
+                else:
+                    offsets[key] = offset
+            offset += len(line)
+    return book_offsets, user_offsets, loans, holds, logged_in_user, record_count
+
+
+class LazyRecords(MutableMapping):
+    # Dict stand-in for Library.books/users that builds each object from the backup file on first access
+    def __init__(self, filename, offsets, factory):
+        self.loaded = {}
+        self.offsets = offsets
+        self.factory = factory
+        self.file = open(filename, 'rb')
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        value = self.loaded.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            if key in self.loaded:  # Another thread materialized it while we waited
+                return self.loaded[key]
+            offset = self.offsets[key]
+            self.file.seek(offset)
+            value = self.factory(key, json.loads(self.file.readline()))
+            self.loaded[key] = value
+            del self.offsets[key]
+        return value
+
+    def __setitem__(self, key, value):
+        self.offsets.pop(key, None)
+        self.loaded[key] = value
+
+    def __delitem__(self, key):
+        if key in self.loaded:
+            del self.loaded[key]
+        else:
+            del self.offsets[key]
+
+    def __contains__(self, key):
+        return key in self.loaded or key in self.offsets
+
+    def __iter__(self):
+        # Copies, because reading values while iterating moves keys from offsets to loaded
+        yield from list(self.loaded)
+        yield from list(self.offsets)
+
+    def __len__(self):
+        return len(self.loaded) + len(self.offsets)
@@ -0,0 +1,141 @@
+"""Hammer lend_book/return_book from many sessions at once and check no copy is ever lent twice.
+
+    python benchmarks/lending_stress.py [--sqlite PATH] [--operations N] [--books N] [--copies N]
+
+Runs the same workload with 1, 2, 4 and 8 worker threads, then once more as asyncio tasks, and prints
+operations per second for each.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library import Library, User  # noqa: E402
+from storage import MemoryStorage, SqliteStorage  # noqa: E402
+
+
+class LoanTracker:
+    # Independent count of who holds each book; a successful lend beyond total_copies is a double lend
+    def __init__(self, copies):
+        self.copies = copies
+        self.holders = {}
+        self.violations = 0
+        self.lock = threading.Lock()
+
+    def lent(self, key):
+        with self.lock:
+            self.holders[key] = self.holders.get(key, 0) + 1
+            if self.holders[key] > self.copies:
+                self.violations += 1
+
+    def returned(self, key):
+        with self.lock:
+            self.holders[key] -= 1
+
+
+def build_library(storage, users, books, copies):
+    library = Library(storage)
+    for i in range(users):
+        storage.put_user(f"user{i}", User(f"user{i}", b"unused"))
+    library.logged_in_user = User("admin", b"unused")
+    for i in range(books):
+        library.add_book(f"Book {i}", "Author", "Genre", copies)
+    return library
+
+
+def session_for(library, worker):
+    session = library.open_session()
+    session.logged_in_user = library.users[f"user{worker}"]
+    return session
+
+
+def churn(session, tracker, operations, books, seed):
+    # Borrow a book, hand it straight back; most attempts contend on the same few titles
+    for i in range(operations):
+        key = f"book {(seed * 7 + i) % books}"
+        if session.lend_book(key):
+            tracker.lent(key)
+            time.sleep(0)  # Hold the copy across a thread switch so overlapping loans would show up
+            tracker.returned(key)
+            session.return_book(key)
+
+
+async def churn_async(session, tracker, operations, books, seed):
+    for i in range(operations):
+        key = f"book {(seed * 7 + i) % books}"
+        if await session.lend_book_async(key):
+            tracker.lent(key)
+            await asyncio.sleep(0)
+            tracker.returned(key)
+            await session.return_book_async(key)
+
+
+def check(library, books, copies, tracker):
+    for i in range(books):
+        book = library.books[f"book {i}"]
+        assert book.available_copies == copies, f"{book.title}: {book.available_copies} of {copies} available"
+    assert tracker.violations == 0, f"{tracker.violations} double lends"
+
+
+def run(make_storage, workers, args):
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        library = build_library(make_storage(), workers, args.books, args.copies)
+        tracker = LoanTracker(args.copies)
+        per_worker = args.operations // workers
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(churn, session_for(library, w), tracker, per_worker, args.books, w)
+                       for w in range(workers)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+    check(library, args.books, args.copies, tracker)
+    return per_worker * workers / elapsed
+
+
+def run_async(make_storage, tasks, args):
+    async def main(library, tracker, per_task):
+        await asyncio.gather(*(churn_async(session_for(library, t), tracker, per_task, args.books, t)
+                               for t in range(tasks)))
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        library = build_library(make_storage(), tasks, args.books, args.copies)
+        tracker = LoanTracker(args.copies)
+        per_task = args.operations // tasks
+        start = time.perf_counter()
+        asyncio.run(main(library, tracker, per_task))
+        elapsed = time.perf_counter() - start
+    check(library, args.books, args.copies, tracker)
+    return per_task * tasks / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sqlite", metavar="PATH", help="use SqliteStorage at PATH instead of memory")
+    parser.add_argument("--operations", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=5)
+    parser.add_argument("--copies", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.sqlite:
+        def make_storage():
+            for suffix in ("", "-wal", "-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(args.sqlite + suffix)
+            return SqliteStorage(args.sqlite)
+    else:
+        make_storage = MemoryStorage
+
+    for workers in (1, 2, 4, 8):
+        print(f"{workers} threads: {run(make_storage, workers, args):10.0f} ops/s, no double lends")
+    print(f"8 asyncio tasks: {run_async(make_storage, 8, args):7.0f} ops/s, no double lends")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Load-test the multi-process server: requests per second and latency percentiles for search, lend and login.
+
+    python benchmarks/load_test.py [--workers 1,2,4] [--clients 8] [--duration 5] [--books 10000] [--unix]
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 [--socket /tmp/library.sock]
+
+Without --url it builds a synthetic SQLite catalog, starts server.py with each worker count in turn and
+stops it afterwards. Every client is its own process holding one keep-alive connection; a lend is a
+lend followed by a return of the same book, counted as two requests. Login limits are raised so the
+login scenario measures bcrypt rather than the throttle.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from catalog import PASSWORD, WORDS, make_library, make_storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def connect(target):
+    if target.startswith("/"):
+        return UnixHTTPConnection(target)
+    url = urlsplit(target)
+    return http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+
+
+def request(connection, method, path, body=None, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+    response = connection.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def client(target, scenario, client_id, duration, titles):
+    # Runs one scenario from one process until the deadline; returns per-request latencies and errors
+    rng = random.Random(client_id)
+    connection = connect(target)
+    username = f"user{client_id}"
+    token = None
+    if scenario == "lend":
+        status, data = request(connection, "POST", "/login", {"username": username, "password": PASSWORD})
+        token = json.loads(data)["token"]
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        if scenario == "search":
+            calls = [("GET", f"/search?q={rng.choice(WORDS)}+{rng.choice(WORDS)}", None)
+                     if rng.random() < 0.5 else
+                     ("GET", f"/search?q={rng.choice(WORDS)}&field={rng.choice(['title', 'author', 'genre'])}", None)]
+        elif scenario == "lend":
+            title = rng.choice(titles)
+            calls = [("POST", "/lend", {"title": title}), ("POST", "/return", {"title": title})]
+        else:
+            calls = [("POST", "/login", {"username": username, "password": PASSWORD})]
+        for method, path, body in calls:
+            start = time.perf_counter()
+            status, _ = request(connection, method, path, body, token)
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+    connection.close()
+    return latencies, errors
+
+
+def run_scenario(target, scenario, clients, duration, titles):
+    with ProcessPoolExecutor(clients) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(client, [target] * clients, [scenario] * clients, range(clients),
+                                [duration] * clients, [titles] * clients))
+        elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result[0])
+    if not latencies:
+        return {"requests": 0}
+    return {"requests": len(latencies), "errors": sum(result[1] for result in results),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000}
+
+
+def wait_until_up(target, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            request(connect(target), "GET", "/books?limit=1")
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server at {target} did not start")
+
+
+def start_server(db_path, workers, unix_path, port):
+    env = dict(os.environ, LOGIN_THROTTLE_DB=db_path + "-throttle", LOGIN_USER_RATE="1000000",
+               LOGIN_USER_BURST="1000000", LOGIN_SOURCE_RATE="1000000", LOGIN_SOURCE_BURST="1000000",
+               LOGIN_GLOBAL_RATE="1000000", LOGIN_GLOBAL_BURST="1000000")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(env["LOGIN_THROTTLE_DB"] + suffix):
+            os.remove(env["LOGIN_THROTTLE_DB"] + suffix)
+    command = [sys.executable, os.path.join(ROOT, "server.py"), "--db", db_path, "--workers", str(workers)]
+    command += ["--unix", unix_path] if unix_path else ["--bind", f"127.0.0.1:{port}"]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+
+
+def print_results(workers, results):
+    for scenario, result in results.items():
+        if result["requests"]:
+            print(f"{workers:>7} {scenario:<8} {result['rps']:>10.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                  f"{result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--socket", help="Unix socket path of a running server")
+    parser.add_argument("--workers", default="1,2,4", help="worker counts to start the server with")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--scenarios", default="search,lend,login")
+    parser.add_argument("--unix", action="store_true", help="start the server on a Unix socket")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-o", "--output", help="also write the results as JSON")
+    args = parser.parse_args()
+    scenarios = args.scenarios.split(",")
+
+    print(f"{'workers':>7} {'scenario':<8} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6}")
+    output = {}
+    if args.url or args.socket:
+        target = args.socket or args.url
+        titles = [book["title"] for book in json.loads(request(connect(target), "GET", "/books?limit=500")[1])]
+        results = {scenario: run_scenario(target, scenario, args.clients, args.duration, titles) for scenario in scenarios}
+        print_results("-", results)
+        output["-"] = results
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            db_path = os.path.join(workdir, "catalog.db")
+            library = make_library(args.books, max(args.clients, 100), make_storage("sqlite", db_path))
+            titles = [book.title for book in library.list_books(limit=500)]
+            library.storage.close()
+            for workers in [int(count) for count in args.workers.split(",")]:
+                unix_path = os.path.join(workdir, "server.sock") if args.unix else None
+                server = start_server(db_path, workers, unix_path, args.port)
+                target = unix_path or f"http://127.0.0.1:{args.port}"
+                try:
+                    wait_until_up(target)
+                    results = {scenario: run_scenario(target, scenario, args.clients, args.duration, titles)
+                               for scenario in scenarios}
+                finally:
+                    server.terminate()
+                    server.wait()
+                print_results(workers, results)
+                output[workers] = results
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
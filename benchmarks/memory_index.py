@@ -0,0 +1,57 @@
+"""Measure the memory taken by the in-memory search indexes next to the Book records they index.
+
+    python benchmarks/memory_index.py [number_of_books]
+
+The catalog comes from catalog.book_rows, so titles, authors and genres look like the other benchmarks'.
+Each structure is built on its own under tracemalloc and its retained size reported: the Book objects,
+the substring index behind search_books (search_index.BookIndex) and the ranked-search index
+(ranking.RankedIndex).
+"""
+import sys
+import tracemalloc
+
+from catalog import book_rows
+
+from library import Book  # noqa: E402  (catalog puts the project root on sys.path)
+from ranking import RankedIndex  # noqa: E402
+from search_index import BookIndex  # noqa: E402
+
+
+def traced(build):
+    # Bytes still allocated once build() returns, with its result kept alive
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def build_books(book_count):
+    return {row["title"].lower(): Book(row["title"], row["author"], row["genre"], row["total_copies"])
+            for row in book_rows(book_count)}
+
+
+def build_index(index_class, books):
+    def build():
+        index = index_class()
+        index.rebuild(books)
+        return index
+    return build
+
+
+def main():
+    book_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    books_bytes = traced(lambda: build_books(book_count))
+    books = build_books(book_count)
+    results = {"Book objects": books_bytes,
+               "BookIndex": traced(build_index(BookIndex, books)),
+               "RankedIndex": traced(build_index(RankedIndex, books))}
+
+    print(f"{book_count} books")
+    for name, size in results.items():
+        print(f"{name:<14} {size / 2**20:8.1f} MiB ({size / book_count:.0f} B per book)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compare the memory taken by Book/User records in the old dict-based layout and the slotted one.
+
+    python benchmarks/memory_records.py [number_of_books]
+"""
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library import Book, LogAction, User  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Mystery", "Romance", "History", "Biography", "Poetry", "Drama"]
+
+
+class DictBook:
+    # The layout Book had before it was slotted: per-instance __dict__ and ratings kept in the reviews list
+    def __init__(self, title, author, genre, total_copies=1):
+        self.title = title
+        self.author = author
+        self.genre = genre
+        self.total_copies = total_copies
+        self.available_copies = total_copies
+        self.reviews = []
+        self.rating = 0
+
+    def add_rating(self, rating):
+        self.reviews.append(rating)
+        self.rating = sum(self.reviews) / len(self.reviews)
+
+
+class DictUser:
+    def __init__(self, username, hashed_password, email=None):
+        self.username = username
+        self.hashed_password = hashed_password
+        self.security_questions = []
+        self.security_answers = {}
+        self.email = email
+        self.reset_code = None
+        self.reset_code_expiry = None
+        self.borrowed_log = []
+        self.wrong_attempts = 0
+        self.cooldown_end_time = None
+
+
+def build(book_count, compact):
+    rng = random.Random(42)
+    authors = [f"Author {i}" for i in range(book_count // 20 + 1)]
+    books, users = [], []
+    for i in range(book_count):
+        # Fresh strings per record, as they would be when read from a backup file
+        author = "".join(rng.choice(authors))
+        genre = "".join(rng.choice(GENRES))
+        book = Book(f"Title {i}", author, genre, 3) if compact else DictBook(f"Title {i}", author, genre, 3)
+        for _ in range(5):
+            book.add_rating(rng.randint(1, 5))
+        books.append(book)
+
+    for i in range(book_count // 10):
+        if compact:
+            user = User(f"user{i}", b"$2b$12$" + bytes(53), email=f"user{i}@example.com")
+        else:
+            user = DictUser(f"user{i}", b"$2b$12$" + bytes(53), email=f"user{i}@example.com")
+        for _ in range(10):
+            book = rng.choice(books)
+            if compact:
+                user.borrowed_log.record(book.title, LogAction.LENT)
+                user.borrowed_log.record(book.title, LogAction.RETURNED)
+            else:
+                user.borrowed_log.append(f"Lent '{book.title}'")
+                user.borrowed_log.append(f"Returned '{book.title}'")
+        users.append(user)
+    return books, users
+
+
+def measure(book_count, compact):
+    tracemalloc.start()
+    records = build(book_count, compact)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+
+def main():
+    book_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # add_rating prints a thank-you line per call
+    try:
+        dict_bytes = measure(book_count, compact=False)
+        compact_bytes = measure(book_count, compact=True)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"{book_count} books, {book_count // 10} users")
+    print(f"dict layout:    {dict_bytes / 2**20:8.1f} MiB ({dict_bytes / book_count:.0f} B per book)")
+    print(f"compact layout: {compact_bytes / 2**20:8.1f} MiB ({compact_bytes / book_count:.0f} B per book)")
+    print(f"saved:          {100 * (1 - compact_bytes / dict_bytes):8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Benchmark the Library hot paths against synthetic catalogs and save the results as JSON.
+
+    python benchmarks/run.py [--sizes 1000,10000,100000] [--storage memory|sqlite] [--memory] [-o results.json]
+    python benchmarks/run.py --compare base.json head.json
+
+Every scenario is timed --repeat times with console output discarded; the JSON records the median and
+minimum per operation together with the git revision, so runs from two revisions can be compared.
+With --memory each scenario is run once more under tracemalloc to record its peak allocation.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from catalog import PASSWORD, make_library, make_storage, quiet
+
+from library import Library  # noqa: E402  (catalog puts the project root on sys.path)
+from catalog_snapshot import write_catalog_snapshot  # noqa: E402
+from storage import MappedStorage, MemoryStorage  # noqa: E402
+from throttle import LoginThrottle, MemoryThrottleStore  # noqa: E402
+
+SEARCHES = [("the", 1), ("winter", 1), ("orchard glass", 1), ("son", 2), ("ember", 2), ("fantasy", 3),
+            ("fi", 3), ("poetry", 3), ("zzz", 1), ("mirror", 2)]
+
+
+def scenario_search(library, workdir):
+    def run():
+        for keyword, filter_option in SEARCHES:
+            library.search_books(keyword, filter_option)
+    return run, len(SEARCHES)
+
+
+def scenario_search_uncached(library, workdir):
+    # Every query misses the query cache, as the first search after a catalog change does
+    def run():
+        for keyword, filter_option in SEARCHES:
+            library.query_cache.invalidate()
+            library.search_books(keyword, filter_option)
+    return run, len(SEARCHES)
+
+
+def scenario_display_first_page(library, workdir):
+    return lambda: library.display_books(0, 20), 1
+
+
+def scenario_display_all(library, workdir):
+    return library.display_books, 1
+
+
+def scenario_lend_return(library, workdir):
+    session = library.open_session()
+    session.logged_in_user = library.users["user0"]
+    keys = [book.title.lower() for book in library.list_books(limit=500)]
+
+    def run():
+        for key in keys:
+            session.lend_book(key)
+            session.return_book(key)
+    return run, 2 * len(keys)
+
+
+def scenario_lend_return_journaled(library, workdir):
+    # Same churn with every change going through the write-ahead journal; the library is a copy so the
+    # journal stays out of the other scenarios
+    journaled = copy.copy(library)
+    journaled.open_journal(os.path.join(workdir, "journal"))
+    run, ops = scenario_lend_return(journaled, workdir)
+
+    def run_and_sync():
+        run()
+        journaled.journal.wait()  # Count the time until the last change is on disk
+    return run_and_sync, ops
+
+
+def scenario_login(library, workdir):
+    # Limits high enough that every attempt reaches bcrypt; login_rejected times the throttled path
+    library.throttle = LoginThrottle(MemoryThrottleStore(), user_burst=1e9, source_burst=1e9, global_burst=1e9)
+
+    def run():
+        for i in range(4):
+            library.login(f"user{i}", PASSWORD)
+            library.login(f"user{i}", "wrong password")
+        library.logout()
+    return run, 8
+
+
+def scenario_login_rejected(library, workdir):
+    session = library.open_session()
+    session.throttle = LoginThrottle(MemoryThrottleStore(), lockout_seconds=3600)
+    for _ in range(session.throttle.max_failures):
+        session.login("user0", "wrong password")
+
+    def run():
+        for _ in range(1000):  # A credential-stuffing burst against a locked account
+            session.login("user0", "guess")
+    return run, 1000
+
+
+def scenario_backup_full(library, workdir):
+    path = os.path.join(workdir, "full.jsonl")
+    return lambda: library.backup_data(path), 1
+
+
+def scenario_backup_incremental(library, workdir):
+    path = os.path.join(workdir, "incremental.jsonl")
+    library.backup_data(path)
+    session = library.open_session()
+    session.logged_in_user = library.users["user1"]
+    keys = [book.title.lower() for book in library.list_books(limit=100)]
+
+    def run():
+        for key in keys:  # 100 changed books per backup
+            session.lend_book(key)
+            session.return_book(key)
+        library.backup_data(path, incremental=True)
+    return run, 1
+
+
+def scenario_restore(lazy):
+    def scenario(library, workdir):
+        path = os.path.join(workdir, "restore.jsonl")
+        library.backup_data(path)
+
+        def run():
+            restored = Library(MemoryStorage())
+            restored.restore_data(path, lazy=lazy)
+            restored.books.get(library.list_books(limit=1)[0].title.lower())  # First request after startup
+        return run, 1
+    return scenario
+
+
+def scenario_restore_mapped(library, workdir):
+    # Startup from the memory-mapped snapshot instead of a JSON backup: map the file, answer the first request
+    path = os.path.join(workdir, "catalog.snap")
+    write_catalog_snapshot(path, library.books)
+
+    def run():
+        restored = Library(MappedStorage(path))
+        restored.books.get(library.list_books(limit=1)[0].title.lower())
+    return run, 1
+
+
+def scenario_search_mapped(library, workdir):
+    path = os.path.join(workdir, "catalog.snap")
+    write_catalog_snapshot(path, library.books)
+    return scenario_search(Library(MappedStorage(path)), workdir)
+
+
+SCENARIOS = {
+    "search": scenario_search,
+    "search_uncached": scenario_search_uncached,
+    "display_first_page": scenario_display_first_page,
+    "display_all": scenario_display_all,
+    "lend_return": scenario_lend_return,
+    "lend_return_journaled": scenario_lend_return_journaled,
+    "login": scenario_login,
+    "login_rejected": scenario_login_rejected,
+    "backup_full": scenario_backup_full,
+    "backup_incremental": scenario_backup_incremental,
+    "restore_eager": scenario_restore(lazy=False),
+    "restore_lazy": scenario_restore(lazy=True),
+    "restore_mapped": scenario_restore_mapped,
+    "search_mapped": scenario_search_mapped,
+}
+
+
+def time_scenario(run, repeat):
+    timings = []
+    with quiet():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def peak_memory(run):
+    with quiet():
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak
+
+
+def build(size, args, workdir):
+    storage = make_storage(args.storage, os.path.join(workdir, f"catalog-{size}.db"))
+    start = time.perf_counter()
+    if args.memory:  # Tracing slows the build down, so compare build times only between runs with the same flags
+        tracemalloc.start()
+    library = make_library(size, args.users, storage)
+    build_bytes = tracemalloc.get_traced_memory()[0] if args.memory else None
+    if args.memory:
+        tracemalloc.stop()
+    return library, {"scenario": "build_catalog", "size": size, "ops": size,
+                     "median_s": time.perf_counter() - start, "min_s": None, "peak_bytes": build_bytes}
+
+
+def run_benchmarks(args):
+    results = []
+    scenarios = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            library, build_result = build(size, args, workdir)
+            results.append(build_result)
+            report(build_result)
+            for name in scenarios:
+                with quiet():
+                    run, ops = SCENARIOS[name](library, workdir)
+                timings = time_scenario(run, args.repeat)
+                result = {"scenario": name, "size": size, "ops": ops,
+                          "median_s": statistics.median(timings), "min_s": min(timings),
+                          "peak_bytes": peak_memory(run) if args.memory else None}
+                results.append(result)
+                report(result)
+    return results
+
+
+def report(result):
+    per_op = result["median_s"] / result["ops"]
+    memory = f"  peak {result['peak_bytes'] / 2**20:8.1f} MiB" if result["peak_bytes"] is not None else ""
+    print(f"{result['scenario']:<20} {result['size']:>9} books  {result['median_s']:10.4f}s  "
+          f"{per_op * 1e6:12.1f} us/op{memory}", flush=True)
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base_file, head_file):
+    with open(base_file) as file:
+        base = json.load(file)
+    with open(head_file) as file:
+        head = json.load(file)
+    base_results = {(r["scenario"], r["size"]): r for r in base["results"]}
+    print(f"{'scenario':<20} {'size':>9}  {base['revision'] or 'base':>12}  {head['revision'] or 'head':>12}  change")
+    for result in head["results"]:
+        before = base_results.get((result["scenario"], result["size"]))
+        if before is None:
+            continue
+        ratio = result["median_s"] / before["median_s"] if before["median_s"] else float("nan")
+        print(f"{result['scenario']:<20} {result['size']:>9}  {before['median_s']:11.4f}s  "
+              f"{result['median_s']:11.4f}s  {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        type=lambda value: [int(size) for size in value.split(",")])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true", help="also record peak traced memory per scenario")
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({"revision": revision(), "python": platform.python_version(), "storage": args.storage,
+                       "repeat": args.repeat, "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
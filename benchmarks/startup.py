@@ -0,0 +1,112 @@
+"""Measure startup: how long importing library takes, module by module, and how long a fresh process takes
+to answer a read-only command.
+
+    python benchmarks/startup.py [--books 10000] [--repeat 10] [--top 12] [-o startup.json]
+
+Each command is started --repeat times as a new interpreter after one untimed run (which also leaves the
+bytecode and the catalog files in the page cache); the median and minimum wall time are reported. The
+interpreter on its own (`-c pass`) is the floor. The search command is run as `python -m library` against
+the same synthetic catalog kept three ways: replayed from a journal directory into memory, in SQLite, and as
+a memory-mapped snapshot; once more as `python library.py`, which compiles library.py on every run because
+Python never caches bytecode for the script it is given. The import breakdown comes from
+`python -X importtime` and lists the slowest modules imported directly by library.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from catalog import make_library, make_storage, quiet
+
+from storage import MappedStorage  # noqa: E402  (catalog puts the project root on sys.path)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH = ["search", "--genre", "poetry", "--limit", "5"]
+
+
+def wall_times(command, env, repeat):
+    subprocess.run(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return {"median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000}
+
+
+def import_breakdown(top):
+    # (module, cumulative microseconds) for library and the modules it imports directly, slowest first
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import library"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    # Each line is "import time: self | cumulative | name", the name indented two spaces per level, and a
+    # module's line comes after those of the modules it imported
+    children = []
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative)))
+        elif depth == 0 and name.strip() == "library":
+            return [(name.strip(), int(cumulative))] + sorted(children, key=lambda module: -module[1])[:top]
+        elif depth == 0:
+            children = []
+    return []
+
+
+def build_catalogs(workdir, books):
+    library = make_library(books, 10)
+    with quiet():
+        library.open_journal(os.path.join(workdir, "journal"))
+        library.close()
+    mapped = MappedStorage(os.path.join(workdir, "catalog.snap"))
+    mapped.replace_all(library.books, library.users)
+    mapped.close()
+    make_library(books, 10, make_storage("sqlite", os.path.join(workdir, "catalog.db"))).storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=12, help="modules to list in the import breakdown")
+    parser.add_argument("-o", "--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    breakdown = import_breakdown(args.top)
+    print(f"{'module':<24} {'import ms':>10}")
+    for name, microseconds in breakdown:
+        print(f"{name:<24} {microseconds / 1000:>10.1f}")
+
+    env = {name: value for name, value in os.environ.items()
+           if name not in ("LIBRARY_DB", "LIBRARY_SNAPSHOT", "LIBRARY_DATA_DIR")}
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        build_catalogs(workdir, args.books)
+        snapshot_env = dict(env, LIBRARY_SNAPSHOT=os.path.join(workdir, "catalog.snap"))
+        commands = {
+            "python -c pass": ([sys.executable, "-c", "pass"], env),
+            "import library": ([sys.executable, "-c", "import library"], env),
+            "search (journal)": ([sys.executable, "-m", "library", *SEARCH],
+                                 dict(env, LIBRARY_DATA_DIR=os.path.join(workdir, "journal"))),
+            "search (sqlite)": ([sys.executable, "-m", "library", *SEARCH],
+                                dict(env, LIBRARY_DB=os.path.join(workdir, "catalog.db"))),
+            "search (snapshot)": ([sys.executable, "-m", "library", *SEARCH], snapshot_env),
+            "library.py (snapshot)": ([sys.executable, os.path.join(ROOT, "library.py"), *SEARCH], snapshot_env),
+        }
+        print(f"\n{'command':<24} {'median ms':>10} {'min ms':>10}   ({args.books} books)")
+        for name, (command, command_env) in commands.items():
+            results[name] = wall_times(command, command_env, args.repeat)
+            print(f"{name:<24} {results[name]['median_ms']:>10.1f} {results[name]['min_ms']:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({"books": args.books, "repeat": args.repeat, "imports_us": dict(breakdown),
+                       "commands": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
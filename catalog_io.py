@@ -0,0 +1,76 @@
+import csv
+import json
+
+# Column order used for both formats; total_copies defaults to 1 when a feed leaves it out
+FIELDS = ["title", "author", "genre", "total_copies"]
+
+
+def read_books_csv(filename):
+    # Rows are yielded as they are read, so a feed of any size is streamed rather than loaded
+    with open(filename, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            yield row
+
+
+def read_books_jsonl(filename):
+    with open(filename, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None  # Passed on so book_fields reports it with the other bad rows
+
+
+def book_fields(row):
+    # (title, author, genre, total_copies) from a feed row; raises ValueError saying what is wrong with it
+    if not isinstance(row, dict):
+        raise ValueError("not a JSON object")
+    fields = []
+    for name in ("title", "author", "genre"):
+        value = row.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"missing {name}")
+        fields.append(value)
+    copies = row.get("total_copies")
+    if copies is None or copies == "":
+        copies = 1
+    elif isinstance(copies, str) and copies.strip().isdigit():
+        copies = int(copies)
+    elif not isinstance(copies, int) or isinstance(copies, bool):
+        raise ValueError(f"total_copies {copies!r} is not a whole number")
+    if copies < 1:
+        raise ValueError(f"total_copies {copies!r} is less than 1")
+    return fields[0], fields[1], fields[2], copies
+
+
+def write_books_csv(filename, books):
+    count = 0
+    with open(filename, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for book in books:
+            writer.writerow([book.title, book.author, book.genre, book.total_copies])
+            count += 1
+    return count
+
+
+def write_books_jsonl(filename, books):
+    count = 0
+    with open(filename, 'w', encoding='utf-8') as file:
+        for book in books:
+            file.write(json.dumps({"title": book.title, "author": book.author, "genre": book.genre,
+                                   "total_copies": book.total_copies}))
+            file.write('\n')
+            count += 1
+    return count
+
+
+READERS = {"csv": read_books_csv, "jsonl": read_books_jsonl}
+# Raised part way through a feed that is not valid CSV or UTF-8
+READ_ERRORS = (csv.Error, UnicodeDecodeError)
+WRITERS = {"csv": write_books_csv, "jsonl": write_books_jsonl}
+
+
+def detect_format(filename):
+    return "jsonl" if filename.endswith((".jsonl", ".ndjson")) else "csv"
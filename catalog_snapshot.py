@@ -0,0 +1,300 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+
+import ratings
+from models import Book
+from search_index import GRAM_SIZE, grams
+
+# File layout, every section 8-byte aligned and in native byte order (the header records which):
+#   header | records, one fixed-width RECORD per book in key order | postings, uint32 record numbers |
+#   gram tables for title, author and genre, one GRAM per gram in byte order | string table, UTF-8
+MAGIC = b"LIBCAT01"
+BYTE_ORDER = 0x01020304  # Reads back differently on a machine of the other endianness
+HEADER = struct.Struct("=8sIIQQQ6Q")
+# key, title, author, genre, JSON reviews, and lowercased title, author and genre as (offset, length) into
+# the string table, then total and available copies, rating count, rating sum and the five-star histogram
+RECORD = struct.Struct("=19Id5I")
+LOWERED = 10  # Index in RECORD of the first lowercased field
+GRAM = struct.Struct("=IIII")  # gram (offset, length) into the string table, first posting, posting count
+FIELD_NAMES = ("title", "author", "genre")
+
+
+def _pad(file):
+    file.write(b"\0" * (-file.tell() % 8))
+    return file.tell()
+
+
+def write_catalog_snapshot(path, books):
+    # Writes books (key -> Book) as a snapshot next to path and renames it over path, so processes that
+    # still have the old file mapped keep reading it undisturbed
+    keys = sorted(books)
+    strings, string_offsets = bytearray(), {}
+
+    def intern(text):
+        # Authors and genres repeat across the catalog, so each distinct string is stored once
+        offset = string_offsets.get(text)
+        data = text.encode()
+        if offset is None:
+            offset = string_offsets[text] = len(strings)
+            strings.extend(data)
+        return offset, len(data)
+
+    records = bytearray()
+    postings = {field: {} for field in FIELD_NAMES}  # field -> gram -> array of record numbers
+    for number, key in enumerate(keys):
+        book = books[key]
+        reviews = json.dumps(list(book.reviews)) if book.reviews else ""
+        records += RECORD.pack(*intern(key), *intern(book.title), *intern(book.author), *intern(book.genre),
+                               *intern(reviews), *(value for field in FIELD_NAMES
+                                                   for value in intern(getattr(book, field).lower())),
+                               book.total_copies, book.available_copies, book.rating_count,
+                               book.rating_sum, *book.rating_histogram)
+        for field in FIELD_NAMES:
+            value = getattr(book, field).lower()
+            for size in range(1, GRAM_SIZE + 1):
+                for gram in grams(value, size):
+                    postings[field].setdefault(gram, array('I')).append(number)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(b"\0" * HEADER.size)
+        records_offset = _pad(file)
+        file.write(records)
+        postings_offset = _pad(file)
+        tables, first = [], 0
+        for field in FIELD_NAMES:
+            table = bytearray()
+            for gram in sorted(postings[field], key=str.encode):
+                numbers = postings[field][gram]
+                file.write(numbers.tobytes())
+                table += GRAM.pack(*intern(gram), first, len(numbers))
+                first += len(numbers)
+            tables.append(table)
+        gram_sections = []
+        for table in tables:
+            gram_sections += [_pad(file), len(table) // GRAM.size]
+            file.write(table)
+        strings_offset = _pad(file)
+        file.write(strings)
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, BYTE_ORDER, len(keys), records_offset, postings_offset, strings_offset,
+                               *gram_sections))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+class MappedCatalog(Mapping):
+    # Read-only key -> BookView mapping over a snapshot file. Opening it maps the file and reads the
+    # header, nothing more; lookups binary-search the fixed-width records and searches read the
+    # precomputed gram postings in place, so every process mapping the file shares one copy of it in
+    # the page cache.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, self.count, self.records_offset, self.postings_offset, self.strings_offset, \
+            *gram_sections = HEADER.unpack_from(self.map)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            self.map.close()
+            raise ValueError(f"{path} is not a catalog snapshot written on this kind of machine")
+        self.gram_tables = dict(zip(FIELD_NAMES, zip(gram_sections[::2], gram_sections[1::2])))
+
+    def __getitem__(self, key):
+        number = self.find(key)
+        if number < 0:
+            raise KeyError(key)
+        return BookView(self, number)
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __iter__(self):
+        return self.keys_from()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.map.close()
+
+    def record(self, number):
+        return RECORD.unpack_from(self.map, self.records_offset + number * RECORD.size)
+
+    def string(self, offset, length):
+        start = self.strings_offset + offset
+        return self.map[start:start + length].decode()
+
+    def key_at(self, number):
+        return self.string(*RECORD.unpack_from(self.map, self.records_offset + number * RECORD.size)[:2])
+
+    def find(self, key):
+        # Record number of key, or -1
+        number = self.position(key)
+        return number if number < self.count and self._key_bytes(number) == key.encode() else -1
+
+    def position(self, key):
+        # Record number of the first key not below `key`, i.e. where it is or would be
+        return bisect_left(_Column(self.count, self._key_bytes), key.encode())
+
+    def keys_from(self, after=None):
+        # Keys in order, starting just past `after`
+        number = 0 if after is None else self.position(after)
+        if after is not None and number < self.count and self._key_bytes(number) == after.encode():
+            number += 1
+        for number in range(number, self.count):
+            yield self.key_at(number)
+
+    def search(self, keyword, field):
+        # Record numbers, in key order, of the books whose field contains keyword case-insensitively;
+        # the same matches as search_index.BookIndex
+        keyword = keyword.lower()
+        if not keyword:
+            return range(self.count)
+        if len(keyword) <= GRAM_SIZE:  # Every gram up to GRAM_SIZE is posted, so the postings are the answer
+            return array('I', self._postings(field, keyword))
+
+        # Walk the rarest trigram's postings and binary-search the others, all in the mapped file, then
+        # confirm the whole keyword against the stored lowercase field, as bytes: UTF-8 substrings match
+        # exactly when the strings do
+        postings = sorted((self._postings(field, gram) for gram in grams(keyword, GRAM_SIZE)), key=len)
+        data = keyword.encode()
+        lowered = LOWERED + 2 * FIELD_NAMES.index(field)
+        matches = array('I')
+        for number in postings[0]:
+            if all(_contains(numbers, number) for numbers in postings[1:]):
+                offset, length = self.record(number)[lowered:lowered + 2]
+                start = self.strings_offset + offset
+                if self.map.find(data, start, start + length) >= 0:
+                    matches.append(number)
+        return matches
+
+    def _key_bytes(self, number):
+        offset, length = RECORD.unpack_from(self.map, self.records_offset + number * RECORD.size)[:2]
+        start = self.strings_offset + offset
+        return self.map[start:start + length]
+
+    def _postings(self, field, gram):
+        # The gram's record numbers as a uint32 view of the mapped file; empty if the gram never occurs
+        table_offset, table_count = self.gram_tables[field]
+        data = gram.encode()
+
+        def gram_bytes(index):
+            offset, length = GRAM.unpack_from(self.map, table_offset + index * GRAM.size)[:2]
+            start = self.strings_offset + offset
+            return self.map[start:start + length]
+
+        index = bisect_left(_Column(table_count, gram_bytes), data)
+        if index == table_count or gram_bytes(index) != data:
+            return ()
+        first, count = GRAM.unpack_from(self.map, table_offset + index * GRAM.size)[2:]
+        start = self.postings_offset + first * 4
+        return memoryview(self.map)[start:start + count * 4].cast('I')
+
+
+class BookViews(Sequence):
+    # Search results as record numbers, each turned into a BookView only when it is read, so a query
+    # matching most of the catalog doesn't build an object per book up front. counts maps record numbers
+    # to copy counts that have changed since the file was written. Marked lazy so QueryCache leaves it be.
+    lazy = True
+
+    def __init__(self, catalog, numbers, counts=None):
+        self.catalog = catalog
+        self.numbers = numbers
+        self.counts = counts or {}
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [BookView(self.catalog, number, self.counts.get(number)) for number in self.numbers[index]]
+        number = self.numbers[index]
+        return BookView(self.catalog, number, self.counts.get(number))
+
+
+class _Column:
+    # Sequence of item(i) for i < length, for bisect over records without reading them all
+    def __init__(self, length, item):
+        self.length = length
+        self.item = item
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.item(index)
+
+
+def _contains(numbers, number):
+    index = bisect_left(numbers, number)
+    return index < len(numbers) and numbers[index] == number
+
+
+def _field(index, decode, mutable=False):
+    # A Book attribute read from the record on access; assigned values, and mutable ones once read, are
+    # kept on the view
+    def get(self):
+        if self._changes is not None and index in self._changes:
+            return self._changes[index]
+        value = decode(self._catalog, self._catalog.record(self._number))
+        if mutable:
+            self._changed()[index] = value
+        return value
+
+    def set(self, value):
+        self._changed()[index] = value
+    return property(get, set)
+
+
+class BookView:
+    # A Book read straight from its record in the mapped file: fields are decoded when they are read,
+    # and assignments (add_rating, a copy count) are kept on the view instead of the read-only file,
+    # so a view can stand in for a Book anywhere, including MappedStorage.put_book
+    __slots__ = ("_catalog", "_number", "_changes")
+
+    def __init__(self, catalog, number, counts=None):
+        # counts, if given, is (total_copies, available_copies) to use instead of the record's
+        self._catalog = catalog
+        self._number = number
+        self._changes = None if counts is None else {4: counts[0], 5: counts[1]}
+
+    title = _field(0, lambda catalog, record: catalog.string(record[2], record[3]))
+    author = _field(1, lambda catalog, record: catalog.string(record[4], record[5]))
+    genre = _field(2, lambda catalog, record: catalog.string(record[6], record[7]))
+    reviews = _field(3, lambda catalog, record: json.loads(catalog.string(record[8], record[9]) or "[]"), mutable=True)
+    total_copies = _field(4, lambda catalog, record: record[16])
+    available_copies = _field(5, lambda catalog, record: record[17])
+    rating_count = _field(6, lambda catalog, record: record[18])
+    rating_sum = _field(7, lambda catalog, record: record[19])
+    rating_histogram = _field(8, lambda catalog, record: array('I', record[20:25]), mutable=True)
+
+    @property
+    def rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+    def bayesian_rating(self, prior_mean=ratings.PRIOR_MEAN, prior_weight=ratings.PRIOR_WEIGHT):
+        return ratings.bayesian_average(self.rating_sum, self.rating_count, prior_mean, prior_weight)
+
+    def display_info(self):
+        Book.display_info(self)
+
+    def add_review(self, review):
+        Book.add_review(self, review)
+
+    def add_rating(self, rating):
+        Book.add_rating(self, rating)
+
+    def record_rating(self, rating):
+        Book.record_rating(self, rating)
+
+    def _changed(self):
+        if self._changes is None:
+            self._changes = {}
+        return self._changes
@@ -0,0 +1,236 @@
+import heapq
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+
+LENT = 1  # Same value as library.LogAction.LENT; only lends count towards popularity
+BUCKET_SECONDS = 24 * 3600
+
+
+class Segment:
+    # Events rolled out of the hot columns, stored as one zlib-compressed block of the four columns
+    __slots__ = ("start", "end", "count", "blob")
+
+    def __init__(self, timestamps, actions, book_ids, user_ids):
+        self.start = timestamps[0]
+        self.end = timestamps[-1]
+        self.count = len(timestamps)
+        self.blob = zlib.compress(b"".join(column.tobytes() for column in (timestamps, book_ids, user_ids, actions)))
+
+    def columns(self):
+        raw = zlib.decompress(self.blob)
+        columns, offset = [], 0
+        for typecode in ("d", "I", "I", "B"):
+            column = array(typecode)
+            size = self.count * column.itemsize
+            column.frombytes(raw[offset:offset + size])
+            columns.append(column)
+            offset += size
+        return columns
+
+
+class CirculationLog:
+    # Append-only lend/return events in parallel arrays, with book keys, usernames and genres stored once in
+    # lookup tables. Positions are global and only grow, so the indexes by book, by user and by time bucket
+    # stay valid after old events are rolled into compressed segments. Lend counts per book and per
+    # (bucket, genre) are kept up to date on every append, so popularity queries never walk the events.
+    # Genres are compared case-insensitively. source, if given, returns the (timestamp, book key, username,
+    # genre, action) events already on record, oldest first; they are loaded on first use and after reset().
+    def __init__(self, bucket_seconds=BUCKET_SECONDS, source=None):
+        self.bucket_seconds = bucket_seconds
+        self.source = source
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Forgets every event; with a source they are read back from it on next use
+        with self._lock:
+            self._clear()
+            self.loaded = self.source is None
+
+    def load(self):
+        # Reads the source's events in, once. Call it before a new event reaches whatever the source reads,
+        # or that event would be counted twice.
+        if self.loaded:
+            return
+        with self._lock:
+            if not self.loaded:
+                for timestamp, key, username, genre, action in self.source():
+                    self._append(key, username, genre, action, timestamp)
+                self.loaded = True
+
+    def _clear(self):
+        self.timestamps = array('d')
+        self.actions = array('B')
+        self.book_ids = array('I')
+        self.user_ids = array('I')
+        self.base = 0  # Global position of timestamps[0]; everything before it lives in segments
+        self.segments = []
+        self.segment_starts = []  # Global position of each segment's first event
+        self.books, self.book_table = {}, []  # book key <-> id
+        self.users, self.user_table = {}, []
+        self.genres, self.genre_table = {}, []
+        self.book_genre = array('I')  # book id -> genre id at its first event
+        self.by_book = {}  # book id -> array of positions
+        self.by_user = {}  # user id -> array of positions
+        self.buckets = array('q')  # Every bucket with events, ascending...
+        self.bucket_starts = array('Q')  # ...and the global position of its first event
+        self.lends = {}  # book id -> lends ever
+        self.genre_lends = {}  # genre id -> {book id: lends ever}
+        self.bucket_lends = {}  # bucket -> {genre id: {book id: lends}}
+
+    def record(self, key, username, genre, action, timestamp=None):
+        self.load()
+        with self._lock:
+            self._append(key, username, genre, action, timestamp)
+
+    def _append(self, key, username, genre, action, timestamp):
+        # Events are appended in time order; a timestamp older than the last event is moved up to it
+        timestamp = max(timestamp or time.time(), self.timestamps[-1] if self.timestamps else 0.0)
+        book_id = self._intern(self.books, self.book_table, key)
+        if book_id == len(self.book_genre):
+            self.book_genre.append(self._intern(self.genres, self.genre_table, genre.lower()))
+        user_id = self._intern(self.users, self.user_table, username)
+        position = self.base + len(self.timestamps)
+        self.timestamps.append(timestamp)
+        self.actions.append(action)
+        self.book_ids.append(book_id)
+        self.user_ids.append(user_id)
+        self.by_book.setdefault(book_id, array('I')).append(position)
+        self.by_user.setdefault(user_id, array('I')).append(position)
+        bucket = int(timestamp // self.bucket_seconds)
+        if not self.buckets or self.buckets[-1] != bucket:
+            self.buckets.append(bucket)
+            self.bucket_starts.append(position)
+        if action == LENT:
+            self.lends[book_id] = self.lends.get(book_id, 0) + 1
+            counts = self.genre_lends.setdefault(self.book_genre[book_id], {})
+            counts[book_id] = counts.get(book_id, 0) + 1
+            counts = self.bucket_lends.setdefault(bucket, {}).setdefault(self.book_genre[book_id], {})
+            counts[book_id] = counts.get(book_id, 0) + 1
+
+    def __len__(self):
+        self.load()
+        return self.base + len(self.timestamps)
+
+    def most_borrowed(self, n=10, genre=None, since=None):
+        # [(book key, lends)] from the materialized counters: whole days come from the per-bucket totals and
+        # only the partial day at `since` is counted event by event
+        self.load()
+        with self._lock:
+            genre_id = self.genres.get(genre.lower()) if genre is not None else None
+            if genre is not None and genre_id is None:
+                return []
+            if since is None:
+                counts = self.lends if genre_id is None else self.genre_lends.get(genre_id, {})
+            else:
+                counts = {}
+                first_bucket = int(since // self.bucket_seconds)
+                for bucket, by_genre in self.bucket_lends.items():
+                    if bucket <= first_bucket:
+                        continue
+                    for book_genre, books in by_genre.items():
+                        if genre_id is None or book_genre == genre_id:
+                            for book_id, lends in books.items():
+                                counts[book_id] = counts.get(book_id, 0) + lends
+                cache = {}
+                for position in range(self._position_at(since), self._bucket_start(first_bucket + 1)):
+                    _, action, book_id, _ = self._event(position, cache)
+                    if action == LENT and (genre_id is None or self.book_genre[book_id] == genre_id):
+                        counts[book_id] = counts.get(book_id, 0) + 1
+            top = heapq.nlargest(n, counts.items(), key=lambda item: item[1])
+            return [(self.book_table[book_id], lends) for book_id, lends in top]
+
+    def circulation_by_genre(self, since=None):
+        # {lowercased genre: lends} since the start of the bucket holding `since` (or ever)
+        first_bucket = int(since // self.bucket_seconds) if since is not None else None
+        totals = {}
+        self.load()
+        with self._lock:
+            for bucket, by_genre in self.bucket_lends.items():
+                if first_bucket is None or bucket >= first_bucket:
+                    for genre_id, books in by_genre.items():
+                        genre = self.genre_table[genre_id]
+                        totals[genre] = totals.get(genre, 0) + sum(books.values())
+        return totals
+
+    def book_history(self, key, since=None, until=None):
+        self.load()
+        with self._lock:
+            book_id = self.books.get(key)
+            return [] if book_id is None else self._events(self.by_book.get(book_id, ()), since, until)
+
+    def user_history(self, username, since=None, until=None):
+        # [(timestamp, action, book key, username)] for one user, oldest first
+        self.load()
+        with self._lock:
+            user_id = self.users.get(username)
+            return [] if user_id is None else self._events(self.by_user.get(user_id, ()), since, until)
+
+    def events_between(self, since, until=None):
+        # Every event in [since, until), found through the time-bucket index rather than a scan from the start
+        self.load()
+        with self._lock:
+            start = self._position_at(since)
+            end = self._position_at(until) if until is not None else len(self)
+            return self._events(range(start, end), None, None)
+
+    def roll_segment(self, before):
+        # Compresses every hot event older than `before` into a segment; returns how many were rolled
+        self.load()
+        with self._lock:
+            cut = bisect_left(self.timestamps, before)
+            if cut == 0:
+                return 0
+            self.segment_starts.append(self.base)
+            self.segments.append(Segment(self.timestamps[:cut], self.actions[:cut], self.book_ids[:cut], self.user_ids[:cut]))
+            for column in (self.timestamps, self.actions, self.book_ids, self.user_ids):
+                del column[:cut]
+            self.base += cut
+            return cut
+
+    def _intern(self, ids, table, value):
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(table)
+            table.append(value)
+        return value_id
+
+    def _bucket_start(self, bucket):
+        # Global position of the first event in `bucket` or any later one
+        index = bisect_left(self.buckets, bucket)
+        return self.bucket_starts[index] if index < len(self.buckets) else len(self)
+
+    def _position_at(self, timestamp):
+        # First global position at or after timestamp: jump to its bucket, then search within it
+        position, cache = self._bucket_start(int(timestamp // self.bucket_seconds)), {}
+        if position >= self.base:
+            return self.base + bisect_left(self.timestamps, timestamp, position - self.base)
+        while position < len(self) and self._event(position, cache)[0] < timestamp:
+            position += 1
+        return position
+
+    def _event(self, position, cache):
+        if position >= self.base:
+            index = position - self.base
+            return self.timestamps[index], self.actions[index], self.book_ids[index], self.user_ids[index]
+        number = bisect_right(self.segment_starts, position) - 1
+        columns = cache.get(number)
+        if columns is None:  # Decompressed once per query, however many of its events are read
+            columns = cache[number] = self.segments[number].columns()
+        index = position - self.segment_starts[number]
+        return columns[0][index], columns[3][index], columns[1][index], columns[2][index]
+
+    def _events(self, positions, since, until):
+        # Positions are ascending and so are timestamps, so the range is cut down by binary search first
+        if since is not None:
+            positions = positions[bisect_left(positions, self._position_at(since)):]
+        if until is not None:
+            positions = positions[:bisect_left(positions, self._position_at(until))]
+        cache, events = {}, []
+        for position in positions:
+            timestamp, action, book_id, user_id = self._event(position, cache)
+            events.append((timestamp, action, self.book_table[book_id], self.user_table[user_id]))
+        return events
@@ -0,0 +1,173 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+import backup
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+JOURNAL_PATTERN = re.compile(r"journal-(\d+)\.jsonl$")
+
+
+def journal_files(directory):
+    # [(generation, path)] oldest first
+    files = []
+    for path in glob.glob(os.path.join(directory, "journal-*.jsonl")):
+        match = JOURNAL_PATTERN.search(path)
+        if match:
+            files.append((int(match.group(1)), path))
+    return sorted(files)
+
+
+def read_journal(path):
+    # Records in the order they were committed; a line cut short by a crash ends the journal
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.endswith("\n"):
+                return
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+
+
+def recovery_records(directory):
+    # The latest checkpoint snapshot followed by every journal written since it, as one record stream
+    snapshot = os.path.join(directory, SNAPSHOT_FILE)
+    first_generation = 0
+    if os.path.exists(snapshot):
+        records = backup.read_records(snapshot)
+        header = next(records, {})
+        first_generation = header.get("journal_generation", 0)
+        yield from records
+    for generation, path in journal_files(directory):
+        if generation >= first_generation:
+            yield from read_journal(path)
+
+
+class Journal:
+    # Write-ahead journal of backup-format records (book, user and loan upserts and tombstones), one JSON
+    # line each. log() only queues; a writer thread waits commit_interval for more records to arrive, then
+    # writes and fsyncs the whole group at once, so a crash loses at most one commit window.
+    # Checkpoints rotate to a new journal generation, write a snapshot that names it, and delete the
+    # generations the snapshot covers.
+    def __init__(self, directory, snapshot, commit_interval=None, checkpoint_interval=None, checkpoint_records=None):
+        # snapshot(journal_generation) returns the snapshot records for a checkpoint
+        self.directory = directory
+        self.snapshot = snapshot
+        self.commit_interval = commit_interval or float(os.getenv("JOURNAL_COMMIT_MS", 10)) / 1000
+        self.checkpoint_interval = checkpoint_interval or float(os.getenv("JOURNAL_CHECKPOINT_SECONDS", 300))
+        self.checkpoint_records = checkpoint_records or int(os.getenv("JOURNAL_CHECKPOINT_RECORDS", 100000))
+        os.makedirs(directory, exist_ok=True)
+        existing = journal_files(directory)
+        self.generation = existing[-1][0] + 1 if existing else 1
+        self.file = open(self._path(self.generation), 'a')
+        self.pending = []
+        self.sequence = 0  # Records queued so far...
+        self.synced = 0  # ...and how many of them are on disk
+        self.since_checkpoint = 0
+        self.closed = False
+        self._lock = threading.Condition()
+        self._write_lock = threading.Lock()  # Held while a group is written, so rotation never splits one
+        self._checkpoint_lock = threading.Lock()
+        self._wake_checkpoint = threading.Event()
+        self.writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self.checkpointer = threading.Thread(target=self._checkpoint_loop, name="journal-checkpoint", daemon=True)
+        self.writer.start()
+        self.checkpointer.start()
+
+    def log(self, build):
+        # build() returns the records for a change that has just been applied. It is called under the
+        # journal lock, so records are queued in the order their state was read: the last record for a
+        # key always holds its latest state. Returns a sequence number for wait().
+        with self._lock:
+            if self.closed:
+                return self.sequence
+            for record in build():
+                self.pending.append(json.dumps(record, separators=(',', ':')))
+                self.sequence += 1
+            self._lock.notify_all()
+            return self.sequence
+
+    def wait(self, sequence=None, timeout=None):
+        # Blocks until the record with this sequence number (default: everything logged so far) is on disk
+        with self._lock:
+            sequence = self.sequence if sequence is None else sequence
+            return self._lock.wait_for(lambda: self.synced >= sequence or self.closed, timeout)
+
+    def checkpoint(self):
+        with self._checkpoint_lock:
+            previous = self._rotate()
+            backup.write_snapshot(os.path.join(self.directory, SNAPSHOT_FILE), self.snapshot(self.generation))
+            for generation, path in journal_files(self.directory):
+                if generation <= previous:
+                    os.remove(path)
+
+    def close(self):
+        # Writes whatever is still queued, then stops both threads
+        with self._lock:
+            self.closed = True
+            self._lock.notify_all()
+        self._wake_checkpoint.set()
+        self.writer.join()
+        self.checkpointer.join()
+        self.file.close()
+
+    def _path(self, generation):
+        return os.path.join(self.directory, f"journal-{generation:08d}.jsonl")
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self.pending or self.closed)
+                if self.closed and not self.pending:
+                    return
+            if not self.closed:
+                time.sleep(self.commit_interval)  # Let the rest of the group arrive
+            self._write_group()
+
+    def _write_group(self):
+        with self._write_lock:
+            with self._lock:
+                batch, self.pending = self.pending, []
+                sequence = self.sequence
+            if batch:
+                self.file.write("\n".join(batch) + "\n")
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            with self._lock:
+                self.synced = max(self.synced, sequence)
+                self.since_checkpoint += len(batch)
+                self._lock.notify_all()
+                if self.since_checkpoint >= self.checkpoint_records:
+                    self._wake_checkpoint.set()
+
+    def _rotate(self):
+        # Finishes the current generation and starts the next; returns the finished one
+        with self._write_lock:
+            with self._lock:
+                batch, self.pending = self.pending, []
+                sequence = self.sequence
+                previous = self.generation
+                self.generation += 1
+                self.since_checkpoint = 0
+            if batch:
+                self.file.write("\n".join(batch) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = open(self._path(self.generation), 'a')
+            with self._lock:
+                self.synced = max(self.synced, sequence)
+                self._lock.notify_all()
+        return previous
+
+    def _checkpoint_loop(self):
+        while not self.closed:
+            self._wake_checkpoint.wait(self.checkpoint_interval)
+            self._wake_checkpoint.clear()
+            if not self.closed and (self.since_checkpoint or self.synced < self.sequence):
+                self.checkpoint()
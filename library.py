@@ -1,11 +1,25 @@
 from getpass import getpass
-import bcrypt
+import copy
 import json
-import random
-import string
-from datetime import datetime, timedelta
+import os
+from datetime import datetime
 import re
-from utils import send_email
+import sys
+import time
+from array import array
+from itertools import islice
+from utils import get_mail_dispatcher, load_env
+from auth import get_auth_engine
+from throttle import get_login_throttle
+from storage import MappedStorage, MemoryStorage, SqliteStorage, StripedLocks
+import backup
+from loans import OVERDUE
+from circulation import CirculationLog
+from journal import Journal, SNAPSHOT_FILE, journal_files, recovery_records
+from metrics import get_metrics, instrumented
+from models import Book, BorrowedLog, LogAction, User
+from query_cache import QueryCache
+import catalog_io
 
 
 
@@ -20,124 +34,58 @@ def is_float(element: any) -> bool:
     except ValueError:
         return False
        
-class Book:
-    def __init__(self, title, author, genre, total_copies=1):
-        self.title = title
-        self.author = author
-        self.genre = genre
-        self.total_copies = total_copies
-        self.available_copies = total_copies
-        self.reviews = []
-        self.rating = 0
-
-    def display_info(self):
-        print(f"Title: {self.title}\nAuthor: {self.author}\nGenre: {self.genre}\n"
-              f"Total Copies: {self.total_copies}\nAvailable Copies: {self.available_copies}\n"
-              f"Rating: {self.rating:.2f}\nReviews: {', '.join(map(str, self.reviews))}\n")
-
-    def add_review(self, review):
-        self.reviews.append(review)
-        print("Review added. Thank you!\n")
-
-    def add_rating(self, rating):
-        if isinstance(rating, (int, float)) and 1.0 <= rating <= 5.0:
-            self.reviews.append(rating)
-            self.rating = sum(self.reviews) / len(self.reviews)
-            print(f"Rating of {rating} added. Thank you!\n")
-        else:
-            print("Invalid rating. Please enter a number between 1 and 5.")
-
-class User:
-    def __init__(self, username, hashed_password, security_questions=None, security_answers=None, email=None):
-        self.username = username
-        self.hashed_password = hashed_password
-        self.security_questions = security_questions or []
-        self.security_answers = dict(zip(security_questions, security_answers)) if security_questions and security_answers else {}
-        self.email = email
-        self.reset_code = None
-        self.reset_code_expiry = None
-        self.borrowed_log = []
-        self.wrong_attempts = 0
-        self.cooldown_end_time = None
-
-    def display_borrowed_log(self):
-        print(f"{self.username}'s Borrowed Books Log:")
-        for log in self.borrowed_log:
-            print(f"- {log}")
-
-    def verify_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.hashed_password)
-
-    def generate_reset_code(self):
-        self.reset_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        self.reset_code_expiry = datetime.now() + timedelta(minutes=15)
-
-
-    def change_password(self, current_password, new_password):
-        if self.verify_password(current_password):
-            self.hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-            print(f"Password for user '{self.username}' has been changed.\n")
-        else:
-            print("Current password is incorrect. Password change failed.\n")
-
-    def reset_password(self, new_password):
-        self.hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-        self.reset_code = None
-        self.reset_code_expiry = None
-        print(f"Password for user '{self.username}' has been updated.\n")
-
-    def initiate_password_reset(self):
-        if self.email:
-            self.generate_reset_code()
-            self.send_reset_email()
-            print(f"Password reset initiated. Check your email for instructions.\n")
-        else:
-            print(f"User '{self.username}' does not have a registered email.\n")
-
-    def send_reset_email(self):
-        # For simplicity, print the reset code in the console
-        send_email()
-        print(f"Reset code for {self.username}: {self.reset_code}")
-
-
-    def initiate_password_reset_security_questions(self):
-        if self.security_questions and self.security_answers:
-            self.verify_identity_and_reset_password()
-        else:
-            print(f"Security questions are not set for user '{self.username}'. Password reset failed.\n")
-
-    def verify_identity_and_reset_password(self):
-        if not self.security_questions or not self.security_answers:
-            print(f"Security questions are not set for user '{self.username}'. Password reset failed.\n")
-            return
-
-        shuffled_questions = list(self.security_questions)
-        random.shuffle(shuffled_questions)
-
-        print("Answer the following security questions to verify your identity:")
-        for i, question in enumerate(shuffled_questions, 1):
-            answer = input(f"{i}. {question}: ")
-            original_answer = self.security_answers.get(question, "")
-            if answer.lower() != original_answer.lower():
-                print("Incorrect answer. Password reset failed.\n")
-                return
-
-        new_password = getpass("Enter a new password for your account: ")
-        self.reset_password(new_password)
-
 class Library:
-    def __init__(self):
-        self.books = {}
-        self.users = {}
+    def __init__(self, storage=None):
+        # storage holds the books and users; MemoryStorage keeps them in dicts, SqliteStorage in a database file
+        self.storage = storage or MemoryStorage()
         self.logged_in_user = None
-
+        self.auth = get_auth_engine()
+        self.throttle = get_login_throttle()
+        # Keys changed since the last backup, so incremental backups only append those records
+        self.dirty_books = set()
+        self.dirty_users = set()
+        self.dirty_loans = set()
+        self.dirty_holds = set()
+        self.backup_state = {"file": None, "appended": 0}
+        self.journal = None  # Write-ahead journal, once open_journal() has been called
+        self.locks = StripedLocks()  # Serializes borrow-log updates per user across sessions
+        self.reservations = self.storage.reservations()  # Waitlists and copies held for the next user in line
+        self.loans = self.storage.loan_ledger()  # Who holds which copy and when it is due
+        # Every lend and return, indexed for history and popularity queries; rebuilt from the borrowed logs on first use
+        self.circulation = CirculationLog(source=self.circulation_events)
+        self.query_cache = QueryCache(live_books=self.storage.live_books)  # Search and listing results, refreshed as books change
+
+    def open_session(self):
+        # A session shares the catalog, users and indexes with this library but has its own logged-in user,
+        # so many users can be served at once from threads or asyncio tasks
+        session = copy.copy(self)
+        session.logged_in_user = None
+        return session
+
+    @property
+    def books(self):
+        return self.storage.books
+
+    @property
+    def users(self):
+        return self.storage.users
 
     def delete_account(self):
         if self.logged_in_user:
+            open_loans = self.loans.for_user(self.logged_in_user.username)
+            if open_loans:  # Their copies would never come back to the shelf
+                print(f"You still have {len(open_loans)} borrowed books. Return them before deleting your account.\n")
+                return
             confirm_choice = input("Are you sure you want to delete your account? (yes/no): ").lower()
             if confirm_choice == "yes":
                 deleted_username = self.logged_in_user.username  # Store the username before deleting the user
-                del self.users[deleted_username]
+                self.storage.delete_user(deleted_username)
+                released = self.reservations.cancel_user(deleted_username)
+                self._changed(users=[deleted_username], holds=[(key, deleted_username) for key in released])
+                for key in released:  # Copies held for them go to the next user waiting or back on the shelf
+                    if self.storage.adjust_copies(key, 1):
+                        self._changed(books=[key])
+                        self.offer_to_waitlist(key)
                 self.logout()
                 print(f"Account for user '{deleted_username}' has been deleted.\n")
             else:
@@ -154,7 +102,7 @@ class Library:
             confirm_password = getpass("Confirm password for the new account: ")
 
             if password == confirm_password:
-                hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+                hashed_password = self.auth.hash_password(password)
 
                 # Set up security questions
                 print("Set up security questions:")
@@ -165,13 +113,15 @@ class Library:
                 ]
                 answers = [getpass(f"{question}: ") for question in questions]  # Collect user's answers to security questions securely using getpass
 
-                self.users[username] = User(username, hashed_password, questions, answers, email)  # Create a new user with the provided username, hashed password, and security question answers
+                self.storage.put_user(username, User(username, hashed_password, questions, answers, email))  # Create a new user with the provided username, hashed password, and security question answers
+                self._changed(users=[username])
                 print(f"User '{username}' has been created with security questions.\n")
             else:
                 print("Passwords do not match. Please try again.\n")
         else:
             print(f"User '{username}' already exists. Please choose a different username.\n")
 
+    @instrumented("password_reset")
     def initiate_password_reset_email(self, username):
         user = self.users.get(username)
         if user and user.email:
@@ -195,62 +145,174 @@ class Library:
                 self.initiate_password_reset_email(username)
             elif recovery_choice == "2" and user.security_questions and user.security_answers:
                 self.initiate_password_reset_security_questions(username)
+                self.storage.put_user(username, user)
+                self._changed(users=[username])
             else:
                 print("Invalid recovery option or not enough information. Password reset failed.\n")
         else:
             print(f"User '{username}' not found. Please enter a valid username.\n")
 
-    def login(self, username, password):
+    @instrumented("login")
+    def login(self, username, password, source="local"):
+        # source identifies the client (e.g. its address) for per-source rate limits
+        if self._throttled(username, source):
+            return None
+
         user = self.users.get(username)
-        
-        # Check if the user is in cooldown period
-        if user and user.cooldown_end_time and datetime.now() < user.cooldown_end_time:
-            print(f"Account is in cooldown. Please try again after {int((user.cooldown_end_time - datetime.now()).total_seconds())} seconds.\n")
+        verified = user is not None and self.auth.check_password(password, user.hashed_password)
+        return self._complete_login(username, user, verified)
+
+    @instrumented("login")
+    async def login_async(self, username, password, source="local"):
+        # Same as login, but the bcrypt check is awaited so many logins can be verified in parallel
+        if self._throttled(username, source):
             return None
 
-        if user and bcrypt.checkpw(password.encode('utf-8'), user.hashed_password):
-            user.wrong_attempts = 0  # Reset wrong attempts upon successful login
+        user = self.users.get(username)
+        verified = user is not None and await self.auth.check_password_async(password, user.hashed_password)
+        return self._complete_login(username, user, verified)
+
+    def _throttled(self, username, source):
+        # Locked-out and rate-limited attempts are turned away here, before the user lookup and before bcrypt
+        rejection = self.throttle.check(username, source)
+        if rejection is None:
+            return False
+        reason, wait = rejection
+        if reason == "cooldown":
+            get_metrics().increment("login_cooldown_rejected")
+            print(f"Account is in cooldown. Please try again after {int(wait) + 1} seconds.\n")
+        else:
+            get_metrics().increment("login_rate_limited")
+            print(f"Too many login attempts. Please try again after {int(wait) + 1} seconds.\n")
+        return True
+
+    def _complete_login(self, username, user, verified):
+        if verified:
+            self.throttle.record_success(username)  # Reset wrong attempts upon successful login
+            get_metrics().increment("login_succeeded")
             self.logged_in_user = user
             print(f"User '{username}' has been logged in.\n")
             return user
         else:
-            if user:
-                user.wrong_attempts += 1
-                print("Invalid username or password. Please try again.\n")
-
-                # Check if the user has reached the maximum wrong attempts
-                if user.wrong_attempts >= 3:
-                    cooldown_duration = 60  # 1 minute cooldown
-                    user.cooldown_end_time = datetime.now() + timedelta(seconds=cooldown_duration)
-                    print(f"Too many wrong attempts. Account is now in cooldown for {cooldown_duration} seconds.\n")
-            else:
-                print("Invalid username or password. Please try again.\n")
-
+            get_metrics().increment("login_failed")
+            print("Invalid username or password. Please try again.\n")
+            # Unknown usernames count failures too, so probing for names gets locked out like guessing passwords
+            locked_until = self.throttle.record_failure(username)
+            if locked_until:
+                get_metrics().increment("login_lockouts")
+                print(f"Too many wrong attempts. Account is now in cooldown for {int(locked_until - time.time() + 0.5)} seconds.\n")
             return None
 
     def logout(self):
         self.logged_in_user = None
         print("User has been logged out.\n")
 
+    def change_password(self, current_password, new_password):
+        if self.logged_in_user:
+            self.logged_in_user.change_password(current_password, new_password)
+            self.storage.put_user(self.logged_in_user.username, self.logged_in_user)
+            self._changed(users=[self.logged_in_user.username])
+        else:
+            print("Please log in first.\n")
+
     def add_book(self, title, author, genre, total_copies=1):
         if self.logged_in_user and self.logged_in_user.username == "admin":
             existing_book = self.books.get(title.lower())
             if existing_book:
-                existing_book.total_copies += total_copies
-                existing_book.available_copies += total_copies
+                self.storage.adjust_copies(title.lower(), total_copies, total_copies)
+                self._changed(books=[title.lower()])
+                self.offer_copies(title.lower(), total_copies)
                 print(f"Additional copies of '{title}' added to the library.\n")
             else:
                 new_book = Book(title, author, genre, total_copies)
-                self.books[title.lower()] = new_book
+                self.storage.put_book(title.lower(), new_book)
+                self.query_cache.invalidate()
+                self._changed(books=[title.lower()])
                 print(f"Book '{title}' added to the library.\n")
         else:
             print("Only admin can add books. Please log in as admin.\n")
 
+    def import_books(self, rows, chunk_size=10000):
+        # Bulk version of add_book for publisher feeds: rows are dicts with title, author, genre and optionally
+        # total_copies, committed to storage a chunk at a time. Rows that can't be read are skipped and reported.
+        if not (self.logged_in_user and self.logged_in_user.username == "admin"):
+            print("Only admin can add books. Please log in as admin.\n")
+            return 0
+
+        start = time.perf_counter()
+        total = added = merged = skipped = 0
+        first_error = None
+        chunk = {}
+        for number, row in enumerate(rows, 1):
+            try:
+                title, author, genre, total_copies = catalog_io.book_fields(row)
+            except ValueError as e:
+                skipped += 1
+                first_error = first_error or f"row {number}: {e}"
+                continue
+            key = title.lower()
+            if key in chunk:  # Duplicates within a chunk are merged before they reach storage
+                chunk[key].total_copies += total_copies
+                chunk[key].available_copies += total_copies
+                merged += 1
+            else:
+                chunk[key] = Book(title, author, genre, total_copies)
+            total += 1
+            if len(chunk) >= chunk_size:
+                added, merged = self._import_chunk(chunk, added, merged)
+                chunk = {}
+        if chunk:
+            added, merged = self._import_chunk(chunk, added, merged)
+
+        elapsed = time.perf_counter() - start
+        print(f"Imported {total} rows ({added} new books, {merged} merged into existing titles) "
+              f"in {elapsed:.2f}s, {total / elapsed if elapsed else 0:.0f} rows/s.")
+        if skipped:
+            print(f"Skipped {skipped} invalid rows (first at {first_error}).")
+        print()
+        return total
+
+    def _import_chunk(self, chunk, added, merged):
+        chunk_added, chunk_merged = self.storage.import_books(list(chunk.items()))
+        self.query_cache.invalidate()
+        self._changed(books=chunk)
+        for key in self.reservations.waiting_books() & chunk.keys():
+            self.offer_copies(key, chunk[key].total_copies)
+        return added + chunk_added, merged + chunk_merged
+
+    def import_books_file(self, filename, file_format=None):
+        # file_format is "csv" or "jsonl"; by default it is taken from the file extension
+        reader = catalog_io.READERS[file_format or catalog_io.detect_format(filename)]
+        try:
+            return self.import_books(reader(filename))
+        except FileNotFoundError:
+            print(f"No file '{filename}' found.\n")
+        except catalog_io.READ_ERRORS as e:
+            # Chunks read before the error stay imported
+            print(f"Could not read '{filename}': {e}\n")
+        return 0
+
+    def export_books(self, filename, file_format=None):
+        # Streams the catalog out in title order, a page at a time
+        writer = catalog_io.WRITERS[file_format or catalog_io.detect_format(filename)]
+        start = time.perf_counter()
+        total = writer(filename, self.iter_books(page_size=1000))
+        elapsed = time.perf_counter() - start
+        print(f"Exported {total} books to {filename} in {elapsed:.2f}s, {total / elapsed if elapsed else 0:.0f} rows/s.\n")
+        return total
+
     def delete_book(self, title):
         if self.logged_in_user and self.logged_in_user.username == "admin":
             existing_book = self.books.get(title.lower())
             if existing_book:
-                del self.books[title.lower()]
+                self.storage.delete_book(title.lower())
+                self.query_cache.invalidate()
+                self._changed(books=[title.lower()], loans=self.loans.drop_book(title.lower()))
+                cancelled = self.reservations.drop(title.lower())
+                self._changed(holds=[(title.lower(), username) for username in cancelled])
+                for username in cancelled:
+                    self.notify_user(username, f"Reservation cancelled: '{existing_book.title}'",
+                                     f"'{existing_book.title}' has been removed from the library, so your reservation was cancelled.")
                 print(f"Book '{title}' has been deleted from the library.\n")
             else:
                 print(f"Book with title '{title}' not found.\n")
@@ -258,129 +320,505 @@ class Library:
             print("Only admin can delete books. Please log in as admin.\n")
 
 
-    def display_books(self):
-        sorted_books = sorted(self.books.values(), key=lambda x: x.title.lower())
+    def list_books(self, offset=0, limit=20, after=None):
+        # One page of the catalog in alphabetical order; pass the last title.lower() seen as `after` to page by cursor
+        return self.query_cache.get(("list", offset, limit, after), lambda: self.storage.list_books(offset, limit, after),
+                                    self.storage.data_version())
+
+    def iter_books(self, page_size=100):
+        # Walks the whole catalog in alphabetical order one page at a time, past the query cache so a full
+        # walk doesn't evict the pages people keep asking for
+        after = None
+        while True:
+            page = self.storage.list_books(limit=page_size, after=after)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1].title.lower()
+
+    def display_books(self, offset=0, limit=None):
+        # Without a limit the rest of the catalog is printed, fetched a page at a time
+        books = islice(self.iter_books(), offset, None) if limit is None else self.list_books(offset, limit)
         print("Library Books (Alphabetical Order):")
-        for book in sorted_books:
+        for book in books:
             print(f"Title: {book.title}\nAuthor: {book.author}\nGenre: {book.genre}\n"
                   f"Total Copies: {book.total_copies}\nAvailable Copies: {book.available_copies}\n"
                  f"Rating: {book.rating}\nReviews: {', '.join(map(str, book.reviews))}\n")
 
 
+    @instrumented("lend")
     def lend_book(self, title):
         if self.logged_in_user:
+            self.expire_reservations()
             existing_book = self.books.get(title.lower())
-            if existing_book and existing_book.available_copies > 0:
-                existing_book.available_copies -= 1
-                self.logged_in_user.borrowed_log.append(f"Lent '{existing_book.title}'")  # Logs the lending of the book with the specified title in the user's borrowing history.
-                print(f"Book '{existing_book.title}' has been lent to {self.logged_in_user.username}.\n")
+            self.circulation.load()  # Before the lend is in borrowed_log, which the first load reads
+            # On SQLite the copy, the borrow log and the loan are committed together
+            with self.storage.atomic():
+                # A copy held for this user was already taken out of available_copies when the hold was placed;
+                # otherwise adjust_copies decrements only if a copy is left, as one atomic step in the storage backend
+                claimed = existing_book and self.reservations.claim(title.lower(), self.logged_in_user.username)
+                lent = existing_book and (claimed or self.storage.adjust_copies(title.lower(), -1))
+                if lent:
+                    with self.locks.get(self.logged_in_user.username):
+                        # Logs the lending of the book with the specified title in the user's borrowing history.
+                        index, entry = self.storage.log_borrow(self.logged_in_user.username, self.logged_in_user,
+                                                               existing_book.title, LogAction.LENT)
+                    loan = self.loans.open(self.logged_in_user.username, title.lower())
+            if lent:
+                self.circulation.record(title.lower(), self.logged_in_user.username, existing_book.genre, LogAction.LENT, loan.lent_at)
+                self._changed(books=[title.lower()], loans=[loan], log_entries=[(self.logged_in_user.username, index, entry)],
+                              holds=[(title.lower(), self.logged_in_user.username)] if claimed else ())
+                print(f"Book '{existing_book.title}' has been lent to {self.logged_in_user.username}. "
+                      f"Due back by {datetime.fromtimestamp(loan.due_at):%Y-%m-%d}.\n")
+                return True
             else:
+                get_metrics().increment("lend_unavailable")
                 print(f"Book with title '{title}' not found or is currently not available.\n")
+                if existing_book:
+                    print("You can reserve it to be notified when a copy comes back.\n")
         else:
             print("Please log in first.\n")
+        return False
+
+    async def lend_book_async(self, title):
+        import asyncio  # Only async callers pay for importing it
+        return await asyncio.to_thread(self.lend_book, title)
 
+    def reserve_book(self, title):
+        if not self.logged_in_user:
+            print("Please log in first.\n")
+            return None
+
+        self.expire_reservations()
+        existing_book = self.books.get(title.lower())
+        if not existing_book:
+            print(f"Book with title '{title}' not found.\n")
+            return None
+        if existing_book.available_copies > 0:
+            print(f"'{existing_book.title}' is available now. Lend it instead of reserving.\n")
+            return None
+
+        position = self.reservations.enqueue(title.lower(), self.logged_in_user.username)
+        if position is None:
+            print(f"You already have a reservation for '{existing_book.title}'.\n")
+        else:
+            print(f"'{existing_book.title}' reserved. You are number {position} in the queue.\n")
+        return position
+
+    def offer_to_waitlist(self, key):
+        # Sets a returned copy aside for the next user in the book's queue and lets them know; True if it did
+        username = self.reservations.next_waiting(key)
+        if username is None:
+            return False
+        if not self.storage.adjust_copies(key, -1):  # Someone lent it first; keep their place for the next copy
+            self.reservations.requeue_front(key, username)
+            return False
+
+        deadline = self.reservations.hold(key, username)
+        book = self.books.get(key)
+        self._changed(books=[key], holds=[(key, username)])
+        self.notify_user(username, f"Your reserved book is ready: '{book.title}'",
+                         f"A copy of '{book.title}' is on hold for you until "
+                         f"{datetime.fromtimestamp(deadline):%Y-%m-%d %H:%M}. Lend it before then to keep it.")
+        return True
+
+    def offer_copies(self, key, copies):
+        # Copies added to the catalog go to the users waiting for the book before they reach the shelf
+        for _ in range(copies):
+            if not self.offer_to_waitlist(key):
+                return
+
+    def expire_reservations(self):
+        # Uncollected holds go back on the shelf, or to the next user waiting for the book
+        for key, username in self.reservations.pop_expired():
+            self._changed(holds=[(key, username)])
+            if self.storage.adjust_copies(key, 1):
+                self._changed(books=[key])
+                self.offer_to_waitlist(key)
+            book = self.books.get(key)
+            self.notify_user(username, "Your reservation expired",
+                             f"Your hold on '{book.title if book else key}' was not collected in time and has been released.")
+
+    def _changed(self, books=(), users=(), loans=(), log_entries=(), holds=()):
+        # Every mutation ends here: the keys are marked for the next incremental backup and, when the journal
+        # is open, their current records are queued for it (a closed loan or deleted key becomes a tombstone).
+        # log_entries are (username, index, borrowed_log entry), journaled on their own rather than as whole users.
+        # holds are (book key, username) pairs whose hold was placed or has ended.
+        self.dirty_books.update(books)
+        self.dirty_users.update(users)
+        self.dirty_users.update(username for username, _, _ in log_entries)
+        self.dirty_loans.update(loan.loan_id for loan in loans)
+        self.dirty_holds.update(holds)
+        for key in books:
+            self.query_cache.refresh(key, lambda key=key: self.books.get(key))
+        if self.journal is not None:
+            self.journal.log(lambda: [*(backup.book_record(key, self.books.get(key)) for key in books),
+                                      *(backup.user_record(username, self.users.get(username)) for username in users),
+                                      *(backup.loan_record(loan.loan_id, self.loans.get(loan.loan_id)) for loan in loans),
+                                      *(backup.borrow_record(username, index, entry) for username, index, entry in log_entries),
+                                      *(backup.hold_record(key, username, self.reservations.deadline(key, username))
+                                        for key, username in holds)])
+
+    def notify_user(self, username, subject, body):
+        # Delivered by the background mail dispatcher, so the caller never waits on SMTP
+        user = self.users.get(username)
+        if user and user.email:
+            get_mail_dispatcher().submit(user.email, subject, body)
+
+    @instrumented("return")
     def return_book(self, title, rating=None, review=None):
         if self.logged_in_user:
             existing_book = self.books.get(title.lower())
-            if existing_book:
-                self.logged_in_user.borrowed_log.append(f"Returned '{existing_book.title}'")
-                print(f"Book '{existing_book.title}' has been returned by {self.logged_in_user.username}.\n")
-
-                if rating is not None:
-                    try:
-                        rating = float(rating)
-                        if 1.0 <= rating <= 5.0:
-                            existing_book.add_rating(rating)
-                        else:
-                            raise ValueError("Invalid rating. Please enter a number between 1 and 5.")
-                    except ValueError as e:
-                        print(str(e))
-                else:
-                    print("No rating provided. Rating skipped.")
-
-                if review:
-                    existing_book.add_review(review)
-                else:
-                    print("No review provided. Review skipped.\n")
-
-                existing_book.available_copies += 1  # Update available copies
+            username = self.logged_in_user.username
+            rating_message = "No rating provided. Rating skipped."
+            if rating is not None:
+                try:
+                    rating = float(rating)
+                    if not 1.0 <= rating <= 5.0:
+                        raise ValueError("Invalid rating. Please enter a number between 1 and 5.")
+                    rating_message = f"Rating of {rating} added. Thank you!\n"
+                except ValueError as e:
+                    rating, rating_message = None, str(e)
+
+            self.circulation.load()
+            # On SQLite closing the loan, the rating and review, the copy back on the shelf and the borrow log
+            # are committed together
+            with self.storage.atomic():
+                # Only an open loan can be returned; otherwise a copy nobody took out would be added to the shelf
+                loan = self.loans.close(username, title.lower()) if existing_book else None
+                if loan is not None:
+                    with self.locks.get(username):
+                        index, entry = self.storage.log_borrow(username, self.logged_in_user, existing_book.title,
+                                                               LogAction.RETURNED)
+                    if rating is not None or review:
+                        # Added by the backend in one step, so concurrent returns don't overwrite each other's
+                        self.storage.add_feedback(title.lower(), rating, review)
+                    self.storage.adjust_copies(title.lower(), 1)  # Update available copies
+
+            if existing_book and loan is None:
+                print(f"You have not borrowed '{existing_book.title}'.\n")
+            elif existing_book:
+                self.circulation.record(title.lower(), username, existing_book.genre, LogAction.RETURNED)
+                print(f"Book '{existing_book.title}' has been returned by {username}.\n")
+                print(rating_message)
+                print("Review added. Thank you!\n" if review else "No review provided. Review skipped.\n")
+                self._changed(books=[title.lower()], loans=[loan], log_entries=[(username, index, entry)])
+                self.offer_to_waitlist(title.lower())
+                return True
             else:
-                print(f"Book with title '{title}' not found or is already available.\n")
+                print(f"Book with title '{title}' not found.\n")
         else:
             print("Please log in first.\n")
+        return False
+
+    async def return_book_async(self, title, rating=None, review=None):
+        import asyncio
+        return await asyncio.to_thread(self.return_book, title, rating, review)
 
 
     def view_borrowed_log(self):
         if self.logged_in_user:
             self.logged_in_user.display_borrowed_log()
+            loans = self.loans.for_user(self.logged_in_user.username)
+            if loans:
+                print("Currently borrowed:")
+            for loan in loans:
+                book = self.books.get(loan.key)
+                late = " (overdue)" if loan.due_at < time.time() else ""
+                print(f"{book.title if book else loan.key} - due {datetime.fromtimestamp(loan.due_at):%Y-%m-%d}{late}")
         else:
             print("Please log in first.\n")
 
-    def search_books(self, keyword, filter_option):
-        filtered_books = []
-
-        for book in self.books.values():
-            match_found = False
-
-            if filter_option == 1:  # Title filter
-                match_found = keyword.lower() in book.title.lower()  # Check if the keyword is present in the book title (case-insensitive)
-            elif filter_option == 2:  # Author filter
-                match_found = keyword.lower() in book.author.lower()
-            elif filter_option == 3:  # Genre filter
-                match_found = keyword.lower() in book.genre.lower()
-
-            if match_found:
-                filtered_books.append(book)
-
-        return filtered_books
-
-    def backup_data(self, filename="library_backup.json"):
-        # Prepare data to be stored in the backup file
-        data = {
-            "books": {title: {"author": book.author, "genre": book.genre, "total_copies": book.total_copies, "available_copies": book.available_copies} for title, book in self.books.items()},
-            "logged_in_user": self.logged_in_user.username if self.logged_in_user else None,
-            "users": {username: {"hashed_password": user.hashed_password, "security_questions": user.security_questions, "security_answers": user.security_answers, "email": user.email} for username, user in self.users.items()},
-        }
-
-        # Convert bytes to a serializable type (e.g., using decode('utf-8'))
-        data = self.convert_bytes_to_serializable(data)
-
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=6)
-        print(f"Data backed up to {filename}.\n")
-
-    def convert_bytes_to_serializable(self, data):
-        for key, value in data.items():
-            if isinstance(value, bytes):
-                # Convert bytes to a string or another serializable type
-                data[key] = value.decode('utf-8')
-            elif isinstance(value, dict):
-                # Recursively handle nested dictionaries
-                data[key] = self.convert_bytes_to_serializable(value)
-        return data
-
-
-    def restore_data(self, filename="library_backup.json"):
-        try:
-            with open(filename, 'r') as file:  # Attempt to open and read the backup file
-                data = json.load(file)  # Load data from the backup file as a JSON object
-
-            self.books = {title: Book(title, book["author"], book["genre"], book["total_copies"])  # Restore books from the backup data
-                          for title, book in data["books"].items()}
+    def borrowing_history(self, since=None, until=None):
+        # The logged-in user's lends and returns between two timestamps as (timestamp, LogAction, book key)
+        if not self.logged_in_user:
+            return []
+        return [(timestamp, LogAction(action), key) for timestamp, action, key, _
+                in self.circulation.user_history(self.logged_in_user.username, since, until)]
+
+    def circulation_events(self):
+        # Every lend and return in the users' borrowed logs as circulation events, oldest first
+        genres, events = {}, []
+        for username, user in self.users.items():
+            for title, action, timestamp in user.borrowed_log:
+                key = title.lower()
+                if key not in genres:
+                    book = self.books.get(key)
+                    genres[key] = book.genre if book else ""
+                events.append((timestamp, key, username, genres[key], action))
+        events.sort(key=lambda event: event[0])
+        return events
+
+    def most_borrowed(self, n=10, genre=None, since=None):
+        # [(Book, lends)] from the circulation log's running counters; books deleted since are left out
+        results = []
+        for key, lends in self.circulation.most_borrowed(n, genre, since):
+            book = self.books.get(key)
+            if book:
+                results.append((book, lends))
+        return results
+
+    def overdue_loans(self, limit=None):
+        # Earliest-due first, read from the top of the loan ledger's due-date heap
+        return self.loans.overdue(limit=limit)
+
+    def send_loan_reminders(self):
+        # Emails everyone whose loan is due within the reminder window or has just become overdue;
+        # each loan gets each reminder once, so this can run as often as needed
+        batch = self.loans.pop_reminders()
+        self._changed(loans=[loan for loan, _ in batch])  # Journaled, so a restart doesn't send them again
+        for loan, stage in batch:
+            book = self.books.get(loan.key)
+            title = book.title if book else loan.key
+            due = f"{datetime.fromtimestamp(loan.due_at):%Y-%m-%d}"
+            if stage == OVERDUE:
+                self.notify_user(loan.username, f"Overdue: '{title}'", f"'{title}' was due back on {due}. Please return it.")
+            else:
+                self.notify_user(loan.username, f"Due soon: '{title}'", f"'{title}' is due back on {due}.")
+        return len(batch)
 
-            self.users = {username: User(username, user["hashed_password"], user["security_questions"], user["security_answers"], user["email"])  # Restore users from the backup data
-                          for username, user in data["users"].items()}
+    def top_rated(self, n=10, genre=None):
+        # Highest Bayesian-average books, optionally within one genre, read from the storage's rating index
+        return self.storage.top_rated(n, genre)
 
-            if data["logged_in_user"] and data["logged_in_user"] in self.users:  # Check if a logged-in user is present in the backup data
-                self.logged_in_user = self.users[data["logged_in_user"]]  # Set the logged-in user to the one in the backup data
+    @instrumented("search")
+    def search_books(self, keyword, filter_option):
+        # Served from the n-gram index so a query costs about the size of its result (1. Title, 2. Author, 3. Genre);
+        # searches are case-insensitive, so the cache keys them by the lowercased keyword
+        return self.query_cache.get(("search", keyword.lower(), filter_option),
+                                    lambda: self.storage.search(keyword, filter_option), self.storage.data_version())
+
+    @instrumented("ranked_search")
+    def search_catalog(self, query, limit=10):
+        # Best `limit` matches across title, author and genre, most relevant first: BM25 relevance,
+        # misspellings matched within one or two edits, and higher-rated books nudged up.
+        # A word can be tied to one field with a prefix, e.g. "author:tolkien hobbit".
+        return [book for book, _ in self.storage.ranked_search(query, limit)]
+
+    @instrumented("backup")
+    def backup_data(self, filename="library_backup.json", incremental=False, compact_ratio=1.0):
+        # Incremental backups append only the records changed since the last backup to the same file;
+        # once the appended tail outgrows compact_ratio times the live catalog it is compacted by a full rewrite
+        live_records = len(self.books) + len(self.users) + len(self.loans)
+        if (incremental and self.backup_state["file"] == filename and os.path.exists(filename)
+                and self.backup_state["appended"] <= compact_ratio * live_records):
+            records = [backup.book_record(key, self.books.get(key)) for key in self.dirty_books]
+            records += [backup.user_record(username, self.users.get(username)) for username in self.dirty_users]
+            records += [backup.loan_record(loan_id, self.loans.get(loan_id)) for loan_id in self.dirty_loans]
+            records += [backup.hold_record(key, username, self.reservations.deadline(key, username))
+                        for key, username in self.dirty_holds]
+            records.append(backup.session_record(self.logged_in_user))
+            self.backup_state["appended"] += backup.append_records(filename, records)
+            print(f"{len(records) - 1} changed records appended to {filename}.\n")
+        else:
+            backup.write_snapshot(filename, backup.snapshot_records(self.books, self.users, self.logged_in_user, self.loans,
+                                                                    holds=self.reservations.held()))
+            self.backup_state["file"] = filename
+            self.backup_state["appended"] = 0
+            print(f"Data backed up to {filename}.\n")
+
+        self.dirty_books.clear()
+        self.dirty_users.clear()
+        self.dirty_loans.clear()
+        self.dirty_holds.clear()
+
+    @instrumented("restore")
+    def restore_data(self, filename="library_backup.json", lazy=False):
+        # lazy=True only indexes where each record sits in the file; books and users are built on first access
+        try:
+            if backup.is_snapshot(filename):
+                if lazy:
+                    book_offsets, user_offsets, loans, holds, logged_in_username, record_count = backup.index_records(filename)
+                    books = backup.LazyRecords(filename, book_offsets, self.book_from_record)
+                    users = backup.LazyRecords(filename, user_offsets, self.user_from_record)
+                else:
+                    books, users, loans, holds, logged_in_username, record_count = self.read_backup_records(filename)
+            else:
+                with open(filename, 'r') as file:  # Older backups are one JSON document
+                    data = json.load(file)  # Load data from the backup file as a JSON object
+                books = {title: self.book_from_record(title, book) for title, book in data["books"].items()}  # Restore books from the backup data
+                users = {username: self.user_from_record(username, user) for username, user in data["users"].items()}  # Restore users from the backup data
+                loans, holds, logged_in_username, record_count = {}, {}, data["logged_in_user"], None
+
+            self.storage.replace_all(books, users, lazy)
+            self.query_cache.invalidate()
+            self.restore_loans(loans)
+            self.restore_holds(holds)
+            self.circulation.reset()
+            self.dirty_books.clear()
+            self.dirty_users.clear()
+            self.dirty_loans.clear()
+            self.dirty_holds.clear()
+            if record_count is not None:  # Later incremental backups can keep appending to this file
+                self.backup_state["file"] = filename
+                self.backup_state["appended"] = (record_count - len(self.books) - len(self.users) - len(self.loans)
+                                                 - len(holds))
+            if self.journal is not None:  # The journal so far describes the state that was just replaced
+                self.journal.checkpoint()
+
+            if logged_in_username and logged_in_username in self.users:  # Check if a logged-in user is present in the backup data
+                self.logged_in_user = self.users[logged_in_username]  # Set the logged-in user to the one in the backup data
                 print(f"Data restored from {filename}. Welcome back, {self.logged_in_user.username}!\n")
             else:
                 print(f"Data restored from {filename}.\n")
         except FileNotFoundError:
             print(f"No backup file '{filename}' found.\n")  # Handle the case where the backup file is not found
 
-def main():
-    library = Library()
+    def read_backup_records(self, filename):
+        return self.apply_records(backup.read_records(filename))
+
+    def apply_records(self, records):
+        # Replays a snapshot plus any appended records one line at a time, building objects as it goes;
+        # later records for a key replace earlier ones. Loans and holds stay as records until restore_loans
+        # and restore_holds.
+        books, users, loans, holds, logged_in_username, record_count = {}, {}, {}, {}, None, 0
+        for record in records:
+            record_type = record["type"]
+            if record_type in ("book", "user", "loan", "hold"):
+                target = {"book": books, "user": users, "loan": loans, "hold": holds}[record_type]
+                record_count += 1
+                if record.get("deleted"):
+                    target.pop(record["key"], None)
+                elif record_type == "book":
+                    books[record["key"]] = self.book_from_record(record["key"], record)
+                elif record_type == "user":
+                    users[record["key"]] = self.user_from_record(record["key"], record)
+                else:
+                    target[record["key"]] = record
+            elif record_type == "borrow" and record["key"] in users:
+                # A checkpoint taken between a lend and its journal record already has the entry
+                borrowed_log = users[record["key"]].borrowed_log
+                if len(borrowed_log) <= record.get("index", len(borrowed_log)):
+                    borrowed_log.record(*record["entry"])
+            elif record_type == "session":
+                logged_in_username = record["logged_in_user"]
+        return books, users, loans, holds, logged_in_username, record_count
+
+    def restore_loans(self, loans):
+        self.loans.clear()
+        for loan_id, record in sorted(loans.items()):
+            self.loans.open(record["username"], record["book"], record["lent_at"], record["due_at"], loan_id,
+                            record.get("reminder_stage", 0))  # Older backups don't record which reminders were sent
+
+    def restore_holds(self, holds):
+        # Held copies were counted out of available_copies when the hold was placed, so the holds come back
+        # with the catalog; ones past their deadline are released by the next expire_reservations
+        self.reservations.restore([(record["book"], record["username"], record["deadline"])
+                                   for record in holds.values() if record["book"] in self.books])
+
+    def book_from_record(self, title, book):
+        # Backups from before the full book record only carry the copy counts; the key stands in for the title
+        restored = Book(book.get("title", title), book["author"], book["genre"], book["total_copies"])
+        restored.available_copies = book.get("available_copies", restored.total_copies)
+        restored.rating_count = book.get("rating_count", 0)
+        restored.rating_sum = book.get("rating_sum", 0.0)
+        restored.rating_histogram = array('I', book.get("rating_histogram", restored.rating_histogram))
+        restored.reviews = book.get("reviews", [])
+        return restored
+
+    def user_from_record(self, username, user):
+        restored = User(username, user["hashed_password"], user["security_questions"], email=user["email"])
+        restored.security_answers = dict(user["security_answers"])
+        restored.borrowed_log = BorrowedLog.from_list(user.get("borrowed_log", []))
+        return restored
+
+    def load_journal(self, directory="library_data", lazy=False):
+        # Rebuilds the library from the directory's last checkpoint plus the journal written since, without
+        # journaling anything; returns (books, users, records replayed), or None if there was nothing to load.
+        # With lazy=True the search and ordering indexes are built by the first query that needs them.
+        # A durable backend is never replaced from the journal: it may hold commits made by other processes.
+        if self.storage.durable or not (os.path.exists(os.path.join(directory, SNAPSHOT_FILE)) or journal_files(directory)):
+            return None
+        books, users, loans, holds, _, record_count = self.apply_records(recovery_records(directory))
+        self.storage.replace_all(books, users, lazy)
+        self.query_cache.invalidate()
+        self.restore_loans(loans)
+        self.restore_holds(holds)
+        self.circulation.reset()
+        return len(books), len(users), record_count
+
+    def open_journal(self, directory="library_data"):
+        # Loads the directory as load_journal does, then journals every change from here on. A first checkpoint
+        # folds the replayed journal (or whatever the library already held) into a fresh snapshot; after that
+        # one runs in the background every few minutes.
+        recovered = self.load_journal(directory)
+        if recovered is not None:
+            print("Recovered {} books and {} users from {} journaled records.\n".format(*recovered))
+        self.journal = Journal(directory, self.checkpoint_records)
+        self.journal.checkpoint()
+
+    def checkpoint_records(self, journal_generation):
+        # Plain dicts are copied in one step, so sessions can keep writing while the snapshot streams out
+        self.storage.checkpoint()
+        books = self.books.copy() if isinstance(self.books, dict) else self.books
+        users = self.users.copy() if isinstance(self.users, dict) else self.users
+        return backup.snapshot_records(books, users, None, list(self.loans), journal_generation, self.reservations.held())
+
+    def close(self):
+        # Flushes the journal; call before exiting so the last commit window isn't left to chance
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+def open_library():
+    # Set LIBRARY_DB to keep the catalog in a SQLite database instead of memory, or LIBRARY_SNAPSHOT to
+    # read it from a memory-mapped catalog snapshot
+    if os.getenv("LIBRARY_DB"):
+        return Library(SqliteStorage(os.environ["LIBRARY_DB"]))
+    if os.getenv("LIBRARY_SNAPSHOT"):
+        return Library(MappedStorage(os.environ["LIBRARY_SNAPSHOT"]))
+    return Library()
+
+
+def run_command(argv):
+    # Short-lived read-only commands for shells and scripts, e.g. `python library.py search --genre fantasy`.
+    # Nothing is journaled or written, and neither .env nor the password and mail modules are loaded, so
+    # settings come from the environment itself and a command costs little more than opening the catalog.
+    import argparse
+    parser = argparse.ArgumentParser(prog="library.py", description="Query the catalog without the interactive menu.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="books whose title, author or genre contains a keyword")
+    fields = search.add_mutually_exclusive_group(required=True)
+    fields.add_argument("--title", metavar="KEYWORD")
+    fields.add_argument("--author", metavar="KEYWORD")
+    fields.add_argument("--genre", metavar="KEYWORD")
+    fields.add_argument("--best", metavar="WORDS", help="best matches across all fields, e.g. 'author:tolkien hobbit'")
+    search.add_argument("--limit", type=int, default=20)
+    listing = commands.add_parser("list", help="one page of the catalog in alphabetical order")
+    listing.add_argument("--offset", type=int, default=0)
+    listing.add_argument("--limit", type=int, default=20)
+    top = commands.add_parser("top-rated", help="the highest-rated books")
+    top.add_argument("-n", type=int, default=10)
+    top.add_argument("--genre")
+    args = parser.parse_args(argv)
+
+    library = open_library()
+    if isinstance(library.storage, MemoryStorage):  # The database and snapshot are read as they are
+        library.load_journal(os.getenv("LIBRARY_DATA_DIR", "library_data"), lazy=True)  # Index only what's asked
+    if args.command == "search" and args.best is not None:
+        books = library.search_catalog(args.best, args.limit)
+    elif args.command == "search":
+        filter_option, keyword = next((option, keyword) for option, keyword
+                                      in ((1, args.title), (2, args.author), (3, args.genre)) if keyword is not None)
+        books = library.storage.search(keyword, filter_option)[:args.limit]  # One query: filling the cache is wasted work
+    elif args.command == "list":
+        books = library.list_books(args.offset, args.limit)
+    else:
+        books = library.top_rated(args.n, args.genre)
+    for book in books:
+        book.display_info()
+    library.storage.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return run_command(argv)
+    load_env()  # The menu takes LIBRARY_DB and the rest from .env as well as the environment
+    library = open_library()
+    if not library.storage.durable:
+        # Changes are journaled to LIBRARY_DATA_DIR and replayed from there on the next start
+        library.open_journal(os.getenv("LIBRARY_DATA_DIR", "library_data"))
 
     # library.restore_data("library_backup.json")
 
@@ -392,6 +830,9 @@ def main():
                 print("5. Delete a Book (Admin Only)")
                 print("12. Backup Data")
                 print("13. Restore Backup Data (Admin Only)")
+                print("17. Import Books from CSV/JSONL (Admin Only)")
+                print("18. Export Books to CSV/JSONL (Admin Only)")
+                print("20. Overdue Loans and Reminders (Admin Only)")
               
         print("Library System Menu:")
         if not library.logged_in_user:
@@ -406,11 +847,13 @@ def main():
             print("10. View Borrowed Books Log")
             print("15. Change Password")
             print("16. Delete Account")
+            print("19. Reserve a Book")
         print("11. Search Books")
+        print("21. Most Borrowed Books")
         print("14. Exit")
         
 
-        choice = input("Enter your choice (1-16): ")
+        choice = input("Enter your choice (1-21): ")
 
         if choice == "1" and not library.logged_in_user:
             username = input("Enter a username for the new account: ")
@@ -445,7 +888,13 @@ def main():
             library.delete_book(title)
 
         elif choice == "6":
-            library.display_books()
+            page_size = 10
+            offset = 0
+            while True:
+                library.display_books(offset, page_size)
+                offset += page_size
+                if offset >= len(library.books) or input("Press Enter for the next page, or q to stop: ").lower() == "q":
+                    break
 
         elif choice == "7":
             if library.logged_in_user:
@@ -475,7 +924,7 @@ def main():
         elif choice == "11":
             while True:
                 try:
-                    filter_option = int(input("Choose a filter option (1. Title, 2. Author, 3. Genre, 0. Exit): "))
+                    filter_option = int(input("Choose a filter option (1. Title, 2. Author, 3. Genre, 4. Best Match, 0. Exit): "))
                 except ValueError:
                     print("Invalid input. Please enter a valid number.")
                     continue  # Restart the loop if there is an error
@@ -490,8 +939,14 @@ def main():
                     for result in search_results:
                         result.display_info()
                     break
+                elif filter_option == 4:
+                    query = input("Enter words to search for (e.g. author:tolkien hobbit): ")
+                    print("\nBest Matches:")
+                    for result in library.search_catalog(query):
+                        result.display_info()
+                    break
                 else:
-                    print("Invalid input. Please enter a valid number (0, 1, 2, or 3) to exit or choose a filter option.")
+                    print("Invalid input. Please enter a valid number (0, 1, 2, 3, or 4) to exit or choose a filter option.")
 
 
         elif choice == "12" and library.logged_in_user and library.logged_in_user.username == "admin":
@@ -512,11 +967,7 @@ def main():
             current_password = getpass("Enter your current password: ")
             new_password = getpass("Enter a new password: ")
     
-             # Check if the user is logged in before attempting to change the password
-            if library.logged_in_user:
-                library.logged_in_user.change_password(current_password, new_password)
-            else:
-                print("Please log in first.\n")
+            library.change_password(current_password, new_password)
             break
         
         elif choice == "16":
@@ -524,9 +975,37 @@ def main():
             library.delete_account()
             break
 
+        elif choice == "19" and library.logged_in_user:
+            title = input("Enter the title of the book to reserve: ")
+            library.reserve_book(title)
+
+        elif choice == "17" and library.logged_in_user and library.logged_in_user.username == "admin":
+            filename = input("Enter the file to import (.csv or .jsonl): ")
+            library.import_books_file(filename)
+
+        elif choice == "18" and library.logged_in_user and library.logged_in_user.username == "admin":
+            filename = input("Enter the file to export to (.csv or .jsonl): ")
+            library.export_books(filename)
+
+        elif choice == "20" and library.logged_in_user and library.logged_in_user.username == "admin":
+            print("Overdue Loans:")
+            for loan in library.overdue_loans():
+                print(f"{loan.username}: '{loan.key}' due {datetime.fromtimestamp(loan.due_at):%Y-%m-%d}")
+            print(f"{library.send_loan_reminders()} reminders sent.\n")
+
+        elif choice == "21":
+            genre = input("Enter a genre (press Enter for all genres): ").strip() or None
+            days = input("Count lends from the last how many days? (press Enter for all time): ").strip()
+            since = time.time() - float(days) * 86400 if is_float(days) else None
+            print("\nMost Borrowed Books:")
+            for book, lends in library.most_borrowed(10, genre, since):
+                print(f"{book.title} by {book.author} - borrowed {lends} times")
+
         else:
             print("Invalid choice. Please enter a number between 1 and 12.")
 
+    library.close()
+
 if __name__ == "__main__":
     main()
 
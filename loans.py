@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import threading
+import time
+
+DAY = 24 * 3600
+
+DUE_SOON = "due_soon"
+OVERDUE = "overdue"
+
+
+class Loan:
+    # reminder_stage: 0 no reminder sent, 1 due-soon sent, 2 overdue sent
+    __slots__ = ("loan_id", "username", "key", "lent_at", "due_at", "reminder_stage")
+
+    def __init__(self, loan_id, username, key, lent_at, due_at, reminder_stage=0):
+        self.loan_id = loan_id
+        self.username = username
+        self.key = key
+        self.lent_at = lent_at
+        self.due_at = due_at
+        self.reminder_stage = reminder_stage
+
+
+class LoanLedger:
+    # Open loans indexed by id, by user and by book, plus two min-heaps: due dates for overdue and due-soon
+    # queries, and reminder times for batching notices. Closed loans are left in the heaps and skipped
+    # when they surface; the heaps are rebuilt once more than half their entries are stale.
+    def __init__(self, loan_days=14, reminder_days=2):
+        self.loan_seconds = loan_days * DAY
+        self.reminder_seconds = reminder_days * DAY
+        self.loans = {}
+        self.by_user = {}  # username -> {loan_id: Loan}
+        self.by_book = {}  # book key -> {loan_id: Loan}
+        self.due = []  # heap of (due_at, loan_id)
+        self.reminders = []  # heap of (remind_at, loan_id) for loans with a reminder still to send
+        self.ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def open(self, username, key, lent_at=None, due_at=None, loan_id=None, reminder_stage=0):
+        lent_at = lent_at or time.time()
+        due_at = due_at or lent_at + self.loan_seconds
+        with self._lock:
+            if loan_id is None:
+                loan_id = next(self.ids)
+            else:  # Restored from a backup: keep new ids above it
+                self.ids = itertools.count(max(loan_id + 1, next(self.ids)))
+            loan = Loan(loan_id, username, key, lent_at, due_at, reminder_stage)
+            self.loans[loan_id] = loan
+            self.by_user.setdefault(username, {})[loan_id] = loan
+            self.by_book.setdefault(key, {})[loan_id] = loan
+            heapq.heappush(self.due, (due_at, loan_id))
+            if reminder_stage < 2:
+                heapq.heappush(self.reminders, (due_at - (self.reminder_seconds if reminder_stage == 0 else 0), loan_id))
+        return loan
+
+    def close(self, username, key):
+        # Closes the user's earliest open loan of this book; None if they don't have one
+        with self._lock:
+            held = [loan for loan in self.by_user.get(username, {}).values() if loan.key == key]
+            if not held:
+                return None
+            loan = min(held, key=lambda loan: loan.lent_at)
+            self._remove(loan)
+            return loan
+
+    def get(self, loan_id):
+        return self.loans.get(loan_id)
+
+    def for_user(self, username):
+        return sorted(self.by_user.get(username, {}).values(), key=lambda loan: loan.due_at)
+
+    def for_book(self, key):
+        return sorted(self.by_book.get(key, {}).values(), key=lambda loan: loan.due_at)
+
+    def due_before(self, deadline, limit=None):
+        # Open loans due before deadline, earliest first. Walks the heap as a tree, best-first, so k results
+        # cost O(k log k) and nothing past the deadline is visited.
+        results = []
+        with self._lock:
+            frontier = [(self.due[0], 0)] if self.due else []
+            while frontier and (limit is None or len(results) < limit):
+                (due_at, loan_id), index = heapq.heappop(frontier)
+                if due_at > deadline:
+                    break
+                loan = self.loans.get(loan_id)
+                if loan is not None and loan.due_at == due_at:
+                    results.append(loan)
+                for child in (2 * index + 1, 2 * index + 2):
+                    if child < len(self.due):
+                        heapq.heappush(frontier, (self.due[child], child))
+        return results
+
+    def overdue(self, now=None, limit=None):
+        return self.due_before(now or time.time(), limit)
+
+    def due_soon(self, within_days=None, now=None, limit=None):
+        now = now or time.time()
+        horizon = within_days * DAY if within_days is not None else self.reminder_seconds
+        return [loan for loan in self.due_before(now + horizon, limit) if loan.due_at > now]
+
+    def pop_reminders(self, now=None):
+        # Every reminder that has come due, as (loan, stage). A due-soon notice schedules the overdue one,
+        # so each loan gets each notice once, and a loan already past due when first seen gets only the
+        # overdue notice, as in SqliteLoans; k reminders cost O(k log N).
+        now = now or time.time()
+        batch = []
+        with self._lock:
+            while self.reminders and self.reminders[0][0] <= now:
+                remind_at, loan_id = heapq.heappop(self.reminders)
+                loan = self.loans.get(loan_id)
+                if loan is None:
+                    continue
+                target = 2 if loan.due_at <= now else 1
+                if loan.reminder_stage < target:
+                    loan.reminder_stage = target
+                    batch.append((loan, OVERDUE if target == 2 else DUE_SOON))
+                if target == 1:
+                    heapq.heappush(self.reminders, (loan.due_at, loan_id))
+        return batch
+
+    def drop_book(self, key):
+        # Closes every loan of a book that left the catalog; returns them
+        with self._lock:
+            loans = list(self.by_book.get(key, {}).values())
+            for loan in loans:
+                self._remove(loan)
+        return loans
+
+    def clear(self):
+        with self._lock:
+            self.loans, self.by_user, self.by_book, self.due, self.reminders = {}, {}, {}, [], []
+
+    def __len__(self):
+        return len(self.loans)
+
+    def __iter__(self):
+        return iter(list(self.loans.values()))
+
+    def _remove(self, loan):
+        del self.loans[loan.loan_id]
+        for index, key in ((self.by_user, loan.username), (self.by_book, loan.key)):
+            entries = index[key]
+            del entries[loan.loan_id]
+            if not entries:
+                del index[key]
+        if len(self.due) > 2 * len(self.loans) + 64:  # Mostly stale: compact both heaps
+            self.due = [(due_at, loan_id) for due_at, loan_id in self.due if loan_id in self.loans]
+            heapq.heapify(self.due)
+            self.reminders = [entry for entry in self.reminders if entry[1] in self.loans]
+            heapq.heapify(self.reminders)
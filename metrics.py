@@ -0,0 +1,164 @@
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds of the latency buckets in seconds, 10 us to 10 s
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+# inspect.CO_COROUTINE; checked directly because importing inspect (with ast, dis and tokenize) would
+# roughly double the startup time of everything that imports library
+CO_COROUTINE = 0x80
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last slot counts everything above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        slot = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[slot] += 1
+            self.count += 1
+            self.sum += seconds
+            if error:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"count": self.count, "sum": self.sum, "errors": self.errors,
+                    "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], self.counts))}
+
+
+class Metrics:
+    # Per-operation latency histograms and named event counters. When disabled, instrumented calls
+    # cost one attribute check; nothing is timed or recorded.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.operations = {}
+        self.events = {}
+        self.trace_hooks = []
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.events = {}
+
+    def increment(self, event, amount=1):
+        if self.enabled:
+            with self._lock:
+                self.events[event] = self.events.get(event, 0) + amount
+
+    def record(self, operation, seconds, error=False):
+        histogram = self.operations.get(operation)
+        if histogram is None:
+            with self._lock:
+                histogram = self.operations.setdefault(operation, Histogram())
+        histogram.record(seconds, error)
+        for hook in self.trace_hooks:
+            hook(operation, seconds, error)
+
+    def add_trace_hook(self, hook):
+        # hook(operation, seconds, error) is called after every instrumented call while metrics are enabled
+        self.trace_hooks.append(hook)
+
+    def remove_trace_hook(self, hook):
+        self.trace_hooks.remove(hook)
+
+    def start_profiling(self):
+        if self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profiling(self, filename=None):
+        # Returns the profiler so callers can print pstats from it; writes it to filename if given
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.disable()
+            if filename:
+                profiler.dump_stats(filename)
+        return profiler
+
+    def snapshot(self):
+        with self._lock:
+            operations = dict(self.operations)
+            events = dict(self.events)
+        return {"operations": {name: histogram.snapshot() for name, histogram in operations.items()},
+                "events": events}
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = ["# TYPE library_operation_seconds histogram"]
+        for name, data in sorted(snapshot["operations"].items()):
+            cumulative = 0
+            for bound, count in data["buckets"].items():
+                cumulative += count
+                lines.append(f'library_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'library_operation_seconds_sum{{operation="{name}"}} {data["sum"]}')
+            lines.append(f'library_operation_seconds_count{{operation="{name}"}} {data["count"]}')
+        lines.append("# TYPE library_operation_errors_total counter")
+        for name, data in sorted(snapshot["operations"].items()):
+            lines.append(f'library_operation_errors_total{{operation="{name}"}} {data["errors"]}')
+        lines.append("# TYPE library_events_total counter")
+        for event, count in sorted(snapshot["events"].items()):
+            lines.append(f'library_events_total{{event="{event}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+_metrics = None
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(enabled=os.getenv("LIBRARY_METRICS") == "1")
+    return _metrics
+
+
+def instrumented(operation):
+    # Decorator timing a Library method under `operation`; exceptions are counted as errors and re-raised
+    def decorate(func):
+        if func.__code__.co_flags & CO_COROUTINE:  # Same test as inspect.iscoroutinefunction for a plain function
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                metrics = get_metrics()
+                if not metrics.enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                error = True
+                try:
+                    result = await func(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    metrics.record(operation, time.perf_counter() - start, error)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = get_metrics()
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                metrics.record(operation, time.perf_counter() - start, error)
+        return wrapper
+    return decorate
@@ -0,0 +1,189 @@
+import random
+import string
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+from enum import IntEnum
+from getpass import getpass
+
+import ratings
+from auth import get_auth_engine
+from utils import get_mail_dispatcher
+
+
+class Book:
+    # Slotted to drop the per-instance __dict__; authors and genres repeat across the catalog, so they are interned
+    __slots__ = ("title", "author", "genre", "total_copies", "available_copies", "reviews", "rating_count", "rating_sum",
+                 "rating_histogram")
+
+    def __init__(self, title, author, genre, total_copies=1):
+        self.title = title
+        self.author = sys.intern(author)
+        self.genre = sys.intern(genre)
+        self.total_copies = total_copies
+        self.available_copies = total_copies
+        self.reviews = []  # Text reviews only; ratings go to the aggregates below
+        self.rating_count = 0  # Ratings are kept as a running count and sum rather than a list
+        self.rating_sum = 0.0
+        self.rating_histogram = array('I', [0] * 5)  # Number of ratings per star, 1 to 5
+
+    @property
+    def rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+    def bayesian_rating(self, prior_mean=ratings.PRIOR_MEAN, prior_weight=ratings.PRIOR_WEIGHT):
+        return ratings.bayesian_average(self.rating_sum, self.rating_count, prior_mean, prior_weight)
+
+    def display_info(self):
+        print(f"Title: {self.title}\nAuthor: {self.author}\nGenre: {self.genre}\n"
+              f"Total Copies: {self.total_copies}\nAvailable Copies: {self.available_copies}\n"
+              f"Rating: {self.rating:.2f}\nReviews: {', '.join(map(str, self.reviews))}\n")
+
+    def add_review(self, review):
+        self.reviews.append(review)
+        print("Review added. Thank you!\n")
+
+    def add_rating(self, rating):
+        if isinstance(rating, (int, float)) and 1.0 <= rating <= 5.0:
+            self.record_rating(rating)
+            print(f"Rating of {rating} added. Thank you!\n")
+        else:
+            print("Invalid rating. Please enter a number between 1 and 5.")
+
+    def record_rating(self, rating):
+        # add_rating without the check and the message, for storage backends applying a validated rating
+        self.rating_count += 1
+        self.rating_sum += rating
+        self.rating_histogram[ratings.star_index(rating)] += 1
+
+
+class LogAction(IntEnum):
+    LENT = 1
+    RETURNED = 2
+
+
+class BorrowedLog:
+    # Borrowing history as parallel arrays (book title, action, timestamp) instead of one formatted string per entry;
+    # titles are the Book's own string objects, so entries don't copy them
+    __slots__ = ("titles", "actions", "timestamps")
+
+    def __init__(self):
+        self.titles = []
+        self.actions = array('B')
+        self.timestamps = array('d')
+
+    def record(self, title, action, timestamp=None):
+        self.titles.append(title)
+        self.actions.append(action)
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __iter__(self):
+        for title, action, timestamp in zip(self.titles, self.actions, self.timestamps):
+            yield title, LogAction(action), timestamp
+
+    def __getitem__(self, index):
+        return self.titles[index], LogAction(self.actions[index]), self.timestamps[index]
+
+    def describe(self):
+        for title, action, timestamp in self:
+            yield f"{'Lent' if action == LogAction.LENT else 'Returned'} '{title}'"
+
+    def to_list(self):
+        return [[title, int(action), timestamp] for title, action, timestamp in self]
+
+    @classmethod
+    def from_list(cls, entries):
+        log = cls()
+        for title, action, timestamp in entries:
+            log.record(title, action, timestamp)
+        return log
+
+
+class User:
+    __slots__ = ("username", "hashed_password", "security_questions", "security_answers", "email", "reset_code",
+                 "reset_code_expiry", "borrowed_log", "wrong_attempts", "cooldown_end_time")
+
+    def __init__(self, username, hashed_password, security_questions=None, security_answers=None, email=None):
+        self.username = username
+        self.hashed_password = hashed_password
+        self.security_questions = [sys.intern(question) for question in security_questions or []]  # Every account shares the same questions
+        self.security_answers = dict(zip(security_questions, security_answers)) if security_questions and security_answers else {}
+        self.email = email
+        self.reset_code = None
+        self.reset_code_expiry = None
+        self.borrowed_log = BorrowedLog()
+        self.wrong_attempts = 0
+        self.cooldown_end_time = None
+
+    def display_borrowed_log(self):
+        print(f"{self.username}'s Borrowed Books Log:")
+        for log in self.borrowed_log.describe():
+            print(f"- {log}")
+
+    def verify_password(self, password):
+        return get_auth_engine().check_password(password, self.hashed_password)
+
+    def generate_reset_code(self):
+        self.reset_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+        self.reset_code_expiry = datetime.now() + timedelta(minutes=15)
+
+
+    def change_password(self, current_password, new_password):
+        if self.verify_password(current_password):
+            self.hashed_password = get_auth_engine().hash_password(new_password)
+            print(f"Password for user '{self.username}' has been changed.\n")
+        else:
+            print("Current password is incorrect. Password change failed.\n")
+
+    def reset_password(self, new_password):
+        self.hashed_password = get_auth_engine().hash_password(new_password)
+        self.reset_code = None
+        self.reset_code_expiry = None
+        print(f"Password for user '{self.username}' has been updated.\n")
+
+    def initiate_password_reset(self):
+        if self.email:
+            self.generate_reset_code()
+            self.send_reset_email()
+            print(f"Password reset initiated. Check your email for instructions.\n")
+        else:
+            print(f"User '{self.username}' does not have a registered email.\n")
+
+    def send_reset_email(self):
+        # Queued for the background dispatcher so the reset request doesn't wait on SMTP
+        body = (f"Hello {self.username},\n\nYour password reset code is {self.reset_code}.\n"
+                f"It expires at {self.reset_code_expiry:%Y-%m-%d %H:%M}.\n")
+        if not get_mail_dispatcher().submit(self.email, "Library password reset", body):
+            print("Mail queue is full. Please try again shortly.\n")
+        # For simplicity, print the reset code in the console
+        print(f"Reset code for {self.username}: {self.reset_code}")
+
+
+    def initiate_password_reset_security_questions(self):
+        if self.security_questions and self.security_answers:
+            self.verify_identity_and_reset_password()
+        else:
+            print(f"Security questions are not set for user '{self.username}'. Password reset failed.\n")
+
+    def verify_identity_and_reset_password(self):
+        if not self.security_questions or not self.security_answers:
+            print(f"Security questions are not set for user '{self.username}'. Password reset failed.\n")
+            return
+
+        shuffled_questions = list(self.security_questions)
+        random.shuffle(shuffled_questions)
+
+        print("Answer the following security questions to verify your identity:")
+        for i, question in enumerate(shuffled_questions, 1):
+            answer = input(f"{i}. {question}: ")
+            original_answer = self.security_answers.get(question, "")
+            if answer.lower() != original_answer.lower():
+                print("Incorrect answer. Password reset failed.\n")
+                return
+
+        new_password = getpass("Enter a new password for your account: ")
+        self.reset_password(new_password)
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import get_metrics
+
+
+class CacheEntry:
+    __slots__ = ("results", "keys", "data_version", "expires_at")
+
+    def __init__(self, results, data_version, expires_at, track_books):
+        self.results = results
+        self.keys = [book.title.lower() for book in results] if track_books else []  # Catalog keys are always title.lower()
+        self.data_version = data_version
+        self.expires_at = expires_at
+
+
+class QueryCache:
+    # Results of search and listing queries, least recently used first, bounded by max_entries and by
+    # max_rows books across all entries, and dropped after ttl seconds.
+    # Adding, importing, deleting or restoring books empties the cache, and so does a change to the
+    # storage's data version (another process writing the same database). A change to one book's copies,
+    # ratings or reviews only touches the entries holding that book: `holders` maps each cached book key
+    # to where it sits in which entry, and the fresh Book is put in its place. With live_books (the storage
+    # hands out the catalog's own Book objects, as MemoryStorage does) cached results can't go stale that
+    # way, so none of that is tracked.
+    # Lazy results (those marked `lazy`, like the mapped snapshot's BookViews) pass straight through
+    # uncached: caching them would mean reading every book they hold up front.
+    def __init__(self, max_entries=None, max_rows=None, ttl=None, live_books=False):
+        self.max_entries = max_entries or int(os.getenv("QUERY_CACHE_SIZE", 1024))
+        self.max_rows = max_rows or int(os.getenv("QUERY_CACHE_ROWS", 500000))
+        self.ttl = ttl or float(os.getenv("QUERY_CACHE_TTL", 60))
+        self.live_books = live_books
+        self.entries = OrderedDict()  # query -> CacheEntry
+        self.holders = {}  # book key -> {query: position in that entry's results}
+        self.rows = 0
+        self.writes = 0  # Bumped by every invalidation and refresh, so a result computed across one isn't cached
+        self.stats_counts = dict.fromkeys(("hits", "misses", "evictions", "expirations", "refreshes", "invalidations"), 0)
+        self._lock = threading.Lock()
+
+    def get(self, query, compute, data_version=0):
+        # Cached results for query (a hashable, already normalized tuple), or compute() stored for next time.
+        # data_version is the storage's own change counter, for changes made outside this process.
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(query)
+            if entry is not None:
+                if entry.data_version == data_version and entry.expires_at > now:
+                    self.entries.move_to_end(query)
+                    self._count("hits")
+                    return list(entry.results)
+                self._drop(query)
+                self._count("expirations")
+            self._count("misses")
+            writes = self.writes
+
+        results = compute()
+        if getattr(results, "lazy", False):
+            return results
+        results = list(results)
+        if len(results) > self.max_rows:
+            return results
+        with self._lock:
+            if writes == self.writes and query not in self.entries:
+                self.entries[query] = CacheEntry(list(results), data_version, now + self.ttl, not self.live_books)
+                for position, key in enumerate(self.entries[query].keys):
+                    self.holders.setdefault(key, {})[query] = position
+                self.rows += len(results)
+                while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                    self._drop(next(iter(self.entries)))
+                    self._count("evictions")
+        return results
+
+    def refresh(self, key, load):
+        # One book changed: load() returns its current state (None once deleted), which replaces the old
+        # one in every entry holding it. Nothing is loaded when no entry holds the book.
+        with self._lock:
+            self.writes += 1
+            holding = self.holders.get(key)
+            if not holding:
+                return
+            book = load()
+            for query, position in list(holding.items()):
+                if book is None:  # Deleted: the entries holding it are wrong, not just stale
+                    self._drop(query)
+                else:
+                    self.entries[query].results[position] = book
+                    self._count("refreshes")
+
+    def invalidate(self):
+        # The set of books changed, so any cached result may be missing one or holding one too many
+        with self._lock:
+            self.writes += 1
+            self.entries.clear()
+            self.holders.clear()
+            self.rows = 0
+            self._count("invalidations")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.stats_counts, entries=len(self.entries), rows=self.rows)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _drop(self, query):
+        entry = self.entries.pop(query)
+        self.rows -= len(entry.results)
+        for key in entry.keys:
+            holding = self.holders.get(key)
+            if holding is not None:
+                holding.pop(query, None)
+                if not holding:
+                    del self.holders[key]
+
+    def _count(self, stat):
+        self.stats_counts[stat] += 1
+        get_metrics().increment(f"query_cache_{stat}")
@@ -0,0 +1,173 @@
+import heapq
+import math
+import re
+
+from ratings import PRIOR_MEAN
+from search_index import grams
+
+# Relative weight of a match in each field; a title hit counts three times a genre hit
+FIELD_WEIGHTS = {"title": 3.0, "author": 2.0, "genre": 1.0}
+K1 = 1.2  # BM25 term-frequency saturation
+B = 0.75  # BM25 field-length normalization
+TYPO_PENALTY = 0.6  # Score multiplier per edit for a misspelled term
+RATING_WEIGHT = 0.05  # A 5-star Bayesian average lifts a score by 10%, a 1-star one lowers it by 10%
+
+TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def max_typos(term):
+    return 0 if len(term) <= 3 else 1 if len(term) <= 6 else 2
+
+
+def edit_distance(a, b, limit):
+    # Levenshtein distance, cut short at limit + 1 once it can only be larger
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def parse_query(query):
+    # "author:tolkien ring" -> [(("author",), "tolkien"), (("title", "author", "genre"), "ring")]
+    terms = []
+    for part in query.split():
+        field, separator, text = part.partition(":")
+        if separator and field.lower() in FIELD_WEIGHTS:
+            terms.extend(((field.lower(),), term) for term in tokenize(text))
+        else:
+            terms.extend((tuple(FIELD_WEIGHTS), term) for term in tokenize(part))
+    return terms
+
+
+def rating_boost(score):
+    return 1 + RATING_WEIGHT * (score - PRIOR_MEAN)
+
+
+class RankedIndex:
+    # Word-level inverted index over title, author and genre with the per-field statistics BM25 needs
+    # (document frequency, field length, average field length), kept current book by book. Misspelled
+    # terms are matched through a trigram index over the vocabulary, so a typo costs a lookup of the
+    # words sharing its trigrams rather than a pass over every word.
+    def __init__(self):
+        self.rebuild({})
+
+    def rebuild(self, books):
+        self.postings = {field: {} for field in FIELD_WEIGHTS}  # field -> token -> {key: term frequency}
+        self.lengths = {}  # key -> tokens in each field, in FIELD_WEIGHTS order
+        self.total_lengths = dict.fromkeys(FIELD_WEIGHTS, 0)
+        self.vocabulary = {}  # token -> number of (book, field) postings holding it
+        self.vocabulary_grams = {}  # trigram of "$token$" -> tokens
+        self.stale = False
+        for key, book in books.items():
+            self.add(key, book)
+
+    def add(self, key, book):
+        if self.stale or key in self.lengths:
+            return
+        lengths = []
+        for field, postings in self.postings.items():
+            tokens = tokenize(getattr(book, field))
+            lengths.append(len(tokens))
+            self.total_lengths[field] += len(tokens)
+            for token in tokens:
+                frequencies = postings.setdefault(token, {})
+                if key not in frequencies:
+                    self._count_token(token, 1)
+                frequencies[key] = frequencies.get(key, 0) + 1
+        self.lengths[key] = tuple(lengths)
+
+    def remove(self, key, book):
+        if self.stale or self.lengths.pop(key, None) is None:
+            return
+        for field, postings in self.postings.items():
+            tokens = tokenize(getattr(book, field))
+            self.total_lengths[field] -= len(tokens)
+            for token in set(tokens):
+                frequencies = postings.get(token)
+                if frequencies is not None and frequencies.pop(key, None) is not None:
+                    self._count_token(token, -1)
+                    if not frequencies:
+                        del postings[token]
+
+    def expand(self, term):
+        # [(token, weight)]: the term itself when it is a known word, otherwise known words within
+        # max_typos edits, weighted down per edit
+        if term in self.vocabulary:
+            return [(term, 1.0)]
+        limit = max_typos(term)
+        if not limit:
+            return []
+        term_grams = grams(f"${term}$", 3)
+        shared = {}
+        for gram in term_grams:
+            for token in self.vocabulary_grams.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        needed = len(term_grams) - 3 * limit  # One edit changes at most three trigrams
+        matches = []
+        for token, count in shared.items():
+            if count >= needed:
+                distance = edit_distance(term, token, limit)
+                if distance <= limit:
+                    matches.append((token, TYPO_PENALTY ** distance))
+        return matches
+
+    def search(self, query, limit=10, rating_of=None):
+        # Top `limit` (key, score) by BM25 summed over fields, times rating_boost(rating_of(key)).
+        # Words in more than half the catalog only score books that rarer words already found,
+        # so a query like "the hobbit" does not score every title containing "the".
+        count = len(self.lengths)
+        if not count:
+            return []
+        clauses = []  # (field index, frequencies, weight)
+        field_names = list(FIELD_WEIGHTS)
+        for fields, term in parse_query(query):
+            for token, typo_weight in self.expand(term):
+                for field in fields:
+                    frequencies = self.postings[field].get(token)
+                    if frequencies:
+                        idf = math.log(1 + (count - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+                        clauses.append((field_names.index(field), frequencies, FIELD_WEIGHTS[field] * typo_weight * idf))
+        if not clauses:
+            return []
+
+        averages = [max(self.total_lengths[field] / count, 1.0) for field in field_names]
+        scores = {}
+        for field_index, frequencies, weight in sorted(clauses, key=lambda clause: len(clause[1])):
+            if scores and len(frequencies) > count // 2:
+                postings = [(key, frequencies[key]) for key in scores if key in frequencies]
+            else:
+                postings = frequencies.items()
+            average = averages[field_index]
+            for key, frequency in postings:
+                norm = K1 * (1 - B + B * self.lengths[key][field_index] / average)
+                scores[key] = scores.get(key, 0.0) + weight * frequency * (K1 + 1) / (frequency + norm)
+        if rating_of:
+            scores = {key: score * rating_boost(rating_of(key)) for key, score in scores.items()}
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def _count_token(self, token, delta):
+        count = self.vocabulary.get(token, 0) + delta
+        if count > 0:
+            self.vocabulary[token] = count
+            if count == delta:  # New word
+                for gram in grams(f"${token}$", 3):
+                    self.vocabulary_grams.setdefault(gram, set()).add(token)
+            return
+        self.vocabulary.pop(token, None)
+        for gram in grams(f"${token}$", 3):
+            tokens = self.vocabulary_grams.get(gram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.vocabulary_grams[gram]
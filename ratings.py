@@ -0,0 +1,59 @@
+from bisect import bisect_left, insort
+
+# Prior used for the Bayesian average: a book starts as if it had PRIOR_WEIGHT ratings of PRIOR_MEAN,
+# so a single 5-star rating doesn't outrank a title with hundreds of 4.8s
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+
+
+def star_index(rating):
+    # Slot in a book's five-slot rating histogram; half stars round up
+    return min(4, int(rating + 0.5) - 1)
+
+
+def bayesian_average(rating_sum, rating_count, prior_mean=PRIOR_MEAN, prior_weight=PRIOR_WEIGHT):
+    return (rating_sum + prior_mean * prior_weight) / (rating_count + prior_weight)
+
+
+class RatingIndex:
+    # Rated books kept sorted by Bayesian average, overall and per genre; a rating change is a
+    # bisect out and back in, and top_rated(n) is a slice of the first n entries
+    def __init__(self):
+        self.scores = {}  # key -> (score, genre) currently in the index
+        self.ranked = []  # (-score, key)
+        self.ranked_by_genre = {}
+        self.stale = False
+
+    def update(self, key, book):
+        self.remove(key)
+        if book.rating_count:
+            score = bayesian_average(book.rating_sum, book.rating_count)
+            genre = book.genre.lower()
+            self.scores[key] = (score, genre)
+            insort(self.ranked, (-score, key))
+            insort(self.ranked_by_genre.setdefault(genre, []), (-score, key))
+
+    def remove(self, key):
+        entry = self.scores.pop(key, None)
+        if entry is None:
+            return
+        score, genre = entry
+        for ranked in (self.ranked, self.ranked_by_genre[genre]):
+            del ranked[bisect_left(ranked, (-score, key))]
+
+    def rebuild(self, books):
+        self.scores, self.ranked, self.ranked_by_genre = {}, [], {}
+        for key, book in books.items():
+            if book.rating_count:
+                score = bayesian_average(book.rating_sum, book.rating_count)
+                self.scores[key] = (score, book.genre.lower())
+                self.ranked.append((-score, key))
+                self.ranked_by_genre.setdefault(book.genre.lower(), []).append((-score, key))
+        self.ranked.sort()
+        for ranked in self.ranked_by_genre.values():
+            ranked.sort()
+        self.stale = False
+
+    def top(self, n, genre=None):
+        ranked = self.ranked if genre is None else self.ranked_by_genre.get(genre.lower(), [])
+        return [key for _, key in ranked[:n]]
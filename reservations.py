@@ -0,0 +1,119 @@
+import heapq
+import threading
+import time
+from collections import deque
+
+
+class Reservations:
+    # Per-book FIFO waitlists plus held copies waiting to be collected. Holds expire through a min-heap
+    # of deadlines, so finding the expired ones only looks at the top of the heap, never at every hold.
+    def __init__(self, hold_seconds=48 * 3600):
+        self.hold_seconds = hold_seconds
+        self.queues = {}  # book key -> deque of usernames
+        self.waiting = set()  # (book key, username) currently in a queue
+        self.holds = {}  # book key -> {username: deadline}
+        self.deadlines = []  # heap of (deadline, book key, username); entries whose hold is gone are skipped
+        self._lock = threading.Lock()
+
+    def enqueue(self, key, username):
+        # Returns the user's place in the queue, or None if they are already waiting or holding a copy
+        with self._lock:
+            if (key, username) in self.waiting or username in self.holds.get(key, ()):
+                return None
+            queue = self.queues.setdefault(key, deque())
+            queue.append(username)
+            self.waiting.add((key, username))
+            return len(queue)
+
+    def next_waiting(self, key):
+        with self._lock:
+            queue = self.queues.get(key)
+            if not queue:
+                return None
+            username = queue.popleft()
+            self.waiting.discard((key, username))
+            if not queue:
+                del self.queues[key]
+            return username
+
+    def requeue_front(self, key, username):
+        # Puts back a user who was popped but could not be given a copy, keeping their place
+        with self._lock:
+            self.queues.setdefault(key, deque()).appendleft(username)
+            self.waiting.add((key, username))
+
+    def hold(self, key, username, now=None):
+        deadline = (now or time.time()) + self.hold_seconds
+        with self._lock:
+            self.holds.setdefault(key, {})[username] = deadline
+            heapq.heappush(self.deadlines, (deadline, key, username))
+        return deadline
+
+    def claim(self, key, username):
+        # True if the user had a copy on hold; the hold is used up
+        with self._lock:
+            return self._release(key, username) is not None
+
+    def pop_expired(self, now=None):
+        now = now or time.time()
+        expired = []
+        with self._lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, key, username = heapq.heappop(self.deadlines)
+                if self.holds.get(key, {}).get(username) == deadline:  # Skip holds already claimed or replaced
+                    self._release(key, username)
+                    expired.append((key, username))
+        return expired
+
+    def waiting_books(self):
+        # Keys of the books someone is queued for
+        with self._lock:
+            return set(self.queues)
+
+    def deadline(self, key, username):
+        # When the user's hold on the book runs out, or None if they have none
+        with self._lock:
+            return self.holds.get(key, {}).get(username)
+
+    def held(self):
+        # [(book key, username, deadline)] for backups and journal checkpoints
+        with self._lock:
+            return [(key, username, deadline) for key, held in self.holds.items() for username, deadline in held.items()]
+
+    def restore(self, holds):
+        # Replaces every reservation with holds read back from a backup or the journal; queues start empty
+        with self._lock:
+            self.queues, self.waiting, self.holds = {}, set(), {}
+            self.deadlines = [(deadline, key, username) for key, username, deadline in holds]
+            for deadline, key, username in self.deadlines:
+                self.holds.setdefault(key, {})[username] = deadline
+            heapq.heapify(self.deadlines)
+
+    def cancel_user(self, username):
+        # Takes a deleted account out of every queue; returns the books it held a copy of, now released
+        with self._lock:
+            for key in [key for key, waiting in self.waiting if waiting == username]:
+                self.waiting.discard((key, username))
+                self.queues[key].remove(username)
+                if not self.queues[key]:
+                    del self.queues[key]
+            released = [key for key, held in self.holds.items() if username in held]
+            for key in released:
+                self._release(key, username)
+        return released
+
+    def drop(self, key):
+        # Forget every reservation for a book that left the catalog; returns the users who were affected
+        with self._lock:
+            users = list(self.queues.pop(key, ()))
+            for username in users:
+                self.waiting.discard((key, username))
+            users.extend(self.holds.pop(key, {}))
+        return users
+
+    def _release(self, key, username):
+        held = self.holds.get(key)
+        deadline = held.pop(username, None) if held else None
+        if held is not None and not held:
+            del self.holds[key]
+        return deadline
@@ -0,0 +1,173 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+GRAM_SIZE = 3
+
+# filter_option values used by Library.search_books mapped to Book attributes
+FIELDS = {1: "title", 2: "author", 3: "genre"}
+
+
+def grams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def index_grams(value):
+    # What BookIndex posts a value under: its trigrams, or the value itself when it is shorter than one
+    return grams(value, GRAM_SIZE) if len(value) >= GRAM_SIZE else {value} if value else set()
+
+
+class BookIndex:
+    def __init__(self):
+        # field -> trigram -> array of document ids, so a posting costs four bytes rather than a key in a
+        # set; a value shorter than a trigram is posted whole. A keyword of GRAM_SIZE or more is looked up
+        # by its rarest trigram, a shorter one by the union of the grams containing it, and search()
+        # confirms every candidate against the whole keyword.
+        self.postings = {field: {} for field in FIELDS.values()}
+        self.ids = {}  # catalog key -> document id
+        self.keys = []  # document id -> catalog key, None once removed
+
+    def invalidate(self):
+        # Defer the build to the first search, e.g. while a lazily restored catalog is still on disk; each
+        # field is then built by the first search of that field, so a one-off genre search doesn't pay for
+        # indexing every title
+        self.postings = dict.fromkeys(FIELDS.values())
+        self.ids, self.keys = {}, []
+
+    def add(self, key, book):
+        for field, grams_map in self.postings.items():
+            if grams_map is not None:
+                self._post(grams_map, self._id(key), getattr(book, field).lower())
+
+    def remove(self, key, book):
+        doc_id = self.ids.pop(key, None)
+        if doc_id is None:
+            return
+        self.keys[doc_id] = None
+        for field, grams_map in self.postings.items():
+            if grams_map is None:
+                continue
+            for gram in index_grams(getattr(book, field).lower()):
+                ids = grams_map.get(gram)
+                if ids is not None and doc_id in ids:
+                    ids.remove(doc_id)
+                    if not ids:
+                        del grams_map[gram]
+
+    def rebuild(self, books, fields=FIELDS.values()):
+        if all(field in fields for field in self.postings):  # Nothing keeps the old ids; start them over
+            self.ids, self.keys = {}, []
+        for field in fields:
+            grams_map = self.postings[field] = {}
+            for key, book in books.items():
+                self._post(grams_map, self._id(key), getattr(book, field).lower())
+
+    def _id(self, key):
+        doc_id = self.ids.get(key)
+        if doc_id is None:
+            doc_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return doc_id
+
+    def _post(self, grams_map, doc_id, value):
+        for gram in index_grams(value):
+            ids = grams_map.get(gram)
+            if ids is None:
+                ids = grams_map[gram] = array('I')
+            ids.append(doc_id)
+
+    def candidates(self, keyword, field):
+        grams_map = self.postings[field]
+        if len(keyword) >= GRAM_SIZE:
+            ids = min((grams_map.get(gram, ()) for gram in grams(keyword, GRAM_SIZE)), key=len)
+        else:
+            ids = set().union(*(ids for gram, ids in grams_map.items() if keyword in gram))
+        keys = self.keys
+        return {keys[doc_id] for doc_id in ids}
+
+    def search(self, keyword, filter_option, books):
+        field = FIELDS.get(filter_option)
+        if field is None:
+            return []
+
+        if self.postings[field] is None:
+            self.rebuild(books, [field])
+
+        keyword = keyword.lower()
+        if not keyword:  # Empty keyword matches everything, same as a substring check
+            return list(books.values())
+
+        matches = []
+        for key in sorted(self.candidates(keyword, field)):
+            book = books.get(key)
+            # Trigram hits only guarantee the pieces occur, so confirm the full substring
+            if book and keyword in getattr(book, field).lower():
+                matches.append(book)
+        return matches
+
+
+class SortedKeys:
+    # Catalog keys in title order, held as a list of short sorted chunks so an insert or delete
+    # only shifts one chunk rather than the whole list
+    CHUNK_SIZE = 512
+
+    def __init__(self, keys=()):
+        self.rebuild(keys)
+
+    def rebuild(self, keys):
+        keys = sorted(keys)
+        self.chunks = [keys[i:i + self.CHUNK_SIZE] for i in range(0, len(keys), self.CHUNK_SIZE)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.stale = False
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def add(self, key):
+        if not self.chunks:
+            self.chunks.append([key])
+            self.maxes.append(key)
+            return
+
+        position = min(bisect_left(self.maxes, key), len(self.chunks) - 1)
+        chunk = self.chunks[position]
+        index = bisect_left(chunk, key)
+        if index < len(chunk) and chunk[index] == key:
+            return
+        chunk.insert(index, key)
+        self.maxes[position] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            self.chunks[position:position + 1] = [chunk[:self.CHUNK_SIZE], chunk[self.CHUNK_SIZE:]]
+            self.maxes[position:position + 1] = [chunk[self.CHUNK_SIZE - 1], chunk[-1]]
+
+    def remove(self, key):
+        position = bisect_left(self.maxes, key)
+        if position == len(self.chunks):
+            return
+        chunk = self.chunks[position]
+        index = bisect_left(chunk, key)
+        if index == len(chunk) or chunk[index] != key:
+            return
+        del chunk[index]
+        if chunk:
+            self.maxes[position] = chunk[-1]
+        else:
+            del self.chunks[position]
+            del self.maxes[position]
+
+    def page(self, offset=0, limit=20, after=None):
+        # Keys in title order starting at offset, or just past the key `after` when paging by cursor
+        if after is not None:
+            position = bisect_right(self.maxes, after)
+            index = bisect_right(self.chunks[position], after) if position < len(self.chunks) else 0
+        else:
+            position, index = 0, offset
+            while position < len(self.chunks) and index >= len(self.chunks[position]):
+                index -= len(self.chunks[position])
+                position += 1
+
+        keys = []
+        while position < len(self.chunks) and len(keys) < limit:
+            chunk = self.chunks[position]
+            keys.extend(chunk[index:index + limit - len(keys)])
+            position, index = position + 1, 0
+        return keys
@@ -0,0 +1,260 @@
+"""Serve the library as a JSON API from a pool of pre-forked worker processes.
+
+    python server.py [--bind 127.0.0.1:8080 | --unix /tmp/library.sock] [--db library.db] [--workers N]
+
+The parent opens the listening socket and forks the workers, which all accept from it; a worker that
+dies is replaced. Each worker opens the SQLite catalog itself, so books, users, copy counts and loans
+are shared through the database, as are waitlists and held copies, and login throttling through
+LOGIN_THROTTLE_DB (default: <db>-throttle). Circulation history and metrics are kept per worker.
+
+    POST /login   {"username", "password"}           -> {"token"}
+    GET  /books   ?offset=&limit=&after=
+    GET  /search  ?q=&field=title|author|genre&limit=  (no field: best match)
+    GET  /top-rated ?n=&genre=
+    POST /lend    {"title"}                           (Authorization: Bearer <token>)
+    POST /return  {"title", "rating", "review"}
+    GET  /loans
+    GET  /metrics                                     (Prometheus text for the worker that answers)
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from library import Library
+from metrics import get_metrics
+from storage import SqliteStorage
+from utils import load_env
+
+FIELDS = {"title": 1, "author": 2, "genre": 3}
+
+
+def make_token(secret, username, ttl, now=None):
+    # Signed "username:expiry:signature", so any worker can check a token without shared session state
+    expires = int((now or time.time()) + ttl)
+    payload = f"{username}:{expires}"
+    return f"{payload}:{hmac.new(secret, payload.encode(), hashlib.sha256).hexdigest()}"
+
+
+def token_user(secret, token, now=None):
+    payload, _, signature = token.rpartition(":")
+    username, _, expires = payload.rpartition(":")
+    expected = hmac.new(secret, payload.encode(), hashlib.sha256).hexdigest()
+    if not username or not hmac.compare_digest(signature, expected):
+        return None
+    if not expires.isdigit() or int(expires) < (now or time.time()):
+        return None
+    return username
+
+
+def book_json(book):
+    return {"title": book.title, "author": book.author, "genre": book.genre, "total_copies": book.total_copies,
+            "available_copies": book.available_copies, "rating": book.bayesian_rating()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so a client reuses one connection
+
+    def setup(self):
+        # Headers and body are written separately, so Nagle would hold the body back on TCP
+        self.disable_nagle_algorithm = self.server.socket.family != socket.AF_UNIX
+        super().setup()
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        route = ROUTES.get((method, url.path))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if route is None:
+            return self.reply(404, {"error": "not found"})
+        try:
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if body:
+                params.update(json.loads(body))
+            status, result = route(self, params)
+        except (ValueError, TypeError, KeyError) as e:
+            status, result = 400, {"error": str(e)}
+        self.reply(status, result)
+
+    def reply(self, status, result):
+        if isinstance(result, str):
+            body, content_type = result.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(result).encode(), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session(self):
+        # A session for the token's user, or None; the user is read fresh so other workers' changes show
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        username = token_user(self.server.secret, token)
+        user = self.server.library.users.get(username) if username else None
+        if user is None:
+            return None
+        session = self.server.library.open_session()
+        session.logged_in_user = user
+        return session
+
+    def login(self, params):
+        user = self.server.library.open_session().login(params["username"], params["password"], self.address_string())
+        if user is None:
+            return 401, {"error": "login failed"}
+        return 200, {"token": make_token(self.server.secret, user.username, self.server.token_ttl)}
+
+    def books(self, params):
+        books = self.server.library.list_books(int(params.get("offset", 0)), int(params.get("limit", 20)),
+                                               params.get("after"))
+        return 200, [book_json(book) for book in books]
+
+    def search(self, params):
+        field = params.get("field")
+        if field:
+            books = self.server.library.search_books(params["q"], FIELDS[field])[:int(params.get("limit", 20))]
+        else:
+            books = self.server.library.search_catalog(params["q"], int(params.get("limit", 10)))
+        return 200, [book_json(book) for book in books]
+
+    def top_rated(self, params):
+        return 200, [book_json(book) for book in self.server.library.top_rated(int(params.get("n", 10)),
+                                                                               params.get("genre"))]
+
+    def lend(self, params):
+        session = self.session()
+        if session is None:
+            return 401, {"error": "not logged in"}
+        return 200, {"ok": session.lend_book(params["title"])}
+
+    def return_(self, params):
+        session = self.session()
+        if session is None:
+            return 401, {"error": "not logged in"}
+        return 200, {"ok": session.return_book(params["title"], params.get("rating"), params.get("review"))}
+
+    def loans(self, params):
+        session = self.session()
+        if session is None:
+            return 401, {"error": "not logged in"}
+        return 200, [{"title": loan.key, "lent_at": loan.lent_at, "due_at": loan.due_at}
+                     for loan in session.loans.for_user(session.logged_in_user.username)]
+
+    def metrics(self, params):
+        return 200, get_metrics().prometheus_text()
+
+
+ROUTES = {("POST", "/login"): Handler.login, ("GET", "/books"): Handler.books, ("GET", "/search"): Handler.search,
+          ("GET", "/top-rated"): Handler.top_rated, ("POST", "/lend"): Handler.lend,
+          ("POST", "/return"): Handler.return_, ("GET", "/loans"): Handler.loans,
+          ("GET", "/metrics"): Handler.metrics}
+
+
+def listen(bind=None, unix=None, backlog=1024):
+    if unix:
+        if os.path.exists(unix):
+            os.remove(unix)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(unix)
+    else:
+        host, _, port = (bind or "127.0.0.1:8080").rpartition(":")
+        listener = socket.create_server((host or "127.0.0.1", int(port)), reuse_port=False)
+    listener.listen(backlog)
+    return listener
+
+
+def run_worker(listener, db_path, secret, token_ttl):
+    # Runs in a forked child; everything with threads or connections is created here, after the fork
+    sys.stdout = open(os.devnull, 'w')  # Library reports through print
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent handles Ctrl-C and stops the workers
+    httpd = ThreadingHTTPServer(listener.getsockname(), Handler, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = listener
+    httpd.library = Library(SqliteStorage(db_path))
+    httpd.secret = secret
+    httpd.token_ttl = token_ttl
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.library.close()
+        httpd.library.storage.close()
+
+
+def serve(listener, db_path, workers, token_ttl=3600):
+    secret = os.getenv("SERVER_SECRET", "").encode() or secrets.token_bytes(32)
+    os.environ.setdefault("LOGIN_THROTTLE_DB", db_path + "-throttle")
+    SqliteStorage(db_path).close()  # Create the schema once, before the workers race to
+    children = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                run_worker(listener, db_path, secret, token_ttl)
+                code = 0
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on {listener.getsockname()} with {workers} workers (pid {os.getpid()})", flush=True)
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if not stopping and started is not None:
+            if time.monotonic() - started < 1:
+                time.sleep(1)  # Don't spin if workers die as soon as they start
+            spawn()
+    listener.close()
+
+
+def main():
+    load_env()  # SERVER_SECRET, LIBRARY_DB and mail settings may come from .env
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bind", default="127.0.0.1:8080", help="host:port to listen on")
+    parser.add_argument("--unix", help="listen on this Unix socket path instead")
+    parser.add_argument("--db", default=os.getenv("LIBRARY_DB", "library.db"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--token-ttl", type=int, default=3600)
+    args = parser.parse_args()
+    serve(listen(args.bind, args.unix), args.db, args.workers, args.token_ttl)
+
+
+if __name__ == "__main__":
+    main()
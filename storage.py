@@ -0,0 +1,1209 @@
+import contextlib
+import heapq
+import json
+import os
+from array import array
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping, Sequence
+from itertools import islice
+
+import ranking
+import ratings
+from catalog_snapshot import BookView, BookViews, MappedCatalog, write_catalog_snapshot
+from loans import DAY, DUE_SOON, OVERDUE, Loan, LoanLedger
+from models import Book, BorrowedLog, User
+from reservations import Reservations
+from search_index import BookIndex, FIELDS, SortedKeys
+
+
+class StripedLocks:
+    # A fixed pool of locks picked by key hash: per-key locking without one Lock object per book or user
+    def __init__(self, stripes=256):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def get(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+
+class MemoryStorage:
+    # Default backend: plain dicts plus the in-memory n-gram and ranked search indexes
+    live_books = True  # Lookups return the catalog's own Book objects, which changes update in place
+    durable = False  # Nothing survives a restart unless the library journals it
+    def __init__(self):
+        self.books = {}
+        self.users = {}
+        self.index = BookIndex()
+        self.ranked_index = ranking.RankedIndex()
+        self.rating_index = ratings.RatingIndex()
+        self.sorted_keys = SortedKeys()
+        self.book_locks = StripedLocks()
+        self.catalog_lock = threading.Lock()  # Guards the search and ordering indexes
+
+    def put_book(self, key, book):
+        with self.catalog_lock:
+            if key not in self.books:
+                self.index.add(key, book)
+                self.ranked_index.add(key, book)
+                if not self.sorted_keys.stale:
+                    self.sorted_keys.add(key)
+            self.books[key] = book
+            if not self.rating_index.stale:
+                self.rating_index.update(key, book)
+
+    def import_books(self, books):
+        # books is a chunk of (key, Book); titles already in the catalog get the new copies added to them
+        added = merged = 0
+        with self.catalog_lock:
+            new_keys = []
+            for key, book in books:
+                existing = self.books.get(key)
+                if existing is not None:
+                    with self.book_locks.get(key):
+                        existing.total_copies += book.total_copies
+                        existing.available_copies += book.available_copies
+                    merged += 1
+                else:
+                    self.books[key] = book
+                    self.index.add(key, book)
+                    self.ranked_index.add(key, book)
+                    new_keys.append(key)
+                    added += 1
+
+            # A large chunk is cheaper to merge by re-sorting once than by inserting key by key
+            if not self.sorted_keys.stale:
+                if len(new_keys) > len(self.books) // 8:
+                    self.sorted_keys.rebuild(self.books)
+                else:
+                    for key in new_keys:
+                        self.sorted_keys.add(key)
+        return added, merged
+
+    def delete_book(self, key):
+        with self.catalog_lock:
+            book = self.books.pop(key, None)
+            if book is not None:
+                self.index.remove(key, book)
+                self.ranked_index.remove(key, book)
+                self.rating_index.remove(key)
+                self.sorted_keys.remove(key)
+
+    def adjust_copies(self, key, available_delta, total_delta=0):
+        # Check and update happen under the book's lock, so two sessions can't both take the last copy;
+        # returns False instead of letting available copies go negative
+        with self.book_locks.get(key):
+            book = self.books.get(key)
+            if book is None or book.available_copies + available_delta < 0:
+                return False
+            book.available_copies += available_delta
+            book.total_copies += total_delta
+            return True
+
+    def add_feedback(self, key, rating=None, review=None):
+        # A rating and review from a return, added under the book's lock so concurrent returns both count
+        with self.book_locks.get(key):
+            book = self.books.get(key)
+            if book is None:
+                return False
+            if rating is not None:
+                book.record_rating(rating)
+            if review:
+                book.reviews.append(review)
+        if rating is not None:
+            with self.catalog_lock:
+                if not self.rating_index.stale:
+                    self.rating_index.update(key, book)
+        return True
+
+    def atomic(self):
+        return contextlib.nullcontext()  # Each change is applied as it is made; there is nothing to commit
+
+    def checkpoint(self):
+        pass  # The journal's snapshot is the only copy on disk
+
+    def loan_ledger(self):
+        return LoanLedger()
+
+    def reservations(self):
+        return Reservations()
+
+    def data_version(self):
+        return 0  # Nothing outside this process changes the catalog
+
+    def put_user(self, username, user):
+        self.users[username] = user
+
+    def log_borrow(self, username, user, title, action):
+        # Appends a lend or return to the user's borrowed_log; returns (index, entry)
+        user.borrowed_log.record(title, action)
+        index = len(user.borrowed_log) - 1
+        return index, user.borrowed_log[index]
+
+    def delete_user(self, username):
+        self.users.pop(username, None)
+
+    def search(self, keyword, filter_option):
+        return self.index.search(keyword, filter_option, self.books)
+
+    def ranked_search(self, query, limit=10):
+        if self.ranked_index.stale:
+            self.ranked_index.rebuild(self.books)
+        if self.rating_index.stale:
+            self.rating_index.rebuild(self.books)
+        scores = self.rating_index.scores
+        results = self.ranked_index.search(query, limit, lambda key: scores.get(key, (ratings.PRIOR_MEAN,))[0])
+        return [(self.books[key], score) for key, score in results]
+
+    def top_rated(self, n, genre=None):
+        if self.rating_index.stale:
+            self.rating_index.rebuild(self.books)
+        return [self.books[key] for key in self.rating_index.top(n, genre)]
+
+    def list_books(self, offset=0, limit=20, after=None):
+        if self.sorted_keys.stale:
+            self.sorted_keys.rebuild(self.books)
+        return [self.books[key] for key in self.sorted_keys.page(offset, limit, after)]
+
+    def replace_all(self, books, users, lazy=False):
+        self.books = books
+        self.users = users
+        if lazy:
+            self.index.invalidate()
+            self.ranked_index.stale = True
+            self.rating_index.stale = True
+            self.sorted_keys.stale = True
+        else:
+            self.index.rebuild(books)
+            self.ranked_index.rebuild(books)
+            self.rating_index.rebuild(books)
+            self.sorted_keys.rebuild(books)
+
+    def close(self):
+        pass
+
+
+class OverlayBooks(MutableMapping):
+    # The mapped catalog with the books changed since it was written layered on top: added and changed
+    # books in `changed`, deleted catalog keys in `deleted`. Catalog books whose copy counts are all that
+    # changed are kept as just the counts, by record number in `counts`, so lending doesn't grow `changed`,
+    # which every search walks.
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.changed = {}
+        self.deleted = set()
+        self.counts = {}  # record number -> (total_copies, available_copies)
+        self.touched = None  # Keys changed while a new snapshot is being written from a copy()
+
+    def __getitem__(self, key):
+        book = self.changed.get(key)
+        if book is not None:
+            return book
+        if key in self.deleted:
+            raise KeyError(key)
+        number = self.catalog.find(key)
+        if number < 0:
+            raise KeyError(key)
+        return self.view(number)
+
+    def __setitem__(self, key, book):
+        self.changed[key] = book
+        self.deleted.discard(key)
+        self.counts.pop(self.catalog.find(key), None)
+        if self.touched is not None:
+            self.touched.add(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changed.pop(key, None)
+        if key in self.catalog:
+            self.deleted.add(key)
+            self.counts.pop(self.catalog.find(key), None)
+        if self.touched is not None:
+            self.touched.add(key)
+
+    def view(self, number):
+        return BookView(self.catalog, number, self.counts.get(number))
+
+    def set_counts(self, key, total_copies, available_copies):
+        # Counts back at the file's values leave nothing in the overlay
+        if self.touched is not None:
+            self.touched.add(key)
+        book = self.changed.get(key)
+        if book is not None:
+            book.total_copies, book.available_copies = total_copies, available_copies
+            return
+        number = self.catalog.find(key)
+        if (total_copies, available_copies) == self.catalog.record(number)[16:18]:
+            self.counts.pop(number, None)
+        else:
+            self.counts[number] = (total_copies, available_copies)
+
+    def __contains__(self, key):
+        return key in self.changed or (key not in self.deleted and key in self.catalog)
+
+    def copy(self):
+        # The overlay as it is now, for writing out while changes carry on. Changed books are shared, so one
+        # changed afterwards may be written half-updated, but it is touched and rebase() replaces it.
+        frozen = OverlayBooks(self.catalog)
+        frozen.changed, frozen.deleted, frozen.counts = dict(self.changed), set(self.deleted), dict(self.counts)
+        return frozen
+
+    def rebase(self, catalog):
+        # A new overlay on catalog, written from copy(), holding the changes made to this one since
+        rebased = OverlayBooks(catalog)
+        for key in self.touched:
+            book = self.changed.get(key)
+            if book is not None:
+                rebased[key] = book
+            elif key not in self:
+                if key in catalog:
+                    rebased.deleted.add(key)
+            else:  # A catalog book whose copy counts are all that changed
+                book = self[key]
+                rebased.set_counts(key, book.total_copies, book.available_copies)
+        return rebased
+
+    def __iter__(self):
+        return self.keys_from()
+
+    def __len__(self):
+        return len(self.catalog) - len(self.deleted) + sum(key not in self.catalog for key in self.changed)
+
+    def keys_from(self, after=None):
+        # Every key in order, starting just past `after`: the catalog's keys merged with the added ones
+        added = sorted(key for key in self.changed if (after is None or key > after) and key not in self.catalog)
+        kept = (key for key in self.catalog.keys_from(after) if key not in self.deleted)
+        return heapq.merge(kept, added)
+
+
+class MappedStorage:
+    # Read-mostly backend over a memory-mapped catalog snapshot (catalog_snapshot.py). Opening it reads
+    # only the file's header, and every process mapping the same file shares its pages through the page
+    # cache instead of building a private copy of the catalog. Changes go to an in-memory overlay until
+    # write_snapshot() folds them into a new file, which happens at a journal checkpoint when books have been
+    # added, edited or deleted, and whenever more than overlay_limit (SNAPSHOT_OVERLAY_LIMIT) have been;
+    # changed copy counts alone stay in the overlay. Users and loans are kept in memory.
+    live_books = False
+    durable = False
+    def __init__(self, path, overlay_limit=None):
+        self.path = path
+        self.overlay_limit = overlay_limit or int(os.getenv("SNAPSHOT_OVERLAY_LIMIT", 10000))
+        if not os.path.exists(path):
+            write_catalog_snapshot(path, {})
+        self.books = OverlayBooks(MappedCatalog(path))
+        self.users = {}
+        self.ranked_index = ranking.RankedIndex()
+        self.rating_index = ratings.RatingIndex()
+        self.ranked_index.stale = self.rating_index.stale = True  # Built from the mapped catalog on first use
+        self.book_locks = StripedLocks()
+        self.catalog_lock = threading.Lock()  # Held by every change, so a fold never misses one
+        self.snapshot_lock = threading.Lock()  # One snapshot written at a time
+
+    def put_book(self, key, book):
+        # Same rule as SqliteStorage: copy counts only change through adjust_copies, so a stale view
+        # can't overwrite a concurrent lend
+        with self.catalog_lock, self.book_locks.get(key):
+            current = self.books.get(key)
+            if current is None:
+                self.ranked_index.add(key, book)
+            elif current is not book:
+                book.total_copies, book.available_copies = current.total_copies, current.available_copies
+            self.books[key] = book
+            if not self.rating_index.stale:
+                self.rating_index.update(key, book)
+        self._fold_if_large()
+
+    def import_books(self, books):
+        added = merged = 0
+        for key, book in books:
+            if self.adjust_copies(key, book.available_copies, book.total_copies):
+                merged += 1
+            else:
+                self.put_book(key, book)
+                added += 1
+        return added, merged
+
+    def delete_book(self, key):
+        with self.catalog_lock:
+            book = self.books.get(key)
+            if book is not None:
+                del self.books[key]
+                self.ranked_index.remove(key, book)
+                self.rating_index.remove(key)
+        self._fold_if_large()
+
+    def adjust_copies(self, key, available_delta, total_delta=0):
+        with self.catalog_lock:
+            book = self.books.get(key)
+            if book is None or book.available_copies + available_delta < 0:
+                return False
+            self.books.set_counts(key, book.total_copies + total_delta, book.available_copies + available_delta)
+            return True
+
+    def add_feedback(self, key, rating=None, review=None):
+        with self.catalog_lock, self.book_locks.get(key):
+            book = self.books.get(key)
+            if book is None:
+                return False
+            if rating is not None:
+                book.record_rating(rating)
+            if review:
+                book.reviews.append(review)
+            self.books[key] = book
+            if not self.rating_index.stale:
+                self.rating_index.update(key, book)
+        self._fold_if_large()
+        return True
+
+    def atomic(self):
+        return contextlib.nullcontext()
+
+    def checkpoint(self):
+        # Called with each journal checkpoint. Copy counts alone don't make search slower, so lending
+        # doesn't cause a rewrite of the whole file.
+        overlay = self.books
+        if overlay.changed or overlay.deleted:
+            self.write_snapshot()
+
+    def loan_ledger(self):
+        return LoanLedger()
+
+    def reservations(self):
+        return Reservations()
+
+    def data_version(self):
+        return 0  # Nothing outside this process changes the catalog
+
+    def put_user(self, username, user):
+        self.users[username] = user
+
+    def log_borrow(self, username, user, title, action):
+        # Appends a lend or return to the user's borrowed_log; returns (index, entry)
+        user.borrowed_log.record(title, action)
+        index = len(user.borrowed_log) - 1
+        return index, user.borrowed_log[index]
+
+    def delete_user(self, username):
+        self.users.pop(username, None)
+
+    def search(self, keyword, filter_option):
+        # The snapshot's gram postings answer for the mapped books; the few changed ones are checked directly
+        field = FIELDS.get(filter_option)
+        if field is None:
+            return []
+        overlay = self.books
+        catalog = overlay.catalog
+        numbers = catalog.search(keyword, field)
+        if not overlay.changed and not overlay.deleted:
+            return BookViews(catalog, numbers, overlay.counts)
+
+        # Changed books are slotted in by their position among the catalog's keys, so nothing is re-sorted
+        skipped = {catalog.find(key) for key in overlay.deleted}
+        keyword = keyword.lower()
+        changed = []
+        for key, book in list(overlay.changed.items()):
+            position = catalog.position(key)
+            if position < catalog.count and catalog.key_at(position) == key:
+                skipped.add(position)
+            if keyword in getattr(book, field).lower():
+                changed.append((position, 0, key, book))
+        changed.sort(key=lambda match: match[:3])
+        kept = ((number, 1, None, overlay.view(number)) for number in numbers if number not in skipped)
+        return [match[3] for match in heapq.merge(changed, kept, key=lambda match: match[:2])]
+
+    def ranked_search(self, query, limit=10):
+        if self.ranked_index.stale:
+            self.ranked_index.rebuild(self.books)
+        if self.rating_index.stale:
+            self.rating_index.rebuild(self.books)
+        scores = self.rating_index.scores
+        results = self.ranked_index.search(query, limit, lambda key: scores.get(key, (ratings.PRIOR_MEAN,))[0])
+        return [(self.books[key], score) for key, score in results]
+
+    def top_rated(self, n, genre=None):
+        if self.rating_index.stale:
+            self.rating_index.rebuild(self.books)
+        return [self.books[key] for key in self.rating_index.top(n, genre)]
+
+    def list_books(self, offset=0, limit=20, after=None):
+        keys = islice(self.books.keys_from(after), offset if after is None else 0, None)
+        return [self.books[key] for key in islice(keys, limit)]
+
+    def write_snapshot(self):
+        # Folds the overlay into a new snapshot at path and maps that; other processes pick it up on reopen
+        with self.snapshot_lock:
+            self._fold()
+
+    def _fold(self):
+        # The file is written from a copy of the overlay without holding catalog_lock, so lending and
+        # editing carry on meanwhile; the lock is taken again only to move those changes onto the new file
+        with self.catalog_lock:
+            overlay = self.books
+            frozen = overlay.copy()
+            overlay.touched = set()
+        write_catalog_snapshot(self.path, frozen)
+        catalog = MappedCatalog(self.path)
+        with self.catalog_lock:
+            self.books = overlay.rebase(catalog)
+
+    def _fold_if_large(self):
+        overlay = self.books
+        if len(overlay.changed) + len(overlay.deleted) > self.overlay_limit:
+            if self.snapshot_lock.acquire(blocking=False):  # Otherwise a fold is already under way
+                try:
+                    self._fold()
+                finally:
+                    self.snapshot_lock.release()
+
+    def replace_all(self, books, users, lazy=False):
+        # A restored catalog is written out as a new snapshot rather than held in memory
+        with self.snapshot_lock:
+            write_catalog_snapshot(self.path, books)
+            with self.catalog_lock:
+                self.books = OverlayBooks(MappedCatalog(self.path))
+                self.users = users
+                self.ranked_index.stale = self.rating_index.stale = True
+
+    def close(self):
+        self.books.catalog.close()
+
+
+BOOK_COLUMNS = "key, title, author, genre, total_copies, available_copies, rating_count, rating_sum, rating_histogram"
+# Title, author and genre lowercased by Python's str.lower, which folds every script; SQLite's lower() and
+# LIKE only fold ASCII, so matching on these columns is what keeps SQLite's results the same as the others'
+INSERT_BOOK = (f"INSERT INTO books ({BOOK_COLUMNS}, title_lower, author_lower, genre_lower) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+USER_COLUMNS = "username, hashed_password, security_questions, security_answers, email, wrong_attempts, cooldown_end_time"
+
+# Same Bayesian average as ratings.bayesian_average, written as SQL so it can be indexed
+RATING_SCORE = f"(rating_sum + {ratings.PRIOR_MEAN * ratings.PRIOR_WEIGHT}) / (rating_count + {ratings.PRIOR_WEIGHT})"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    total_copies INTEGER NOT NULL,
+    available_copies INTEGER NOT NULL CHECK (available_copies >= 0),
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum REAL NOT NULL DEFAULT 0,
+    rating_histogram TEXT NOT NULL DEFAULT '[0,0,0,0,0]',
+    title_lower TEXT NOT NULL,
+    author_lower TEXT NOT NULL,
+    genre_lower TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_top_rated ON books ({score} DESC) WHERE rating_count > 0;
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    hashed_password BLOB NOT NULL,
+    security_questions TEXT NOT NULL,
+    security_answers TEXT NOT NULL,
+    email TEXT,
+    wrong_attempts INTEGER NOT NULL DEFAULT 0,
+    cooldown_end_time TEXT
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    book_key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (book_key, seq)
+);
+CREATE TABLE IF NOT EXISTS borrow_log (
+    username TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    action INTEGER NOT NULL,
+    at REAL NOT NULL,
+    PRIMARY KEY (username, seq)
+);
+CREATE TABLE IF NOT EXISTS loans (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    key TEXT NOT NULL,
+    lent_at REAL NOT NULL,
+    due_at REAL NOT NULL,
+    reminder_stage INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS loans_username ON loans (username, key);
+CREATE INDEX IF NOT EXISTS loans_key ON loans (key);
+CREATE INDEX IF NOT EXISTS loans_due ON loans (due_at);
+CREATE INDEX IF NOT EXISTS loans_reminders ON loans (due_at) WHERE reminder_stage < 2;
+CREATE TABLE IF NOT EXISTS waitlist (
+    key TEXT NOT NULL,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (key, username)
+);
+CREATE INDEX IF NOT EXISTS waitlist_position ON waitlist (key, position);
+CREATE TABLE IF NOT EXISTS holds (
+    key TEXT NOT NULL,
+    username TEXT NOT NULL,
+    deadline REAL NOT NULL,
+    PRIMARY KEY (key, username)
+);
+CREATE INDEX IF NOT EXISTS holds_deadline ON holds (deadline);
+CREATE INDEX IF NOT EXISTS holds_username ON holds (username);
+""".format(score=RATING_SCORE)
+
+# Run once the lowercased columns exist, which in a database from before them is after they are added
+LOWER_SCHEMA = f"""
+CREATE INDEX IF NOT EXISTS books_genre ON books (genre_lower);
+CREATE INDEX IF NOT EXISTS books_top_rated_in_genre ON books (genre_lower, {RATING_SCORE} DESC) WHERE rating_count > 0;
+"""
+
+# Trigram full-text table over the lowercased columns, kept in step with books by triggers, so substring
+# searches of three or more characters use an index instead of scanning every row
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title_lower, author_lower, genre_lower, content='books', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title_lower, author_lower, genre_lower)
+    VALUES (new.id, new.title_lower, new.author_lower, new.genre_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title_lower, author_lower, genre_lower)
+    VALUES ('delete', old.id, old.title_lower, old.author_lower, old.genre_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title_lower, author_lower, genre_lower ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title_lower, author_lower, genre_lower)
+    VALUES ('delete', old.id, old.title_lower, old.author_lower, old.genre_lower);
+    INSERT INTO books_fts (rowid, title_lower, author_lower, genre_lower)
+    VALUES (new.id, new.title_lower, new.author_lower, new.genre_lower);
+END;
+"""
+
+# Word-level full-text table for ranked search; its bm25() supplies the relevance score, and the
+# fts5vocab view lists the indexed words for typo matching
+WORDS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_words USING fts5(
+    title, author, genre, content='books', content_rowid='id', tokenize='unicode61');
+CREATE VIRTUAL TABLE IF NOT EXISTS books_words_vocab USING fts5vocab(books_words, 'row');
+CREATE TRIGGER IF NOT EXISTS books_words_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_words (rowid, title, author, genre) VALUES (new.id, new.title, new.author, new.genre);
+END;
+CREATE TRIGGER IF NOT EXISTS books_words_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_words (books_words, rowid, title, author, genre) VALUES ('delete', old.id, old.title, old.author, old.genre);
+END;
+CREATE TRIGGER IF NOT EXISTS books_words_update AFTER UPDATE OF title, author, genre ON books BEGIN
+    INSERT INTO books_words (books_words, rowid, title, author, genre) VALUES ('delete', old.id, old.title, old.author, old.genre);
+    INSERT INTO books_words (rowid, title, author, genre) VALUES (new.id, new.title, new.author, new.genre);
+END;
+"""
+
+
+class SqliteStorage:
+    # Durable backend: every mutation is its own committed transaction in a WAL-mode database,
+    # and Book/User objects are built per lookup, so memory does not grow with the catalog
+    live_books = False
+    durable = True  # The database is the record; there is no journal to replay over it
+    def __init__(self, path="library.db"):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+        self.lock = threading.RLock()
+        self.depth = 0  # How many atomic() blocks the thread holding the lock is inside
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            if not any(column[1] == "title_lower" for column in self.connection.execute("PRAGMA table_info(books)")):
+                # A database from before the lowercased columns: add and fill them, and replace the indexes
+                # and trigram table that were built on SQLite's lower()
+                self.connection.create_function("python_lower", 1, str.lower, deterministic=True)
+                for field in ("title", "author", "genre"):
+                    self.connection.execute(f"ALTER TABLE books ADD COLUMN {field}_lower TEXT NOT NULL DEFAULT ''")
+                self.connection.execute("UPDATE books SET title_lower = python_lower(title), "
+                                        "author_lower = python_lower(author), genre_lower = python_lower(genre)")
+                self.connection.executescript(
+                    "DROP INDEX IF EXISTS books_title_lower; DROP INDEX IF EXISTS books_author_lower; "
+                    "DROP INDEX IF EXISTS books_genre_lower; DROP INDEX IF EXISTS books_top_rated_genre; "
+                    "DROP TRIGGER IF EXISTS books_fts_insert; DROP TRIGGER IF EXISTS books_fts_delete; "
+                    "DROP TRIGGER IF EXISTS books_fts_update; DROP TABLE IF EXISTS books_fts;")
+            self.connection.executescript(LOWER_SCHEMA)
+            try:
+                existed = self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'").fetchone()
+                self.connection.executescript(FTS_SCHEMA)
+                if not existed:
+                    self.connection.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+                self.has_fts = True
+            except sqlite3.OperationalError:  # SQLite built without FTS5 falls back to scanning
+                self.has_fts = False
+            if self.has_fts:
+                existed = self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'books_words'").fetchone()
+                self.connection.executescript(WORDS_SCHEMA)
+                if not existed:  # Index the rows of a database created before ranked search
+                    self.connection.execute("INSERT INTO books_words (books_words) VALUES ('rebuild')")
+            if any(column[1] == "borrowed_log" for column in self.connection.execute("PRAGMA table_info(users)")):
+                # Histories of a database from before borrow_log were a JSON column on users; moved here once
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO borrow_log (username, seq, title, action, at) "
+                    "SELECT u.username, CAST(e.key AS INTEGER), json_extract(e.value, '$[0]'), "
+                    "json_extract(e.value, '$[1]'), json_extract(e.value, '$[2]') "
+                    "FROM users u, json_each(u.borrowed_log) e WHERE u.borrowed_log != '[]'")
+                self.connection.execute("UPDATE users SET borrowed_log = '[]' WHERE borrowed_log != '[]'")
+            if any(column[1] == "reviews" for column in self.connection.execute("PRAGMA table_info(books)")):
+                # Likewise reviews, once a JSON column on books that every lookup of the book decoded
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO reviews (book_key, seq, text) "
+                    "SELECT b.key, CAST(e.key AS INTEGER), e.value FROM books b, json_each(b.reviews) e "
+                    "WHERE b.reviews != '[]'")
+                self.connection.execute("UPDATE books SET reviews = '[]' WHERE reviews != '[]'")
+            self.connection.commit()
+        self.books = SqliteBooks(self)
+        self.users = SqliteUsers(self)
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    @contextlib.contextmanager
+    def atomic(self):
+        # Everything written inside commits together or not at all. Nested blocks, and transaction() calls
+        # inside them, join the outermost one, so a lend's copy count, loan and borrow log land in one commit.
+        with self.lock:
+            if self.depth:
+                self.depth += 1
+                try:
+                    yield
+                finally:
+                    self.depth -= 1
+                return
+            self.depth = 1
+            try:
+                with self.connection:
+                    yield
+            finally:
+                self.depth = 0
+
+    def checkpoint(self):
+        pass  # Every change is already committed
+
+    def transaction(self, statements):
+        # statements is a list of (sql, params); all of them commit or none do
+        with self.atomic():
+            return [self.connection.execute(sql, params).rowcount for sql, params in statements]
+
+    def put_book(self, key, book):
+        # Inserts a new book, or updates the descriptive fields of an existing one; copy counts only
+        # change through adjust_copies, and ratings and reviews through add_feedback, so a stale Book object
+        # can't overwrite a concurrent lend or another process's review
+        with self.atomic():
+            new = not self.connection.execute("SELECT 1 FROM books WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                f"{INSERT_BOOK} ON CONFLICT (key) DO UPDATE SET title = excluded.title, author = excluded.author, "
+                "genre = excluded.genre, title_lower = excluded.title_lower, author_lower = excluded.author_lower, "
+                "genre_lower = excluded.genre_lower",
+                book_row(key, book))
+            if new:
+                self.connection.executemany("INSERT INTO reviews (book_key, seq, text) VALUES (?, ?, ?)",
+                                            review_rows(key, book))
+
+    def import_books(self, books):
+        # One transaction per chunk; the upsert folds duplicate titles into the existing row's copies
+        with self.atomic():
+            # New rows take ids above the current maximum, which tells added and merged rows apart cheaply
+            last_id = self.connection.execute("SELECT coalesce(max(id), 0) FROM books").fetchone()[0]
+            self.connection.executemany(
+                f"{INSERT_BOOK} ON CONFLICT (key) DO UPDATE SET total_copies = total_copies + excluded.total_copies, "
+                "available_copies = available_copies + excluded.available_copies",
+                (book_row(key, book) for key, book in books))
+            added = self.connection.execute("SELECT coalesce(max(id), 0) FROM books").fetchone()[0] - last_id
+        return added, len(books) - added
+
+    def delete_book(self, key):
+        self.transaction([("DELETE FROM books WHERE key = ?", (key,)), ("DELETE FROM reviews WHERE book_key = ?", (key,))])
+
+    def adjust_copies(self, key, available_delta, total_delta=0):
+        (updated,) = self.transaction([(
+            "UPDATE books SET available_copies = available_copies + ?, total_copies = total_copies + ? "
+            "WHERE key = ? AND available_copies + ? >= 0",
+            (available_delta, total_delta, key, available_delta))])
+        return updated == 1
+
+    def add_feedback(self, key, rating=None, review=None):
+        # Counted up in the UPDATE itself rather than written back from a Book, and the review appended as
+        # its own row, so returns committed by other processes at the same moment each keep theirs
+        statements = []
+        if rating is not None:
+            path = f"$[{ratings.star_index(rating)}]"
+            statements.append((
+                "UPDATE books SET rating_count = rating_count + 1, rating_sum = rating_sum + ?, "
+                "rating_histogram = json_set(rating_histogram, ?, json_extract(rating_histogram, ?) + 1) WHERE key = ?",
+                (rating, path, path, key)))
+        if review:
+            statements.append((
+                "INSERT INTO reviews (book_key, seq, text) SELECT ?, coalesce(max(seq), -1) + 1, ? FROM reviews "
+                "WHERE book_key = ? AND EXISTS (SELECT 1 FROM books WHERE key = ?)", (key, review, key, key)))
+        if not statements:
+            return key in self.books
+        return self.transaction(statements)[0] == 1
+
+    def loan_ledger(self):
+        return SqliteLoans(self)
+
+    def reservations(self):
+        return SqliteReservations(self)
+
+    def data_version(self):
+        # Changes whenever another connection, e.g. another server worker, commits to the database
+        return self.execute("PRAGMA data_version")[0][0]
+
+    def put_user(self, username, user):
+        # The borrow log is not part of the row: it is only appended to, through log_borrow
+        self.transaction([(f"INSERT OR REPLACE INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           user_row(username, user))])
+
+    def log_borrow(self, username, user, title, action):
+        # One INSERT however long the user's history is, numbered after the user's last entry in the same
+        # statement, so lends by other processes for the same user are kept rather than overwritten. The
+        # session's copy of the user gets the entry too. Returns (seq, entry), seq being its borrowed_log index.
+        timestamp = time.time()
+        with self.atomic():
+            self.connection.execute(
+                "INSERT INTO borrow_log (username, seq, title, action, at) "
+                "SELECT ?, coalesce(max(seq), -1) + 1, ?, ?, ? FROM borrow_log WHERE username = ?",
+                (username, title, int(action), timestamp, username))
+            seq = self.connection.execute("SELECT max(seq) FROM borrow_log WHERE username = ?", (username,)).fetchone()[0]
+        user.borrowed_log.record(title, action, timestamp)
+        return seq, user.borrowed_log[len(user.borrowed_log) - 1]
+
+    def borrow_log(self, username):
+        return self.execute("SELECT title, action, at FROM borrow_log WHERE username = ? ORDER BY seq", (username,))
+
+    def delete_user(self, username):
+        self.transaction([("DELETE FROM users WHERE username = ?", (username,)),
+                          ("DELETE FROM borrow_log WHERE username = ?", (username,))])
+
+    def search(self, keyword, filter_option):
+        field = FIELDS.get(filter_option)
+        if field is None:
+            return []
+        keyword = keyword.lower()
+
+        if self.has_fts and len(keyword) >= 3:
+            escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            rows = self.execute(
+                f"SELECT {prefixed('b.', BOOK_COLUMNS)} FROM books_fts f JOIN books b ON b.id = f.rowid "
+                f"WHERE f.{field}_lower LIKE ? ESCAPE '\\' ORDER BY b.key", (f"%{escaped}%",))
+        else:
+            rows = self.execute(f"SELECT {BOOK_COLUMNS} FROM books WHERE instr({field}_lower, ?) > 0 ORDER BY key",
+                                (keyword,))
+        return [book_from_row(row, self) for row in rows]
+
+    def ranked_search(self, query, limit=10):
+        if not self.has_fts:  # No full-text index to rank from: build a throwaway one from a scan
+            index = ranking.RankedIndex()
+            index.rebuild(dict(self.books.items()))
+            return [(self.books[key], score) for key, score in index.search(query, limit, self._rating_of)]
+
+        groups = []
+        for fields, term in ranking.parse_query(query):
+            tokens = [token for token, _ in self.expand_term(term)]  # bm25() can't weight down typos per word
+            if tokens:
+                columns = " ".join(fields)
+                groups.append(" OR ".join(f'{{{columns}}} : "{token}"' for token in tokens))
+        if not groups:
+            return []
+        # bm25() is lower for better matches, so the rating boost multiplies it further below zero
+        weights = ", ".join(str(weight) for weight in ranking.FIELD_WEIGHTS.values())
+        rows = self.execute(
+            f"SELECT {prefixed('b.', BOOK_COLUMNS)}, bm25(books_words, {weights}) "
+            f"* (1 + {ranking.RATING_WEIGHT} * ({RATING_SCORE} - {ratings.PRIOR_MEAN})) AS rank "
+            "FROM books_words w JOIN books b ON b.id = w.rowid WHERE books_words MATCH ? ORDER BY rank LIMIT ?",
+            (" OR ".join(f"({group})" for group in groups), limit))
+        return [(book_from_row(row[:-1], self), -row[-1]) for row in rows]
+
+    def expand_term(self, term):
+        # Same rule as RankedIndex.expand. Misspellings are looked up among indexed words with the same
+        # first letter and a close length, a range scan of the vocabulary's sorted term column.
+        if self.execute("SELECT 1 FROM books_words_vocab WHERE term = ?", (term,)):
+            return [(term, 1.0)]
+        limit = ranking.max_typos(term)
+        if not limit:
+            return []
+        rows = self.execute("SELECT term FROM books_words_vocab WHERE term >= ? AND term < ? "
+                            "AND length(term) BETWEEN ? AND ?",
+                            (term[0], chr(ord(term[0]) + 1), len(term) - limit, len(term) + limit))
+        matches = []
+        for (token,) in rows:
+            distance = ranking.edit_distance(term, token, limit)
+            if distance <= limit:
+                matches.append((token, ranking.TYPO_PENALTY ** distance))
+        return matches
+
+    def _rating_of(self, key):
+        book = self.books.get(key)
+        return book.bayesian_rating() if book else ratings.PRIOR_MEAN
+
+    def top_rated(self, n, genre=None):
+        if genre is None:
+            rows = self.execute(f"SELECT {BOOK_COLUMNS} FROM books WHERE rating_count > 0 "
+                                f"ORDER BY {RATING_SCORE} DESC LIMIT ?", (n,))
+        else:
+            rows = self.execute(f"SELECT {BOOK_COLUMNS} FROM books WHERE rating_count > 0 AND genre_lower = ? "
+                                f"ORDER BY {RATING_SCORE} DESC LIMIT ?", (genre.lower(), n))
+        return [book_from_row(row, self) for row in rows]
+
+    def list_books(self, offset=0, limit=20, after=None):
+        # Served in key order from the unique index on key, which is the lowercased title
+        if after is not None:
+            rows = self.execute(f"SELECT {BOOK_COLUMNS} FROM books WHERE key > ? ORDER BY key LIMIT ?", (after, limit))
+        else:
+            rows = self.execute(f"SELECT {BOOK_COLUMNS} FROM books ORDER BY key LIMIT ? OFFSET ?", (limit, offset))
+        return [book_from_row(row, self) for row in rows]
+
+    def replace_all(self, books, users, lazy=False):
+        # Restoring a backup loads it into the database in one transaction
+        with self.atomic():
+            self.connection.execute("DELETE FROM books")
+            self.connection.execute("DELETE FROM reviews")
+            self.connection.execute("DELETE FROM users")
+            self.connection.execute("DELETE FROM borrow_log")
+            self.connection.executemany(INSERT_BOOK, (book_row(key, books[key]) for key in books))
+            self.connection.executemany("INSERT INTO reviews (book_key, seq, text) VALUES (?, ?, ?)",
+                                        (row for key in books for row in review_rows(key, books[key])))
+            self.connection.executemany(f"INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (user_row(username, users[username]) for username in users))
+            self.connection.executemany(
+                "INSERT INTO borrow_log (username, seq, title, action, at) VALUES (?, ?, ?, ?, ?)",
+                ((username, seq, title, int(action), timestamp) for username in users
+                 for seq, (title, action, timestamp) in enumerate(users[username].borrowed_log)))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SqliteBooks(MutableMapping):
+    # Read-through mapping so existing code can keep using library.books.get(key)
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getitem__(self, key):
+        rows = self.storage.execute(f"SELECT {BOOK_COLUMNS} FROM books WHERE key = ?", (key,))
+        if not rows:
+            raise KeyError(key)
+        return book_from_row(rows[0], self.storage)
+
+    def __setitem__(self, key, book):
+        self.storage.put_book(key, book)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.storage.delete_book(key)
+
+    def __contains__(self, key):
+        return bool(self.storage.execute("SELECT 1 FROM books WHERE key = ?", (key,)))
+
+    def __iter__(self):
+        for (key,) in self.storage.execute("SELECT key FROM books ORDER BY key"):
+            yield key
+
+    def __len__(self):
+        return self.storage.execute("SELECT count(*) FROM books")[0][0]
+
+    def values(self):
+        for row in self.storage.execute(f"SELECT {BOOK_COLUMNS} FROM books ORDER BY key"):
+            yield book_from_row(row, self.storage)
+
+    def items(self):
+        for row in self.storage.execute(f"SELECT {BOOK_COLUMNS} FROM books ORDER BY key"):
+            yield row[0], book_from_row(row, self.storage)
+
+
+class StoredReviews(Sequence):
+    # A SQLite book's reviews, read from the reviews table the first time they are used, so the lookups
+    # behind lending and returning don't load them. New reviews are stored by add_feedback; append() only
+    # updates this copy.
+    __slots__ = ("storage", "key", "texts")
+
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.key = key
+        self.texts = None
+
+    def _load(self):
+        if self.texts is None:
+            self.texts = [text for (text,) in self.storage.execute(
+                "SELECT text FROM reviews WHERE book_key = ? ORDER BY seq", (self.key,))]
+        return self.texts
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __len__(self):
+        return len(self._load())
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self._load())
+
+    def append(self, review):
+        self._load().append(review)
+
+
+class SqliteUsers(MutableMapping):
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getitem__(self, username):
+        rows = self.storage.execute(f"SELECT {USER_COLUMNS} FROM users WHERE username = ?", (username,))
+        if not rows:
+            raise KeyError(username)
+        return user_from_row(rows[0], self.storage.borrow_log(username))
+
+    def __setitem__(self, username, user):
+        self.storage.put_user(username, user)
+
+    def __delitem__(self, username):
+        if username not in self:
+            raise KeyError(username)
+        self.storage.delete_user(username)
+
+    def __contains__(self, username):
+        return bool(self.storage.execute("SELECT 1 FROM users WHERE username = ?", (username,)))
+
+    def __iter__(self):
+        for (username,) in self.storage.execute("SELECT username FROM users ORDER BY username"):
+            yield username
+
+    def __len__(self):
+        return self.storage.execute("SELECT count(*) FROM users")[0][0]
+
+
+LOAN_COLUMNS = "id, username, key, lent_at, due_at, reminder_stage"
+
+
+class SqliteLoans:
+    # LoanLedger backed by the loans table, so every process using the database sees the same loans.
+    # The index on due_at does the job of the in-memory due-date heap, and reminder_stage (0 none sent,
+    # 1 due-soon sent, 2 overdue sent) is claimed with a conditional UPDATE so only one process sends each.
+    def __init__(self, storage, loan_days=14, reminder_days=2):
+        self.storage = storage
+        self.loan_seconds = loan_days * DAY
+        self.reminder_seconds = reminder_days * DAY
+
+    def open(self, username, key, lent_at=None, due_at=None, loan_id=None, reminder_stage=0):
+        lent_at = lent_at or time.time()
+        due_at = due_at or lent_at + self.loan_seconds
+        with self.storage.atomic():
+            cursor = self.storage.connection.execute(
+                f"INSERT INTO loans ({LOAN_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (loan_id, username, key, lent_at, due_at, reminder_stage))
+        return Loan(cursor.lastrowid, username, key, lent_at, due_at, reminder_stage)
+
+    def close(self, username, key):
+        # The DELETE's row count decides between two processes closing the same loan at once
+        while True:
+            rows = self.storage.execute(f"SELECT {LOAN_COLUMNS} FROM loans WHERE username = ? AND key = ? "
+                                        "ORDER BY lent_at LIMIT 1", (username, key))
+            if not rows:
+                return None
+            (deleted,) = self.storage.transaction([("DELETE FROM loans WHERE id = ?", (rows[0][0],))])
+            if deleted:
+                return Loan(*rows[0])
+
+    def get(self, loan_id):
+        rows = self.storage.execute(f"SELECT {LOAN_COLUMNS} FROM loans WHERE id = ?", (loan_id,))
+        return Loan(*rows[0]) if rows else None
+
+    def for_user(self, username):
+        return self._query("WHERE username = ? ORDER BY due_at", (username,))
+
+    def for_book(self, key):
+        return self._query("WHERE key = ? ORDER BY due_at", (key,))
+
+    def due_before(self, deadline, limit=None):
+        return self._query("WHERE due_at <= ? ORDER BY due_at LIMIT ?", (deadline, -1 if limit is None else limit))
+
+    def overdue(self, now=None, limit=None):
+        return self.due_before(now or time.time(), limit)
+
+    def due_soon(self, within_days=None, now=None, limit=None):
+        now = now or time.time()
+        horizon = within_days * DAY if within_days is not None else self.reminder_seconds
+        return self._query("WHERE due_at > ? AND due_at <= ? ORDER BY due_at LIMIT ?",
+                           (now, now + horizon, -1 if limit is None else limit))
+
+    def pop_reminders(self, now=None):
+        # A loan already past due when first seen gets only the overdue notice
+        now = now or time.time()
+        loans = self._query("WHERE reminder_stage < 2 AND due_at <= ? ORDER BY due_at", (now + self.reminder_seconds,))
+        batch = []
+        for loan in loans:
+            target = 2 if loan.due_at <= now else 1
+            if loan.reminder_stage < target:
+                (claimed,) = self.storage.transaction([(
+                    "UPDATE loans SET reminder_stage = ? WHERE id = ? AND reminder_stage = ?",
+                    (target, loan.loan_id, loan.reminder_stage))])
+                if claimed:
+                    loan.reminder_stage = target
+                    batch.append((loan, OVERDUE if target == 2 else DUE_SOON))
+        return batch
+
+    def drop_book(self, key):
+        return self._drop("key", key)
+
+    def clear(self):
+        self.storage.transaction([("DELETE FROM loans", ())])
+
+    def __len__(self):
+        return self.storage.execute("SELECT count(*) FROM loans")[0][0]
+
+    def __iter__(self):
+        return iter(self._query("ORDER BY id", ()))
+
+    def _query(self, where, params):
+        return [Loan(*row) for row in self.storage.execute(f"SELECT {LOAN_COLUMNS} FROM loans {where}", params)]
+
+    def _drop(self, column, value):
+        with self.storage.atomic():
+            rows = self.storage.connection.execute(
+                f"SELECT {LOAN_COLUMNS} FROM loans WHERE {column} = ?", (value,)).fetchall()
+            self.storage.connection.execute(f"DELETE FROM loans WHERE {column} = ?", (value,))
+        return [Loan(*row) for row in rows]
+
+
+class SqliteReservations:
+    # Reservations kept in the waitlist and holds tables. A held copy is already out of available_copies,
+    # so the hold has to outlive the process that placed it; every process also serves the same queues.
+    # As with loans, the row count of a DELETE decides which process gets a queued user or an expired hold.
+    def __init__(self, storage, hold_seconds=48 * 3600):
+        self.storage = storage
+        self.hold_seconds = hold_seconds
+
+    def enqueue(self, key, username):
+        with self.storage.atomic():
+            connection = self.storage.connection
+            if connection.execute("SELECT 1 FROM holds WHERE key = ? AND username = ?", (key, username)).fetchone():
+                return None
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO waitlist (key, username, position) "
+                "SELECT ?, ?, coalesce(max(position), 0) + 1 FROM waitlist WHERE key = ?", (key, username, key)).rowcount
+            if not inserted:
+                return None
+            return connection.execute("SELECT count(*) FROM waitlist WHERE key = ?", (key,)).fetchone()[0]
+
+    def next_waiting(self, key):
+        while True:
+            rows = self.storage.execute("SELECT username, position FROM waitlist WHERE key = ? "
+                                        "ORDER BY position LIMIT 1", (key,))
+            if not rows:
+                return None
+            username, position = rows[0]
+            (deleted,) = self.storage.transaction([(
+                "DELETE FROM waitlist WHERE key = ? AND username = ? AND position = ?", (key, username, position))])
+            if deleted:
+                return username
+
+    def requeue_front(self, key, username):
+        self.storage.transaction([(
+            "INSERT OR IGNORE INTO waitlist (key, username, position) "
+            "SELECT ?, ?, coalesce(min(position), 1) - 1 FROM waitlist WHERE key = ?", (key, username, key))])
+
+    def hold(self, key, username, now=None):
+        deadline = (now or time.time()) + self.hold_seconds
+        self.storage.transaction([(
+            "INSERT OR REPLACE INTO holds (key, username, deadline) VALUES (?, ?, ?)", (key, username, deadline))])
+        return deadline
+
+    def claim(self, key, username):
+        (deleted,) = self.storage.transaction([("DELETE FROM holds WHERE key = ? AND username = ?", (key, username))])
+        return deleted == 1
+
+    def pop_expired(self, now=None):
+        expired = []
+        for key, username, deadline in self.storage.execute(
+                "SELECT key, username, deadline FROM holds WHERE deadline <= ? ORDER BY deadline", (now or time.time(),)):
+            (deleted,) = self.storage.transaction([(
+                "DELETE FROM holds WHERE key = ? AND username = ? AND deadline = ?", (key, username, deadline))])
+            if deleted:
+                expired.append((key, username))
+        return expired
+
+    def waiting_books(self):
+        return {key for (key,) in self.storage.execute("SELECT DISTINCT key FROM waitlist")}
+
+    def deadline(self, key, username):
+        rows = self.storage.execute("SELECT deadline FROM holds WHERE key = ? AND username = ?", (key, username))
+        return rows[0][0] if rows else None
+
+    def held(self):
+        return [tuple(row) for row in self.storage.execute("SELECT key, username, deadline FROM holds")]
+
+    def restore(self, holds):
+        with self.storage.atomic():
+            self.storage.connection.execute("DELETE FROM waitlist")
+            self.storage.connection.execute("DELETE FROM holds")
+            self.storage.connection.executemany("INSERT OR REPLACE INTO holds (key, username, deadline) VALUES (?, ?, ?)", holds)
+
+    def cancel_user(self, username):
+        with self.storage.atomic():
+            released = [key for (key,) in self.storage.connection.execute(
+                "SELECT key FROM holds WHERE username = ?", (username,))]
+            self.storage.connection.execute("DELETE FROM holds WHERE username = ?", (username,))
+            self.storage.connection.execute("DELETE FROM waitlist WHERE username = ?", (username,))
+        return released
+
+    def drop(self, key):
+        with self.storage.atomic():
+            users = [username for (username,) in self.storage.connection.execute(
+                "SELECT username FROM waitlist WHERE key = ? ORDER BY position", (key,))]
+            users += [username for (username,) in self.storage.connection.execute(
+                "SELECT username FROM holds WHERE key = ?", (key,))]
+            self.storage.connection.execute("DELETE FROM waitlist WHERE key = ?", (key,))
+            self.storage.connection.execute("DELETE FROM holds WHERE key = ?", (key,))
+        return users
+
+
+def prefixed(prefix, columns):
+    return ", ".join(prefix + column.strip() for column in columns.split(","))
+
+
+def book_row(key, book):
+    return (key, book.title, book.author, book.genre, book.total_copies, book.available_copies,
+            book.rating_count, book.rating_sum, json.dumps(list(book.rating_histogram)),
+            book.title.lower(), book.author.lower(), book.genre.lower())
+
+
+def review_rows(key, book):
+    return [(key, seq, text) for seq, text in enumerate(book.reviews)]
+
+
+def book_from_row(row, storage):
+    key, title, author, genre, total_copies, available_copies, rating_count, rating_sum, rating_histogram = row
+    book = Book(title, author, genre, total_copies)
+    book.available_copies = available_copies
+    book.rating_count = rating_count
+    book.rating_sum = rating_sum
+    book.rating_histogram = array('I', json.loads(rating_histogram))
+    book.reviews = StoredReviews(storage, key)
+    return book
+
+
+def user_row(username, user):
+    hashed_password = user.hashed_password
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return (username, hashed_password, json.dumps(user.security_questions), json.dumps(user.security_answers),
+            user.email, user.wrong_attempts, user.cooldown_end_time.isoformat() if user.cooldown_end_time else None)
+
+
+def user_from_row(row, borrow_log):
+    from datetime import datetime
+
+    username, hashed_password, questions, answers, email, wrong_attempts, cooldown_end_time = row
+    user = User(username, hashed_password, email=email)
+    user.security_questions = json.loads(questions)
+    user.security_answers = json.loads(answers)
+    user.borrowed_log = BorrowedLog.from_list(borrow_log)
+    user.wrong_attempts = wrong_attempts
+    user.cooldown_end_time = datetime.fromisoformat(cooldown_end_time) if cooldown_end_time else None
+    return user
@@ -0,0 +1,121 @@
+import os
+import socketserver
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import library as library_module  # noqa: E402
+import models  # noqa: E402
+from library import Book, Library, User  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+
+def make_library(storage=None, readers=("alice", "bob")):
+    # Accounts are stored directly with a placeholder hash; tests log in by setting logged_in_user
+    library = Library(storage or MemoryStorage())
+    for username in ("admin",) + tuple(readers):
+        library.storage.put_user(username, User(username, "unused", email=f"{username}@example.com"))
+    return library
+
+
+def log_in(library, username):
+    library.logged_in_user = library.users[username]
+    return library
+
+
+def add_books(library, *titles, copies=1, genre="Fiction"):
+    for title in titles:
+        library.storage.put_book(title.lower(), Book(title, "Some Author", genre, copies))
+
+
+class Outbox:
+    def __init__(self):
+        self.messages = []
+
+    def submit(self, to_addr, subject, body):
+        self.messages.append((to_addr, subject, body))
+        return True
+
+
+@pytest.fixture(autouse=True)
+def outbox(monkeypatch):
+    # Notifications and reset emails are collected here instead of going to the SMTP dispatcher
+    outbox = Outbox()
+    monkeypatch.setattr(library_module, "get_mail_dispatcher", lambda: outbox)
+    monkeypatch.setattr(models, "get_mail_dispatcher", lambda: outbox)
+    return outbox
+
+
+@pytest.fixture
+def library():
+    return make_library()
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "library.db")
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    # Just enough SMTP for smtplib: every command is accepted, DATA is read up to the lone "."
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 stand-in ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            server.commands.append(command.split(" ")[0])
+            if command.startswith("DATA"):
+                self.reply("354 end with <CRLF>.<CRLF>")
+                lines = []
+                for data in iter(self.rfile.readline, b""):
+                    if data == b".\r\n":
+                        break
+                    lines.append(data.decode())
+                server.in_data.set()
+                server.gate.wait(5)
+                if server.fail_next > 0:
+                    server.fail_next -= 1
+                    self.reply("451 try again later")
+                else:
+                    server.messages.append("".join(lines))
+                    self.reply("250 queued")
+            elif command.startswith("QUIT"):
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.connections = 0
+        self.commands = []
+        self.messages = []
+        self.fail_next = 0
+        self.in_data = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+
+@pytest.fixture
+def smtp_server():
+    server = SmtpServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+
+import library as library_module
+import throttle as throttle_module
+from auth import AuthEngine
+from conftest import add_books, log_in
+from library import User
+from throttle import LoginThrottle, MemoryThrottleStore, SqliteThrottleStore
+
+
+def test_account_with_open_loans_is_not_deleted(library, monkeypatch, capsys):
+    add_books(library, "Dune")
+    monkeypatch.setattr("builtins.input", lambda prompt="": "yes")
+    log_in(library, "alice").lend_book("Dune")
+
+    library.delete_account()
+    assert "Return them before deleting your account" in capsys.readouterr().out
+    assert "alice" in library.users and len(library.loans.for_user("alice")) == 1
+
+    library.return_book("Dune")
+    library.delete_account()
+    assert "alice" not in library.users
+    assert library.books["dune"].available_copies == 1
+
+
+class Clock:
+    # Stands in for the time module, so lockouts and refills can be stepped through without sleeping
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+BASE = 600_000.0  # A whole number of failure windows, so the first window starts here
+
+
+def make_throttle(store=None, **limits):
+    settings = dict(user_rate=1, user_burst=3, source_rate=100, source_burst=100, global_rate=100,
+                    global_burst=100, max_failures=3, failure_window=60, lockout_seconds=30)
+    settings.update(limits)
+    return LoginThrottle(store or MemoryThrottleStore(), **settings)
+
+
+def test_token_bucket_refills_at_its_rate():
+    throttle = make_throttle()
+    assert [throttle.check("alice", now=BASE) for _ in range(3)] == [None, None, None]
+    assert throttle.check("alice", now=BASE) == ("rate_limited", 1.0)
+    assert throttle.check("alice", now=BASE + 0.5) == ("rate_limited", 0.5)
+    assert throttle.check("alice", now=BASE + 1.0) is None
+    assert throttle.check("bob", now=BASE + 1.0) is None  # Buckets are per username
+    # A long pause refills only up to the burst
+    assert [throttle.check("alice", now=BASE + 100) for _ in range(4)][-1] == ("rate_limited", 1.0)
+
+
+def test_source_bucket_limits_many_usernames_from_one_client():
+    throttle = make_throttle(source_rate=1, source_burst=2)
+    assert throttle.check("alice", "10.0.0.1", now=BASE) is None
+    assert throttle.check("bob", "10.0.0.1", now=BASE) is None
+    assert throttle.check("carol", "10.0.0.1", now=BASE)[0] == "rate_limited"
+    assert throttle.check("carol", "10.0.0.2", now=BASE) is None
+
+
+def test_failures_count_over_a_sliding_window():
+    throttle = make_throttle()
+    assert throttle.record_failure("alice", now=BASE) == 0
+    assert throttle.record_failure("alice", now=BASE + 10) == 0
+    # Next window: the previous window's two failures still count for the part of it that overlaps
+    assert throttle.record_failure("alice", now=BASE + 70) == 0  # 2 * 50/60 + 1 < 3
+    assert throttle.record_failure("alice", now=BASE + 75) == BASE + 105  # 2 * 45/60 + 2 >= 3
+
+
+def test_failures_older_than_the_window_are_forgotten():
+    throttle = make_throttle()
+    throttle.record_failure("alice", now=BASE)
+    throttle.record_failure("alice", now=BASE + 10)
+    assert throttle.record_failure("alice", now=BASE + 130) == 0
+    assert throttle.record_failure("alice", now=BASE + 131) == 0
+
+
+def test_lockout_expires_and_counting_starts_over():
+    throttle = make_throttle()
+    for second in range(3):
+        locked_until = throttle.record_failure("alice", now=BASE + second)
+    assert locked_until == BASE + 32
+    assert throttle.check("alice", now=BASE + 31) == ("cooldown", 1.0)
+    assert throttle.check("alice", now=BASE + 32) is None
+    assert throttle.record_failure("alice", now=BASE + 33) == 0
+
+
+def test_success_clears_failures():
+    throttle = make_throttle()
+    throttle.record_failure("alice", now=BASE)
+    throttle.record_failure("alice", now=BASE + 1)
+    throttle.record_success("alice")
+    assert throttle.record_failure("alice", now=BASE + 2) == 0
+
+
+def test_memory_store_evicts_the_least_recently_used_key():
+    store = MemoryThrottleStore(max_keys=2)
+    throttle = make_throttle(store)
+    throttle.record_failure("alice", now=BASE)
+    throttle.record_failure("bob", now=BASE)
+    throttle.record_failure("alice", now=BASE + 1)
+    throttle.record_failure("carol", now=BASE + 1)
+    assert list(store.states) == ["failures:alice", "failures:carol"]
+
+
+def test_sqlite_store_prunes_the_least_recently_touched_keys(tmp_path, monkeypatch):
+    clock = Clock(BASE)
+    monkeypatch.setattr(throttle_module, "time", clock)
+    store = SqliteThrottleStore(str(tmp_path / "throttle.db"), max_keys=2)
+    store.PRUNE_EVERY = 1
+    throttle = make_throttle(store)
+    for username in ("alice", "bob", "alice", "carol"):
+        clock.now += 1
+        throttle.record_failure(username)
+    keys = [key for (key,) in store.connection.execute("SELECT key FROM throttle ORDER BY key")]
+    assert keys == ["failures:alice", "failures:carol"]
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "throttle.db")
+    first, second = make_throttle(SqliteThrottleStore(path)), make_throttle(SqliteThrottleStore(path))
+    first.record_failure("alice", now=BASE)
+    second.record_failure("alice", now=BASE + 1)
+    assert first.record_failure("alice", now=BASE + 2) == BASE + 32
+    assert second.check("alice", now=BASE + 3) == ("cooldown", 29.0)
+
+    for throttle in (first, second, first):
+        assert throttle.check("bob", now=BASE) is None
+    assert second.check("bob", now=BASE) == ("rate_limited", 1.0)
+
+
+def test_unknown_usernames_are_locked_out_like_real_ones(library, monkeypatch, capsys):
+    clock = Clock(BASE)
+    monkeypatch.setattr(throttle_module, "time", clock)
+    monkeypatch.setattr(library_module, "time", clock)
+    checked = []
+    monkeypatch.setattr(library.auth, "check_password", lambda password, hashed: checked.append(password))
+    library.throttle = make_throttle()
+
+    for _ in range(3):
+        clock.now += 1
+        assert library.login("ghost", "guess") is None
+    assert "Account is now in cooldown for 30 seconds" in capsys.readouterr().out
+    clock.now += 1
+    assert library.login("ghost", "guess") is None
+    assert "Account is in cooldown" in capsys.readouterr().out
+
+    for _ in range(3):
+        clock.now += 1
+        library.login("alice", "guess")
+    clock.now += 1
+    library.login("alice", "right")  # Turned away before the password is checked
+    assert checked == ["guess"] * 3
+    clock.now += 30
+    library.login("alice", "right")
+    assert checked[-1] == "right"
+
+
+def test_auth_engine_hashes_and_checks_on_its_pool():
+    engine = AuthEngine(max_workers=2, rounds=4)
+    hashed = engine.hash_password("secret")
+    assert engine.check_password("secret", hashed)
+    assert engine.check_password("secret", hashed.decode("utf-8"))  # As restored from a JSON backup
+    assert not engine.check_password("wrong", hashed)
+    assert asyncio.run(engine.check_password_async("secret", hashed))
+
+    metrics = {kind: stats.snapshot() for kind, stats in engine.metrics.items()}
+    assert metrics["hash"]["count"] == 1 and metrics["check"]["count"] == 4
+    assert 0 < metrics["check"]["p50"] <= metrics["check"]["max"]
+    engine.shutdown()
+
+
+def test_async_logins_are_checked_in_parallel(library, monkeypatch):
+    # Each check waits for the other at a barrier, which only works if both run at once
+    library.auth = AuthEngine(max_workers=2, rounds=4)
+    for username in ("alice", "bob"):
+        library.storage.put_user(username, User(username, library.auth.hash_password(f"{username}-pw")))
+    barrier = threading.Barrier(2, timeout=5)
+    check = library.auth._check
+    monkeypatch.setattr(library.auth, "_check", lambda *args: barrier.wait() is not None and check(*args))
+
+    async def log_both_in():
+        return await asyncio.gather(library.open_session().login_async("alice", "alice-pw"),
+                                    library.open_session().login_async("bob", "wrong"))
+
+    alice, bob = asyncio.run(log_both_in())
+    assert alice is library.users["alice"] and bob is None
+    assert library.logged_in_user is None
+    library.auth.shutdown()
@@ -0,0 +1,60 @@
+import json
+
+import backup
+from conftest import add_books, log_in, make_library
+
+
+def backed_up_library(filename):
+    library = make_library()
+    add_books(library, "Dune", "Emma", "Ulysses", copies=2)
+    log_in(library, "alice").lend_book("Dune")
+    library.backup_data(filename)
+    return library
+
+
+def test_lazy_restore_builds_records_on_first_access(tmp_path):
+    filename = str(tmp_path / "backup.jsonl")
+    backed_up_library(filename)
+
+    restored = make_library(readers=())
+    restored.restore_data(filename, lazy=True)
+    books = restored.storage.books
+    assert isinstance(books, backup.LazyRecords) and not books.loaded
+    assert len(books) == 3 and "emma" in books and not books.loaded
+
+    assert books["dune"].available_copies == 1
+    assert list(books.loaded) == ["dune"]
+    assert books["dune"] is books["dune"]
+    assert restored.users["alice"].borrowed_log.to_list()[0][0] == "Dune"
+    assert [book.title for book in restored.search_books("u", 1)] == ["Dune", "Ulysses"]
+
+
+def test_lazy_restore_reads_the_latest_appended_record(tmp_path):
+    filename = str(tmp_path / "backup.jsonl")
+    library = backed_up_library(filename)
+    library.return_book("Dune")
+    log_in(library, "admin").delete_book("Emma")
+    library.backup_data(filename, incremental=True)
+
+    for lazy in (False, True):
+        restored = make_library(readers=())
+        restored.restore_data(filename, lazy=lazy)
+        assert sorted(restored.books) == ["dune", "ulysses"]
+        assert restored.books["dune"].available_copies == 2
+        assert not restored.loans.for_user("alice")
+
+
+def test_older_single_document_backups_still_restore(tmp_path, capsys):
+    filename = str(tmp_path / "backup.json")
+    library = backed_up_library(str(tmp_path / "backup.jsonl"))
+    data = {"books": {key: backup.book_record(key, book) for key, book in library.books.items()},
+            "users": {username: backup.user_record(username, user) for username, user in library.users.items()},
+            "logged_in_user": "alice"}
+    with open(filename, "w") as file:
+        json.dump(data, file, indent=4)
+
+    restored = make_library(readers=())
+    restored.restore_data(filename, lazy=True)
+    assert "Welcome back, alice!" in capsys.readouterr().out
+    assert restored.books["dune"].available_copies == 1
+    assert restored.logged_in_user is restored.users["alice"]
@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+SCENARIOS = ["search", "search_uncached", "display_first_page", "display_all", "lend_return",
+             "lend_return_journaled", "login_rejected", "backup_full", "backup_incremental", "restore_eager",
+             "restore_lazy", "restore_mapped", "search_mapped"]  # All but login, which is bcrypt at full cost
+
+
+def run_harness(*args):
+    return subprocess.run([sys.executable, os.path.join(BENCHMARKS, "run.py"), *args],
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_harness_runs_every_scenario_and_compares_results(tmp_path):
+    output = str(tmp_path / "results.json")
+    printed = run_harness("--sizes", "50", "--users", "2", "--repeat", "1", "--memory",
+                          "--scenarios", ",".join(SCENARIOS), "-o", output)
+    assert "Data backed up" not in printed  # Library prints are kept out of the timings
+
+    with open(output) as file:
+        results = json.load(file)
+    assert [result["scenario"] for result in results["results"]] == ["build_catalog"] + SCENARIOS
+    assert all(result["size"] == 50 and result["ops"] > 0 and result["median_s"] >= 0
+               and result["peak_bytes"] is not None for result in results["results"])
+
+    compared = run_harness("--compare", output, output).splitlines()
+    assert len(compared) == 1 + len(SCENARIOS) + 1
+    assert all(line.endswith("1.00x") for line in compared[1:])
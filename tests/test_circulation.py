@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from conftest import add_books, log_in, make_library
+from library import Library
+from storage import MemoryStorage, SqliteStorage
+
+READERS = tuple(f"reader{n}" for n in range(8))
+
+
+def lend_and_return(library, username, title):
+    log_in(library.open_session(), username).lend_book(title)
+    log_in(library.open_session(), username).return_book(title)
+
+
+def counts(library, genre=None):
+    return [(book.title, lends) for book, lends in library.most_borrowed(genre=genre)]
+
+
+def test_genre_lookup_ignores_case(library):
+    add_books(library, "Dune", genre="Science Fiction")
+    lend_and_return(library, "alice", "Dune")
+    assert counts(library, "science fiction") == counts(library, "SCIENCE FICTION") == [("Dune", 1)]
+    assert library.circulation.circulation_by_genre() == {"science fiction": 1}
+
+
+def test_popularity_and_history_survive_journal_replay(tmp_path):
+    journal_dir = str(tmp_path / "journal")
+    library = make_library()
+    library.open_journal(journal_dir)
+    admin = log_in(library.open_session(), "admin")
+    admin.add_book("Dune", "Frank Herbert", "Science Fiction")
+    admin.add_book("Emma", "Jane Austen", "Romance")
+    lend_and_return(library, "alice", "Dune")
+    lend_and_return(library, "bob", "Dune")
+    lend_and_return(library, "bob", "Emma")
+    library.close()
+
+    restarted = make_library(readers=())
+    restarted.load_journal(journal_dir)
+    assert counts(restarted) == [("Dune", 2), ("Emma", 1)]
+    lend_and_return(restarted, "alice", "Emma")  # Counted once, not again by the rebuild
+    assert counts(restarted) == [("Dune", 2), ("Emma", 2)]
+    assert [key for _, _, key in log_in(restarted, "bob").borrowing_history()] == ["dune", "dune", "emma", "emma"]
+
+
+def test_popularity_survives_restart_on_sqlite(sqlite_path):
+    library = make_library(SqliteStorage(sqlite_path))
+    add_books(library, "Dune", genre="Science Fiction")
+    lend_and_return(library, "alice", "Dune")
+
+    restarted = Library(SqliteStorage(sqlite_path))
+    assert counts(restarted, "Science Fiction") == [("Dune", 1)]
+
+
+def test_restore_replaces_circulation(library, tmp_path):
+    filename = str(tmp_path / "backup.jsonl")
+    add_books(library, "Dune")
+    library.backup_data(filename)
+    lend_and_return(library, "alice", "Dune")
+    assert counts(library) == [("Dune", 1)]
+
+    library.restore_data(filename)
+    assert counts(library) == []
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_concurrent_sessions_never_lend_more_copies_than_exist(backend, sqlite_path):
+    library = make_library(SqliteStorage(sqlite_path) if backend == "sqlite" else MemoryStorage(), READERS)
+    add_books(library, "Dune", copies=3)
+    start = threading.Barrier(len(READERS))
+    lent = []
+
+    def borrow(username):
+        session = log_in(library.open_session(), username)
+        start.wait()
+        if session.lend_book("Dune"):
+            lent.append(username)
+
+    threads = [threading.Thread(target=borrow, args=(username,)) for username in READERS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(lent) == 3
+    assert library.books["dune"].available_copies == 0
+    assert sorted(loan.username for loan in library.loans.for_book("dune")) == sorted(lent)
+
+
+def test_async_sessions_lend_and_return_independently(library):
+    add_books(library, "Dune", "Emma")
+
+    async def circulate(username, title):
+        session = log_in(library.open_session(), username)
+        assert await session.lend_book_async(title)
+        assert session.logged_in_user.username == username
+        await session.return_book_async(title)
+
+    async def both():
+        await asyncio.gather(circulate("alice", "Dune"), circulate("bob", "Emma"))
+
+    asyncio.run(both())
+    assert library.logged_in_user is None
+    assert [book.available_copies for book in (library.books["dune"], library.books["emma"])] == [1, 1]
+    assert [entry[0] for entry in library.users["bob"].borrowed_log.to_list()] == ["Emma", "Emma"]
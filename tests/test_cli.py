@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from library import Book
+from storage import MappedStorage, SqliteStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_script(env, *argv):
+    # `python library.py ...` runs library as __main__; -X importtime lists every module it imports
+    result = subprocess.run([sys.executable, "-X", "importtime", os.path.join(ROOT, "library.py"), *argv],
+                            env=dict(os.environ, **env), cwd=ROOT, capture_output=True, text=True, check=True)
+    imported = {line.split("|")[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")}
+    return result.stdout, imported
+
+
+def test_script_search_does_not_import_library_again(tmp_path):
+    database, snapshot = str(tmp_path / "library.db"), str(tmp_path / "catalog.snap")
+    for storage in (SqliteStorage(database), MappedStorage(snapshot)):
+        storage.put_book("dune", Book("Dune", "Frank Herbert", "Science Fiction", 2))
+        storage.checkpoint()
+        storage.close()
+
+    for env in ({"LIBRARY_DB": database}, {"LIBRARY_SNAPSHOT": snapshot}):
+        printed, imported = run_script(env, "search", "--title", "dune")
+        assert "Title: Dune\nAuthor: Frank Herbert" in printed
+        assert "library" not in imported and "models" in imported
+
+
+def test_importing_library_leaves_bcrypt_and_mail_unloaded():
+    check = ("import sys, library; "
+             "print(sorted(name for name in ('bcrypt', 'smtplib', 'dotenv') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_read_only_commands_write_nothing(tmp_path):
+    data_dir = str(tmp_path / "library_data")
+    _, imported = run_script({"LIBRARY_DATA_DIR": data_dir}, "top-rated", "-n", "3")
+    assert not {"bcrypt", "smtplib", "dotenv"} & imported
+    assert not os.path.exists(data_dir)
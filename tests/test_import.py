@@ -0,0 +1,35 @@
+import json
+
+from conftest import log_in
+
+
+def test_bad_rows_are_skipped_and_reported(library, capsys):
+    log_in(library, "admin")
+    rows = [
+        {"title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction", "total_copies": "2"},
+        {"title": "No Author", "genre": "Poetry"},
+        {"title": "Bad Count", "author": "Someone", "genre": "Drama", "total_copies": "two"},
+        {"title": "dune", "author": "Frank Herbert", "genre": "Science Fiction"},
+        {"title": "Zero", "author": "Someone", "genre": "Drama", "total_copies": 0},
+        None,
+    ]
+    assert library.import_books(rows) == 2
+
+    output = capsys.readouterr().out
+    assert "1 new books, 1 merged" in output
+    assert "Skipped 4 invalid rows (first at row 2: missing author)" in output
+    assert library.books["dune"].total_copies == 3
+    assert "no author" not in library.books and "bad count" not in library.books
+
+
+def test_malformed_file_does_not_raise(library, tmp_path, capsys):
+    log_in(library, "admin")
+    path = tmp_path / "feed.jsonl"
+    path.write_text(json.dumps({"title": "Emma", "author": "Jane Austen", "genre": "Romance"}) + "\n{not json\n")
+    assert library.import_books_file(str(path)) == 1
+    assert "Skipped 1 invalid rows" in capsys.readouterr().out
+
+    path = tmp_path / "feed.csv"
+    path.write_bytes(b"title,author,genre\nEmma,Jane Austen,Romance\n\xff\xfe,x,y\n")
+    assert library.import_books_file(str(path)) == 0
+    assert "Could not read" in capsys.readouterr().out
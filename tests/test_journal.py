@@ -0,0 +1,58 @@
+import backup
+from conftest import add_books, log_in, make_library
+from library import Library, User
+from storage import SqliteStorage
+
+
+def test_journal_never_replaces_a_sqlite_catalog(sqlite_path, tmp_path, capsys):
+    journal_dir = str(tmp_path / "journal")
+    first = make_library(SqliteStorage(sqlite_path))
+    add_books(first, "Dune", copies=2)
+    first.open_journal(journal_dir)  # Checkpoints Dune with both copies on the shelf
+    first.close()
+
+    other = Library(SqliteStorage(sqlite_path))  # Another process lends a copy
+    assert log_in(other, "alice").lend_book("Dune")
+
+    restarted = Library(SqliteStorage(sqlite_path))
+    assert restarted.load_journal(journal_dir) is None
+    assert restarted.books["dune"].available_copies == 1
+    assert len(restarted.loans.for_user("alice")) == 1
+
+
+def test_borrow_record_replayed_after_checkpoint_is_not_duplicated(tmp_path):
+    journal_dir = str(tmp_path / "journal")
+    library = make_library()
+    add_books(library, "Dune")
+    library.open_journal(journal_dir)
+    log_in(library, "alice").lend_book("Dune")
+    entry = library.users["alice"].borrowed_log[0]
+    # A checkpoint that ran after the entry was recorded but before it was journaled: the snapshot has the
+    # entry and the next journal generation has its record as well
+    library.journal.checkpoint()
+    library.journal.log(lambda: [backup.borrow_record("alice", 0, entry)])
+    library.close()
+
+    restarted = make_library(readers=())
+    restarted.load_journal(journal_dir)
+    assert restarted.users["alice"].borrowed_log.to_list() == [list(entry)]
+
+
+def test_security_answers_survive_a_restart(tmp_path):
+    journal_dir = str(tmp_path / "journal")
+    library = make_library()
+    questions = ["First pet?", "Home town?"]
+    library.storage.put_user("carol", User("carol", "unused", questions, ["Rex", "Leeds"], "carol@example.com"))
+    library.open_journal(journal_dir)
+    library.close()
+
+    restarted = make_library(readers=())
+    restarted.load_journal(journal_dir)
+    restarted.open_journal(journal_dir)  # Checkpoints what was just loaded, as main() does on every start
+    restarted.close()
+
+    again = make_library(readers=())
+    again.load_journal(journal_dir)
+    user = again.users["carol"]
+    assert user.security_questions == questions
+    assert user.security_answers == {"First pet?": "Rex", "Home town?": "Leeds"}
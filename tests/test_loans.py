@@ -0,0 +1,77 @@
+import pytest
+
+import loans as loans_module
+from conftest import add_books, log_in, make_library
+from loans import DAY, DUE_SOON, OVERDUE, LoanLedger
+from storage import SqliteStorage
+
+NOW = 1_700_000_000.0
+
+
+def make_ledger(kind, sqlite_path):
+    return SqliteStorage(sqlite_path).loan_ledger() if kind == "sqlite" else LoanLedger()
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_each_reminder_is_sent_once(kind, sqlite_path):
+    ledger = make_ledger(kind, sqlite_path)
+    late = ledger.open("alice", "dune", NOW - 20 * DAY)  # Already overdue when reminders first run
+    soon = ledger.open("bob", "emma", NOW - 13 * DAY)  # Due tomorrow
+    ledger.open("carol", "ubik", NOW)
+
+    assert sorted((loan.loan_id, stage) for loan, stage in ledger.pop_reminders(NOW)) == \
+        [(late.loan_id, OVERDUE), (soon.loan_id, DUE_SOON)]
+    assert ledger.pop_reminders(NOW + 1) == []
+    assert [(loan.loan_id, stage) for loan, stage in ledger.pop_reminders(NOW + DAY)] == [(soon.loan_id, OVERDUE)]
+    assert ledger.pop_reminders(NOW + 2 * DAY) == []
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_restored_loans_keep_their_reminder_stage(kind, sqlite_path):
+    ledger = make_ledger(kind, sqlite_path)
+    ledger.open("alice", "dune", NOW, NOW + DAY, loan_id=1, reminder_stage=1)
+    ledger.open("bob", "emma", NOW, NOW - DAY, loan_id=2, reminder_stage=2)
+    assert [(loan.loan_id, stage) for loan, stage in ledger.pop_reminders(NOW)] == []
+    assert [(loan.loan_id, stage) for loan, stage in ledger.pop_reminders(NOW + DAY)] == [(1, OVERDUE)]
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def reminders_sent(outbox):
+    sent = [subject for _, subject, _ in outbox.messages]
+    outbox.messages.clear()
+    return sent
+
+
+def test_reminders_are_not_resent_after_a_restart(tmp_path, monkeypatch, outbox):
+    clock = Clock(NOW)
+    monkeypatch.setattr(loans_module, "time", clock)
+    journal_dir = str(tmp_path / "journal")
+    library = make_library()
+    library.open_journal(journal_dir)
+    add_books(library, "Dune")
+    log_in(library, "alice").lend_book("Dune")
+
+    clock.now += 13 * DAY
+    assert library.send_loan_reminders() == 1
+    assert reminders_sent(outbox) == ["Due soon: 'Dune'"]
+    library.close()
+
+    restarted = make_library(readers=())
+    restarted.load_journal(journal_dir)
+    assert restarted.send_loan_reminders() == 0
+    clock.now += 2 * DAY
+    assert restarted.send_loan_reminders() == 1
+    assert reminders_sent(outbox) == ["Overdue: 'Dune'"]
+
+    filename = str(tmp_path / "backup.jsonl")
+    restarted.backup_data(filename)
+    restored = make_library(readers=())
+    restored.restore_data(filename)
+    assert restored.send_loan_reminders() == 0
@@ -0,0 +1,77 @@
+import time
+
+import utils
+from utils import MailDispatcher
+
+
+def dispatcher(server, **settings):
+    settings.setdefault("backoff", 0.01)
+    return MailDispatcher("127.0.0.1", server.server_address[1], "", "", False, **settings)
+
+
+def test_queued_messages_share_one_session(smtp_server):
+    mail = dispatcher(smtp_server)
+    for number in range(5):
+        assert mail.submit(f"reader{number}@example.com", "Reset", f"code {number}")
+    assert mail.flush(5)
+    mail.close()
+
+    assert mail.sent == 5 and mail.failed == 0
+    assert len(smtp_server.messages) == 5
+    assert "Subject: Reset" in smtp_server.messages[0]
+    assert smtp_server.connections == 1
+    assert smtp_server.commands.count("QUIT") == 1
+
+
+def test_failed_send_is_retried_with_backoff(smtp_server, monkeypatch):
+    delays = []
+    monkeypatch.setattr(utils.time, "sleep", delays.append)
+    smtp_server.fail_next = 2
+    mail = dispatcher(smtp_server, backoff=0.5)
+    mail.submit("reader@example.com", "Reset", "code")
+    assert mail.flush(5)
+
+    assert mail.sent == 1 and mail.failed == 0
+    assert delays == [0.5, 1.0]
+    assert smtp_server.connections == 3  # the session is dropped after each error
+
+
+def test_gives_up_after_max_retries(smtp_server, capsys):
+    smtp_server.fail_next = 10
+    mail = dispatcher(smtp_server, max_retries=2)
+    mail.submit("reader@example.com", "Reset", "code")
+    assert mail.flush(5)
+
+    assert mail.sent == 0 and mail.failed == 1
+    assert smtp_server.connections == 3
+    assert "Failed to send email to reader@example.com" in capsys.readouterr().out
+
+
+def test_full_queue_rejects_without_blocking(smtp_server):
+    smtp_server.gate.clear()
+    mail = dispatcher(smtp_server, max_queue=2)
+    assert mail.submit("first@example.com", "Reset", "code")
+    assert smtp_server.in_data.wait(5)  # the worker holds the first message, the queue is empty again
+
+    assert mail.submit("second@example.com", "Reset", "code")
+    assert mail.submit("third@example.com", "Reset", "code")
+    start = time.monotonic()
+    assert not mail.submit("fourth@example.com", "Reset", "code")
+    assert time.monotonic() - start < 1
+
+    smtp_server.gate.set()
+    assert mail.flush(5)
+    assert mail.sent == 3
+    assert len(smtp_server.messages) == 3
+
+
+def test_idle_session_is_closed(smtp_server):
+    mail = dispatcher(smtp_server, idle_timeout=0.05)
+    mail.submit("reader@example.com", "Reset", "code")
+    assert mail.flush(5)
+    deadline = time.monotonic() + 5
+    while mail.server is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert mail.server is None
+    assert "QUIT" in smtp_server.commands
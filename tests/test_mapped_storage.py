@@ -0,0 +1,114 @@
+import os
+import threading
+
+import catalog_snapshot
+import storage as storage_module
+from conftest import add_books, log_in, make_library
+from library import Book
+from storage import MappedStorage
+
+
+def mapped_library(tmp_path, *titles, overlay_limit=None):
+    storage = MappedStorage(str(tmp_path / "catalog.snap"), overlay_limit)
+    library = make_library(storage)
+    add_books(library, *titles, copies=2)
+    storage.write_snapshot()
+    return library
+
+
+def test_lending_keeps_only_copy_counts(tmp_path):
+    library = mapped_library(tmp_path, "Dune", "Emma")
+    overlay = library.storage.books
+
+    log_in(library, "alice").lend_book("Dune")
+    assert not overlay.changed and len(overlay.counts) == 1
+    assert library.books["dune"].available_copies == 1
+    assert [book.available_copies for book in library.storage.search("dune", 1)] == [1]
+
+    log_in(library, "alice").return_book("Dune", "", "")
+    assert not overlay.changed and not overlay.counts
+    assert library.books["dune"].available_copies == 2
+
+
+def test_overlay_is_folded_past_the_limit(tmp_path):
+    library = mapped_library(tmp_path, "Dune", overlay_limit=2)
+    storage = library.storage
+    storage.put_book("emma", Book("Emma", "Jane Austen", "Fiction", 1))
+    storage.put_book("ulysses", Book("Ulysses", "James Joyce", "Fiction", 1))
+    storage.adjust_copies("dune", -1)
+    assert len(storage.books.changed) == 2
+
+    storage.put_book("walden", Book("Walden", "Henry David Thoreau", "Fiction", 1))
+    assert not storage.books.changed and not storage.books.counts
+    assert sorted(storage.books) == ["dune", "emma", "ulysses", "walden"]
+    assert storage.books["dune"].available_copies == 1
+    assert [(book.title, book.available_copies) for book in storage.search("u", 1)] == [("Dune", 1), ("Ulysses", 1)]
+
+
+def test_checkpoint_folds_the_overlay(tmp_path):
+    library = mapped_library(tmp_path, "Dune", "Emma")
+    log_in(library, "alice").lend_book("Dune")
+    library.storage.delete_book("emma")
+
+    library.checkpoint_records(1)
+    overlay = library.storage.books
+    assert not overlay.changed and not overlay.deleted and not overlay.counts
+
+    reopened = MappedStorage(str(tmp_path / "catalog.snap"))
+    assert list(reopened.books) == ["dune"]
+    assert reopened.books["dune"].available_copies == 1
+
+
+def test_checkpoint_after_lending_alone_keeps_the_file(tmp_path):
+    library = mapped_library(tmp_path, "Dune", "Emma")
+    before = os.stat(tmp_path / "catalog.snap").st_ino
+    log_in(library, "alice").lend_book("Dune")
+
+    library.checkpoint_records(1)
+    assert os.stat(tmp_path / "catalog.snap").st_ino == before
+    assert library.storage.books["dune"].available_copies == 1
+
+
+def test_changes_made_while_a_snapshot_is_written_are_kept(tmp_path, monkeypatch):
+    library = mapped_library(tmp_path, "Dune", "Emma", "Walden")
+    storage = library.storage
+    storage.put_book("ulysses", Book("Ulysses", "James Joyce", "Fiction", 2))
+    storage.adjust_copies("walden", -1)
+    write = storage_module.write_catalog_snapshot
+
+    def concurrent_changes():
+        storage.adjust_copies("dune", -1)
+        storage.adjust_copies("walden", 1)
+        storage.adjust_copies("ulysses", -1)
+        storage.delete_book("emma")
+        storage.put_book("beloved", Book("Beloved", "Toni Morrison", "Fiction", 1))
+
+    def slow_write(path, books):
+        # Run from another thread: with catalog_lock held across the write it would never finish
+        worker = threading.Thread(target=concurrent_changes)
+        worker.start()
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+        write(path, books)
+    monkeypatch.setattr(storage_module, "write_catalog_snapshot", slow_write)
+    storage.write_snapshot()
+
+    assert sorted(storage.books) == ["beloved", "dune", "ulysses", "walden"]
+    copies = {key: storage.books[key].available_copies for key in storage.books}
+    assert copies == {"beloved": 1, "dune": 1, "ulysses": 1, "walden": 2}
+    assert sorted(storage.books.changed) == ["beloved", "ulysses"] and storage.books.deleted == {"emma"}
+    assert [book.title for book in storage.search("d", 1)] == ["Beloved", "Dune", "Walden"]
+
+
+def test_snapshot_search_results_stay_lazy(tmp_path, monkeypatch):
+    library = mapped_library(tmp_path, "Dune", "Dune Messiah", "Emma")
+    built = []
+    view = catalog_snapshot.BookView
+    monkeypatch.setattr(catalog_snapshot, "BookView", lambda *args: built.append(args) or view(*args))
+
+    results = library.search_books("dune", 1)
+    assert len(results) == 2 and not built
+    assert library.query_cache.stats()["entries"] == 0
+
+    log_in(library, "alice").lend_book("Dune")
+    assert [book.available_copies for book in library.search_books("dune", 1)] == [1, 2]
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import metrics as metrics_module
+from conftest import add_books, log_in
+from metrics import Metrics, instrumented
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(metrics_module, "_metrics", metrics)
+    return metrics
+
+
+def test_nothing_is_recorded_until_enabled(library, metrics):
+    add_books(library, "Dune")
+    log_in(library, "alice").lend_book("Dune")
+    assert metrics.snapshot() == {"operations": {}, "events": {}}
+
+    metrics.enable()
+    library.lend_book("Dune")
+    library.search_books("dune", 1)
+    snapshot = metrics.snapshot()
+    assert snapshot["operations"]["lend"]["count"] == 1 and snapshot["operations"]["search"]["count"] == 1
+    assert snapshot["events"]["lend_unavailable"] == 1
+
+    metrics.disable()
+    library.lend_book("Dune")
+    assert metrics.snapshot() == snapshot
+
+
+def test_errors_and_async_calls_are_timed(metrics):
+    metrics.enable()
+    hooked = []
+    metrics.add_trace_hook(lambda operation, seconds, error: hooked.append((operation, error)))
+
+    @instrumented("fails")
+    def fails():
+        raise ValueError
+
+    @instrumented("waits")
+    async def waits():
+        await asyncio.sleep(0)
+        return "done"
+
+    with pytest.raises(ValueError):
+        fails()
+    assert asyncio.run(waits()) == "done"
+    operations = metrics.snapshot()["operations"]
+    assert (operations["fails"]["count"], operations["fails"]["errors"]) == (1, 1)
+    assert (operations["waits"]["count"], operations["waits"]["errors"]) == (1, 0)
+    assert hooked == [("fails", True), ("waits", False)]
+
+
+def test_prometheus_buckets_are_cumulative(metrics):
+    for seconds in (0.00002, 0.003, 0.003, 20.0):
+        metrics.record("search", seconds)
+    metrics.enable()
+    metrics.increment("login_lockouts", 2)
+
+    lines = metrics.prometheus_text().splitlines()
+    assert 'library_operation_seconds_bucket{operation="search",le="1e-05"} 0' in lines
+    assert 'library_operation_seconds_bucket{operation="search",le="5e-05"} 1' in lines
+    assert 'library_operation_seconds_bucket{operation="search",le="0.005"} 3' in lines
+    assert 'library_operation_seconds_bucket{operation="search",le="+Inf"} 4' in lines
+    assert 'library_operation_seconds_count{operation="search"} 4' in lines
+    assert 'library_events_total{event="login_lockouts"} 2' in lines
+
+
+def test_profiling_can_be_toggled(metrics, tmp_path):
+    filename = str(tmp_path / "profile.out")
+    metrics.start_profiling()
+    sum(range(1000))
+    profiler = metrics.stop_profiling(filename)
+    assert profiler is not None and (tmp_path / "profile.out").exists()
+    assert metrics.stop_profiling() is None
@@ -0,0 +1,70 @@
+import random
+
+from conftest import add_books, make_library
+from search_index import SortedKeys
+
+
+class SmallChunks(SortedKeys):
+    # Chunks of four so a few dozen keys already split and empty chunks
+    CHUNK_SIZE = 4
+
+
+def check_pages(keys, expected):
+    for offset in range(len(expected) + 2):
+        for limit in (1, 3, 5, len(expected) + 1):
+            assert keys.page(offset, limit) == expected[offset:offset + limit]
+    for after in [""] + expected + ["zzz"]:
+        assert keys.page(limit=7, after=after) == [key for key in expected if key > after][:7]
+
+
+def test_pages_follow_inserts_that_split_chunks():
+    words = [f"book {n:03d}" for n in range(60)]
+    random.Random(7).shuffle(words)
+    keys = SmallChunks()
+    for word in words:
+        keys.add(word)
+    keys.add(words[0])  # Already there: no duplicate
+
+    assert len(keys) == 60
+    assert max(len(chunk) for chunk in keys.chunks) <= 2 * SmallChunks.CHUNK_SIZE
+    assert keys.maxes == [chunk[-1] for chunk in keys.chunks]
+    check_pages(keys, sorted(words))
+
+
+def test_pages_follow_removals_that_empty_chunks():
+    words = [f"book {n:03d}" for n in range(40)]
+    keys = SmallChunks(words)
+    removed = set(words[4:12]) | set(words[::3])
+    for word in removed:
+        keys.remove(word)
+    keys.remove("not a book")
+
+    remaining = sorted(set(words) - removed)
+    assert len(keys) == len(remaining)
+    assert all(keys.chunks)
+    check_pages(keys, remaining)
+
+    for word in remaining:
+        keys.remove(word)
+    assert keys.chunks == [] and keys.page(0, 5) == [] and keys.page(after="a") == []
+    keys.add("only")
+    assert keys.page(0, 5) == ["only"]
+
+
+def test_display_books_pages_after_adds_and_deletes(capsys):
+    library = make_library()
+    titles = [f"Title {n:02d}" for n in range(30)]
+    add_books(library, *titles[::2])
+    assert [book.title for book in library.list_books(0, 5)] == titles[0:10:2]
+
+    add_books(library, *titles[1::2])
+    for title in titles[5:9]:
+        library.storage.delete_book(title.lower())
+    remaining = titles[:5] + titles[9:]
+    assert [book.title for book in library.list_books(3, 4)] == remaining[3:7]
+    assert [book.title for book in library.list_books(limit=4, after=remaining[9].lower())] == remaining[10:14]
+    assert [book.title for book in library.iter_books(page_size=4)] == remaining
+
+    library.display_books(offset=20)
+    shown = [line[len("Title: "):] for line in capsys.readouterr().out.splitlines() if line.startswith("Title: ")]
+    assert shown == remaining[20:]
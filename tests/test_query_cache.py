@@ -0,0 +1,56 @@
+from conftest import add_books, log_in, make_library
+from library import Book
+from query_cache import QueryCache
+from storage import SqliteStorage
+
+
+def test_a_new_data_version_drops_the_entry():
+    cache = QueryCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [Book("Dune", "Frank Herbert", "Science Fiction")]
+
+    cache.get(("search", "dune", 1), compute, data_version=1)
+    cache.get(("search", "dune", 1), compute, data_version=1)
+    assert len(calls) == 1
+    cache.get(("search", "dune", 1), compute, data_version=2)
+    assert len(calls) == 2
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 1
+
+
+def test_a_write_from_another_connection_clears_cached_results(sqlite_path):
+    library = make_library(SqliteStorage(sqlite_path))
+    add_books(library, "Dune")
+    assert [book.title for book in library.search_books("dune", 1)] == ["Dune"]
+
+    other = SqliteStorage(sqlite_path)
+    other.put_book("dune messiah", Book("Dune Messiah", "Frank Herbert", "Science Fiction"))
+    other.close()
+    assert [book.title for book in library.search_books("dune", 1)] == ["Dune", "Dune Messiah"]
+
+
+def test_a_lend_refreshes_only_the_cached_book(sqlite_path):
+    library = make_library(SqliteStorage(sqlite_path))
+    add_books(library, "Dune", "Dune Messiah", copies=2)
+    assert [book.available_copies for book in library.search_books("dune", 1)] == [2, 2]
+    assert [book.available_copies for book in library.list_books(0, 5)] == [2, 2]
+
+    log_in(library, "alice").lend_book("Dune Messiah")
+    stats = library.query_cache.stats()
+    assert stats["entries"] == 2 and stats["refreshes"] == 2 and stats["invalidations"] == 0
+    assert [book.available_copies for book in library.search_books("dune", 1)] == [2, 1]
+    assert [book.available_copies for book in library.list_books(0, 5)] == [2, 1]
+    assert library.query_cache.stats()["hits"] == 2
+
+
+def test_a_deleted_book_drops_the_entries_holding_it():
+    cache = QueryCache()
+    dune, emma = Book("Dune", "Frank Herbert", "Science Fiction"), Book("Emma", "Jane Austen", "Romance")
+    cache.get(("list", 0, 20, None), lambda: [dune, emma])
+    cache.get(("search", "emma", 1), lambda: [emma])
+
+    cache.refresh("dune", lambda: None)
+    assert cache.stats()["entries"] == 1
+    assert cache.get(("search", "emma", 1), lambda: []) == [emma]
@@ -0,0 +1,102 @@
+import pytest
+
+from library import Book
+from ranking import RankedIndex, edit_distance, parse_query
+from storage import MemoryStorage, SqliteStorage
+
+CATALOG = {"winter garden": Book("Winter Garden", "Kristin Hannah", "Fiction"),
+           "tale": Book("Tale", "Winter Smith", "Fantasy"),
+           "other": Book("Other", "Jane Doe", "Winter"),
+           "dune": Book("Dune", "Frank Herbert", "Science Fiction"),
+           "dune messiah and other tales": Book("Dune Messiah and Other Tales", "Frank Herbert", "Science Fiction")}
+
+
+def keys(results):
+    return [key for key, _ in results]
+
+
+@pytest.fixture
+def index():
+    index = RankedIndex()
+    index.rebuild(CATALOG)
+    return index
+
+
+def test_title_match_outranks_author_and_genre(index):
+    assert keys(index.search("winter")) == ["winter garden", "tale", "other"]
+
+
+def test_shorter_field_ranks_first(index):
+    assert keys(index.search("dune")) == ["dune", "dune messiah and other tales"]
+
+
+def test_field_prefix_restricts_the_match(index):
+    assert keys(index.search("author:winter")) == ["tale"]
+    assert keys(index.search("genre:winter")) == ["other"]
+
+
+def test_every_word_adds_to_the_score(index):
+    assert keys(index.search("dune tales"))[0] == "dune messiah and other tales"
+
+
+def test_rating_breaks_a_tie():
+    index = RankedIndex()
+    index.rebuild({"a": Book("Storm", "X", "Y"), "b": Book("Storm", "X", "Y")})
+    ratings = {"a": 1.0, "b": 5.0}
+    assert keys(index.search("storm", rating_of=ratings.get)) == ["b", "a"]
+    ratings = {"a": 5.0, "b": 1.0}
+    assert keys(index.search("storm", rating_of=ratings.get)) == ["a", "b"]
+
+
+def test_misspelled_query_finds_the_word(index):
+    assert keys(index.search("herbret")) == ["dune", "dune messiah and other tales"]  # Two edits in seven letters
+    assert keys(index.search("wintr")) == ["winter garden", "tale", "other"]
+    assert index.search("dnu") == []  # Terms of three letters or fewer must be spelled right
+
+
+def test_misspelling_scores_below_an_exact_match():
+    index = RankedIndex()
+    index.rebuild({"lanterns": Book("Lanterns", "X", "Y"), "lantern": Book("Lantern", "X", "Y")})
+    assert index.expand("lantern") == [("lantern", 1.0)]  # A known word is not expanded
+    assert sorted(index.expand("lanterm")) == [("lantern", 0.6), ("lanterns", 0.36)]
+    assert keys(index.search("lanterm")) == ["lantern", "lanterns"]
+
+
+def test_added_and_removed_books_are_searchable_at_once(index):
+    index.add("neuromancer", Book("Neuromancer", "William Gibson", "Science Fiction"))
+    assert keys(index.search("neuromancer")) == ["neuromancer"]
+    assert keys(index.search("neuromancr")) == ["neuromancer"]
+
+    index.remove("neuromancer", Book("Neuromancer", "William Gibson", "Science Fiction"))
+    assert index.search("neuromancer") == [] and index.search("neuromancr") == []
+    assert "neuromancer" not in index.vocabulary
+    assert not any("neuromancer" in tokens for tokens in index.vocabulary_grams.values())
+
+    index.remove("dune", CATALOG["dune"])
+    assert keys(index.search("dune")) == ["dune messiah and other tales"]
+    assert index.vocabulary["herbert"] == 1
+
+
+def test_remove_undoes_add_exactly(index):
+    before = (index.lengths.copy(), dict(index.total_lengths), dict(index.vocabulary))
+    book = Book("Winter Winter", "Winter", "Poetry")
+    index.add("winter winter", book)
+    index.remove("winter winter", book)
+    assert (index.lengths, index.total_lengths, index.vocabulary) == before
+
+
+def test_helpers():
+    assert parse_query("author:Tolkien ring") == [(("author",), "tolkien"), (("title", "author", "genre"), "ring")]
+    assert edit_distance("winter", "wintr", 2) == 1
+    assert edit_distance("winter", "summer", 2) == 3  # Cut short at limit + 1
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_ranked_search_orders_the_same_on_each_backend(kind, tmp_path):
+    storage = MemoryStorage() if kind == "memory" else SqliteStorage(str(tmp_path / "library.db"))
+    for key, book in CATALOG.items():
+        storage.put_book(key, Book(book.title, book.author, book.genre))
+    assert [book.title for book, _ in storage.ranked_search("winter")] == ["Winter Garden", "Tale", "Other"]
+    assert [book.title for book, _ in storage.ranked_search("herbret")] == ["Dune", "Dune Messiah and Other Tales"]
+    storage.delete_book("dune")
+    assert [book.title for book, _ in storage.ranked_search("dune")] == ["Dune Messiah and Other Tales"]
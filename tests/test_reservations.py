@@ -0,0 +1,107 @@
+import pytest
+
+from conftest import add_books, log_in, make_library
+from library import Library
+from storage import MappedStorage, SqliteStorage
+
+
+def hold_for_bob(library):
+    # Alice has the only copy; bob queues for it and gets it on hold when she returns it
+    add_books(library, "Dune")
+    log_in(library.open_session(), "alice").lend_book("Dune")
+    log_in(library.open_session(), "bob").reserve_book("Dune")
+    log_in(library.open_session(), "alice").return_book("Dune")
+    assert library.reservations.deadline("dune", "bob") is not None
+    assert library.books["dune"].available_copies == 0
+
+
+def test_hold_survives_journal_replay(tmp_path):
+    journal_dir = str(tmp_path / "journal")
+    library = make_library()
+    library.open_journal(journal_dir)
+    hold_for_bob(library)
+    library.close()
+
+    restarted = make_library(readers=())
+    restarted.load_journal(journal_dir)
+    assert restarted.books["dune"].available_copies == 0
+    assert log_in(restarted, "bob").lend_book("Dune")
+    assert restarted.books["dune"].available_copies == 0
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_hold_survives_backup_and_restore(library, tmp_path, incremental):
+    filename = str(tmp_path / "backup.jsonl")
+    library.backup_data(filename)
+    hold_for_bob(library)
+    library.backup_data(filename, incremental=incremental)
+
+    restored = make_library(readers=())
+    restored.restore_data(filename, lazy=incremental)
+    assert restored.reservations.deadline("dune", "bob") is not None
+    assert log_in(restored, "bob").lend_book("Dune")
+
+
+def test_hold_survives_restart_on_sqlite(sqlite_path):
+    hold_for_bob(make_library(SqliteStorage(sqlite_path)))
+
+    restarted = Library(SqliteStorage(sqlite_path))
+    assert not log_in(restarted.open_session(), "alice").lend_book("Dune")
+    assert log_in(restarted.open_session(), "bob").lend_book("Dune")
+
+
+def test_sqlite_waitlist_is_shared_between_processes(sqlite_path):
+    first = make_library(SqliteStorage(sqlite_path))
+    add_books(first, "Dune")
+    log_in(first.open_session(), "alice").lend_book("Dune")
+    assert log_in(first.open_session(), "bob").reserve_book("Dune") == 1
+
+    second = Library(SqliteStorage(sqlite_path))
+    log_in(second, "alice").return_book("Dune")
+    assert first.reservations.deadline("dune", "bob") is not None
+
+
+def test_expired_hold_is_released_after_restart(tmp_path):
+    journal_dir = str(tmp_path / "journal")
+    library = make_library()
+    library.open_journal(journal_dir)
+    hold_for_bob(library)
+    library.close()
+
+    restarted = make_library(readers=())
+    restarted.load_journal(journal_dir)
+    restarted.expire_reservations()
+    assert restarted.books["dune"].available_copies == 0  # Still held
+    restarted.reservations.hold_seconds = 0
+    for key, username, _ in restarted.reservations.held():
+        restarted.reservations.hold(key, username, now=1)
+    restarted.expire_reservations()
+    assert restarted.books["dune"].available_copies == 1
+
+
+@pytest.mark.parametrize("storage", ["memory", "sqlite", "mapped"])
+def test_added_copies_go_to_the_waitlist(tmp_path, storage):
+    storage = {"memory": lambda: None, "sqlite": lambda: SqliteStorage(str(tmp_path / "library.db")),
+               "mapped": lambda: MappedStorage(str(tmp_path / "catalog.snap"))}[storage]()
+    library = make_library(storage)
+    add_books(library, "Dune", "Emma")
+    log_in(library.open_session(), "alice").lend_book("Dune")
+    log_in(library.open_session(), "alice").lend_book("Emma")
+    log_in(library.open_session(), "bob").reserve_book("Dune")
+    log_in(library.open_session(), "bob").reserve_book("Emma")
+
+    log_in(library, "admin").add_book("Dune", "Some Author", "Fiction", 2)
+    assert library.reservations.deadline("dune", "bob") is not None
+    assert library.books["dune"].available_copies == 1
+
+    library.import_books([{"title": "Emma", "author": "Some Author", "genre": "Fiction", "total_copies": 1}])
+    assert library.reservations.deadline("emma", "bob") is not None
+    assert library.books["emma"].available_copies == 0
+
+
+def test_deleting_an_account_releases_its_holds(library, monkeypatch):
+    hold_for_bob(library)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "yes")
+    log_in(library, "bob").delete_account()
+    assert library.reservations.held() == []
+    assert library.books["dune"].available_copies == 1
@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from library import Book
+from storage import MappedStorage, MemoryStorage, SqliteStorage
+
+CATALOG = [("Dune", "Frank Herbert", "Science Fiction"), ("It", "Stephen King", "Horror"),
+           ("Emma", "Jane Austen", "Romance"), ("The Winter Garden", "Kristin Hannah", "Fiction"),
+           ("Winter's Tale", "Mark Helprin", "Fantasy"), ("Ubik", "Philip K. Dick", "Science Fiction"),
+           ("Germinal", "Émile Zola", "Naturalisme"), ("Ökonomie", "Ölaf Ünger", "Études")]
+QUERIES = [("i", 1), ("it", 1), ("IT", 1), ("win", 1), ("winter", 1), ("garden w", 1), ("zzz", 1), ("", 1),
+           ("he", 2), ("herbert", 2), ("k", 2), ("fi", 3), ("science fiction", 3), ("ro", 3),
+           ("émile", 2), ("ÉMILE", 2), ("Ém", 2), ("ö", 1), ("ÖKONOMIE", 1), ("ünger", 2), ("ÉTUDES", 3)]
+
+
+def make_storage(kind, tmp_path):
+    if kind == "sqlite":
+        return SqliteStorage(str(tmp_path / "library.db"))
+    if kind == "mapped":
+        return MappedStorage(str(tmp_path / "catalog.snap"))
+    return MemoryStorage()
+
+
+def expected(keyword, filter_option, catalog=CATALOG):
+    return sorted(row[0] for row in catalog if keyword.lower() in row[filter_option - 1].lower())
+
+
+@pytest.fixture(params=["memory", "sqlite", "mapped"])
+def storage(request, tmp_path):
+    storage = make_storage(request.param, tmp_path)
+    for title, author, genre in CATALOG:
+        storage.put_book(title.lower(), Book(title, author, genre))
+    return storage
+
+
+@pytest.mark.parametrize("keyword, filter_option", QUERIES)
+def test_search_matches_substrings_on_every_backend(storage, keyword, filter_option):
+    assert sorted(book.title for book in storage.search(keyword, filter_option)) == expected(keyword, filter_option)
+
+
+def test_search_follows_deletes_and_adds(storage):
+    storage.delete_book("it")
+    storage.put_book("ivanhoe", Book("Ivanhoe", "Walter Scott", "Adventure"))
+    catalog = [row for row in CATALOG if row[0] != "It"] + [("Ivanhoe", "Walter Scott", "Adventure")]
+    for keyword, filter_option in QUERIES + [("van", 1), ("ott", 2)]:
+        assert sorted(book.title for book in storage.search(keyword, filter_option)) == \
+            expected(keyword, filter_option, catalog), keyword
+
+
+def test_lazily_built_index_matches_an_eager_one():
+    books = {title.lower(): Book(title, author, genre) for title, author, genre in CATALOG}
+    eager, lazy = MemoryStorage(), MemoryStorage()
+    eager.replace_all(dict(books), {})
+    lazy.replace_all(dict(books), {}, lazy=True)
+    lazy.put_book("ivanhoe", Book("Ivanhoe", "Walter Scott", "Adventure"))
+    eager.put_book("ivanhoe", Book("Ivanhoe", "Walter Scott", "Adventure"))
+    for keyword, filter_option in QUERIES + [("van", 1)]:
+        assert [book.title for book in lazy.search(keyword, filter_option)] == \
+            [book.title for book in eager.search(keyword, filter_option)]
+
+
+@pytest.mark.parametrize("genre", ["études", "ÉTUDES", "Études"])
+def test_top_rated_matches_genre_case_insensitively(storage, genre):
+    storage.add_feedback("ökonomie", 4.0)
+    assert [book.title for book in storage.top_rated(5, genre)] == ["Ökonomie"]
+
+
+def test_older_sqlite_database_is_searched_case_insensitively(tmp_path):
+    path = str(tmp_path / "library.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE books (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, title TEXT NOT NULL,
+            author TEXT NOT NULL, genre TEXT NOT NULL, total_copies INTEGER NOT NULL,
+            available_copies INTEGER NOT NULL, rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum REAL NOT NULL DEFAULT 0, rating_histogram TEXT NOT NULL DEFAULT '[0,0,0,0,0]');
+        CREATE INDEX books_genre_lower ON books (lower(genre));
+        CREATE VIRTUAL TABLE books_fts USING fts5(title, author, genre, content='books', content_rowid='id',
+            tokenize='trigram');
+        INSERT INTO books (key, title, author, genre, total_copies, available_copies)
+            VALUES ('germinal', 'Germinal', 'Émile Zola', 'Naturalisme', 1, 1);
+        INSERT INTO books_fts (books_fts) VALUES ('rebuild');
+    """)
+    connection.close()
+
+    storage = SqliteStorage(path)
+    assert [book.title for book in storage.search("ÉMILE", 2)] == ["Germinal"]
+    storage.put_book("emma", Book("Emma", "Jane Austen", "Romance"))
+    assert [book.title for book in storage.search("austen", 2)] == ["Emma"]
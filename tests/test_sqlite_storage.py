@@ -0,0 +1,174 @@
+import sqlite3
+
+import pytest
+
+from conftest import add_books, log_in, make_library
+from library import Book, Library, User
+from storage import MappedStorage, MemoryStorage, SqliteStorage
+
+
+def test_feedback_from_two_processes_is_added_not_overwritten(sqlite_path):
+    first, second = SqliteStorage(sqlite_path), SqliteStorage(sqlite_path)
+    first.put_book("dune", Book("Dune", "Frank Herbert", "Science Fiction", 2))
+    stale = second.books["dune"]
+
+    first.add_feedback("dune", 5.0, "Loved it")
+    second.add_feedback("dune", 2.5, "Too long")
+    second.put_book("dune", stale)  # A stale Book written back keeps the feedback it never saw
+
+    book = SqliteStorage(sqlite_path).books["dune"]
+    assert (book.rating_count, book.rating_sum) == (2, 7.5)
+    assert list(book.rating_histogram) == [0, 0, 1, 0, 1]
+    assert book.reviews == ["Loved it", "Too long"]
+
+
+def test_returns_in_two_processes_both_count(sqlite_path, capsys):
+    library = make_library(SqliteStorage(sqlite_path))
+    add_books(library, "Dune", copies=2)
+    first, second = Library(SqliteStorage(sqlite_path)), Library(SqliteStorage(sqlite_path))
+    log_in(first, "alice").lend_book("Dune")
+    log_in(second, "bob").lend_book("Dune")
+
+    log_in(first, "alice").return_book("Dune", "5", "Loved it")
+    log_in(second, "bob").return_book("Dune", "9", "Too long")
+    output = capsys.readouterr().out
+    assert "Rating of 5.0 added" in output and "Invalid rating" in output
+
+    book = library.books["dune"]
+    assert (book.rating_count, book.available_copies) == (1, 2)
+    assert book.reviews == ["Loved it", "Too long"]
+
+
+def test_failed_lend_leaves_nothing_behind(sqlite_path, monkeypatch):
+    storage = SqliteStorage(sqlite_path)
+    library = make_library(storage)
+    add_books(library, "Dune")
+
+    def fail(username, key):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(library.loans, "open", fail)  # After the copy and the borrow log entry are written
+    with pytest.raises(sqlite3.OperationalError):
+        log_in(library, "alice").lend_book("Dune")
+
+    fresh = Library(SqliteStorage(sqlite_path))
+    assert fresh.books["dune"].available_copies == 1
+    assert len(fresh.loans) == 0
+    assert len(fresh.users["alice"].borrowed_log) == 0
+    assert storage.depth == 0
+    assert storage.adjust_copies("dune", -1)  # The connection is usable again
+
+
+def test_lends_by_two_processes_for_one_user_both_reach_the_log(sqlite_path):
+    library = make_library(SqliteStorage(sqlite_path))
+    add_books(library, "Dune", "Emma")
+    first, second = Library(SqliteStorage(sqlite_path)), Library(SqliteStorage(sqlite_path))
+    log_in(first, "alice").lend_book("Dune")
+    log_in(second, "alice").lend_book("Emma")  # This session's copy of alice has never seen the first lend
+    log_in(first, "alice").return_book("Dune")
+
+    user = SqliteStorage(sqlite_path).users["alice"]
+    assert [(title, int(action)) for title, action, _ in user.borrowed_log] == [("Dune", 1), ("Emma", 1), ("Dune", 2)]
+    assert sorted(loan.key for loan in library.loans) == ["emma"]
+
+
+def test_borrow_log_is_not_rewritten_by_put_user(sqlite_path):
+    storage = SqliteStorage(sqlite_path)
+    library = make_library(storage)
+    add_books(library, "Dune")
+    stale = storage.users["alice"]
+    log_in(library, "alice").lend_book("Dune")
+    storage.put_user("alice", stale)  # e.g. a password change from a session loaded before the lend
+
+    assert [title for title, _, _ in storage.users["alice"].borrowed_log] == ["Dune"]
+
+
+def test_borrow_log_column_of_an_older_database_is_moved(sqlite_path):
+    connection = sqlite3.connect(sqlite_path)
+    connection.execute("CREATE TABLE users (username TEXT PRIMARY KEY, hashed_password BLOB NOT NULL, "
+                       "security_questions TEXT NOT NULL, security_answers TEXT NOT NULL, email TEXT, "
+                       "borrowed_log TEXT NOT NULL DEFAULT '[]', wrong_attempts INTEGER NOT NULL DEFAULT 0, "
+                       "cooldown_end_time TEXT)")
+    connection.execute("INSERT INTO users VALUES ('alice', 'unused', '[]', '{}', NULL, "
+                       "'[[\"Dune\", 1, 100.0], [\"Dune\", 2, 200.0]]', 0, NULL)")
+    connection.commit()
+    connection.close()
+
+    storage = SqliteStorage(sqlite_path)
+    assert storage.users["alice"].borrowed_log.to_list() == [["Dune", 1, 100.0], ["Dune", 2, 200.0]]
+    storage.put_user("bob", User("bob", "unused"))  # The old column's default fills in
+    assert list(storage.users) == ["alice", "bob"]
+
+
+def test_lending_and_returning_never_read_reviews(sqlite_path):
+    storage = SqliteStorage(sqlite_path)
+    library = make_library(storage)
+    add_books(library, "Dune")
+    for number in range(50):
+        storage.add_feedback("dune", review=f"Review {number}")
+    statements = []
+    storage.connection.set_trace_callback(statements.append)
+    log_in(library, "alice").lend_book("Dune")
+    log_in(library, "alice").return_book("Dune", "4", "Good")
+    storage.connection.set_trace_callback(None)
+
+    assert not [sql for sql in statements if "SELECT text FROM reviews" in sql]
+    reviews = storage.books["dune"].reviews
+    assert reviews.texts is None  # Read only when used
+    assert len(reviews) == 51 and reviews[-1] == "Good"
+
+
+def test_reviews_survive_replace_all(sqlite_path):
+    book = Book("Dune", "Frank Herbert", "Science Fiction")
+    book.reviews = ["Loved it", "Too long"]
+    storage = SqliteStorage(sqlite_path)
+    storage.replace_all({"dune": book}, {})
+    storage.put_book("emma", book)  # A new key takes the reviews of the Book it is given
+    storage.put_book("dune", Book("Dune", "Frank Herbert", "Classics"))  # An edit keeps the stored ones
+
+    fresh = SqliteStorage(sqlite_path)
+    assert fresh.books["dune"].reviews == ["Loved it", "Too long"]
+    assert fresh.books["emma"].reviews == ["Loved it", "Too long"]
+    fresh.delete_book("emma")
+    assert fresh.execute("SELECT count(*) FROM reviews WHERE book_key = 'emma'") == [(0,)]
+
+
+def test_reviews_column_of_an_older_database_is_moved(sqlite_path):
+    connection = sqlite3.connect(sqlite_path)
+    connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, title TEXT NOT NULL, "
+                       "author TEXT NOT NULL, genre TEXT NOT NULL, total_copies INTEGER NOT NULL, "
+                       "available_copies INTEGER NOT NULL CHECK (available_copies >= 0), "
+                       "rating_count INTEGER NOT NULL DEFAULT 0, rating_sum REAL NOT NULL DEFAULT 0, "
+                       "rating_histogram TEXT NOT NULL DEFAULT '[0,0,0,0,0]', reviews TEXT NOT NULL DEFAULT '[]')")
+    connection.execute("INSERT INTO books (key, title, author, genre, total_copies, available_copies, reviews) "
+                       "VALUES ('dune', 'Dune', 'Frank Herbert', 'Science Fiction', 1, 1, '[\"Loved it\"]')")
+    connection.commit()
+    connection.close()
+
+    storage = SqliteStorage(sqlite_path)
+    assert storage.books["dune"].reviews == ["Loved it"]
+    storage.add_feedback("dune", review="Too long")
+    storage.put_book("emma", Book("Emma", "Jane Austen", "Romance"))  # The old column's default fills in
+    assert SqliteStorage(sqlite_path).books["dune"].reviews == ["Loved it", "Too long"]
+
+
+def test_nested_atomic_commits_once(sqlite_path):
+    storage = SqliteStorage(sqlite_path)
+    storage.put_book("dune", Book("Dune", "Frank Herbert", "Science Fiction", 2))
+    other = SqliteStorage(sqlite_path)
+    with storage.atomic():
+        storage.adjust_copies("dune", -1)
+        with storage.atomic():
+            storage.adjust_copies("dune", -1)
+        assert other.books["dune"].available_copies == 2  # Nothing committed until the outer block ends
+    assert other.books["dune"].available_copies == 0
+
+
+@pytest.mark.parametrize("kind", ["memory", "mapped"])
+def test_feedback_on_other_backends(tmp_path, kind):
+    storage = MemoryStorage() if kind == "memory" else MappedStorage(str(tmp_path / "catalog.snap"))
+    storage.put_book("dune", Book("Dune", "Frank Herbert", "Science Fiction", 1))
+    assert storage.add_feedback("dune", 4.5, "Classic")
+    assert not storage.add_feedback("missing", 3.0)
+    book = storage.books["dune"]
+    assert (book.rating_count, list(book.rating_histogram), book.reviews) == (1, [0, 0, 0, 0, 1], ["Classic"])
+    assert [book.title for book in storage.top_rated(1)] == ["Dune"]
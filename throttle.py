@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryThrottleStore:
+    # Limiter state for one process: key -> state tuple, least recently used first, capped at max_keys
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, key, func):
+        # func(state or None) -> (new state, result), applied atomically; returns result
+        with self._lock:
+            state, result = func(self.states.get(key))
+            self.states[key] = state
+            self.states.move_to_end(key)
+            if len(self.states) > self.max_keys:
+                self.states.popitem(last=False)
+            return result
+
+    def peek(self, key):
+        with self._lock:
+            return self.states.get(key)
+
+    def delete(self, key):
+        with self._lock:
+            self.states.pop(key, None)
+
+
+class SqliteThrottleStore:
+    # Limiter state in a small SQLite file, so every process serving logins on this machine shares the
+    # same buckets and lockouts. Each update is one IMMEDIATE transaction, which makes the read-modify-write
+    # atomic across processes; the least recently touched keys are pruned past max_keys.
+    PRUNE_EVERY = 256
+
+    def __init__(self, path, max_keys=100000):
+        self.path = path
+        self.max_keys = max_keys
+        self.connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.writes = 0
+        with self._lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS throttle (key TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                                    "touched REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS throttle_touched ON throttle (touched)")
+
+    def update(self, key, func):
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT state FROM throttle WHERE key = ?", (key,)).fetchone()
+                state, result = func(tuple(json.loads(row[0])) if row else None)
+                self.connection.execute("INSERT OR REPLACE INTO throttle (key, state, touched) VALUES (?, ?, ?)",
+                                        (key, json.dumps(state), time.time()))
+                self.writes += 1
+                if self.writes % self.PRUNE_EVERY == 0:
+                    self.connection.execute(
+                        "DELETE FROM throttle WHERE key IN (SELECT key FROM throttle ORDER BY touched DESC "
+                        "LIMIT -1 OFFSET ?)", (self.max_keys,))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            return result
+
+    def peek(self, key):
+        with self._lock:
+            row = self.connection.execute("SELECT state FROM throttle WHERE key = ?", (key,)).fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def delete(self, key):
+        with self._lock:
+            self.connection.execute("DELETE FROM throttle WHERE key = ?", (key,))
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def take_token(rate, burst, now):
+    # Token bucket step over state (tokens, updated_at); the result is 0 if a token was taken,
+    # otherwise the seconds until one will be
+    def step(state):
+        tokens, updated_at = state or (burst, now)
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens >= 1:
+            return (tokens - 1, now), 0.0
+        return (tokens, now), (1 - tokens) / rate
+    return step
+
+
+def failure_step(window, max_failures, lockout_seconds, now):
+    # Sliding-window counter over state (window_start, current, previous, locked_until): failures in the
+    # previous fixed window count in proportion to how much of it still overlaps the last `window` seconds,
+    # which approximates a true sliding window in four numbers per key. The result is the lockout end,
+    # or 0 while under max_failures.
+    def step(state):
+        window_start, current, previous, locked_until = state or (now - now % window, 0, 0, 0.0)
+        elapsed_windows = int((now - window_start) // window)
+        if elapsed_windows:
+            previous = current if elapsed_windows == 1 else 0
+            current = 0
+            window_start += elapsed_windows * window
+        current += 1
+        estimate = previous * (1 - (now - window_start) / window) + current
+        if estimate >= max_failures:
+            locked_until = now + lockout_seconds
+            current, previous = 0, 0  # The lockout is the penalty; counting starts over after it
+        return (window_start, current, previous, locked_until), locked_until if locked_until > now else 0.0
+    return step
+
+
+class LoginThrottle:
+    # Decides whether a login attempt may reach bcrypt at all. Attempts draw from token buckets for the
+    # username, the source (client address) and the whole service; failed attempts feed a per-username
+    # sliding-window counter that locks the name out for lockout_seconds after max_failures.
+    # Unknown usernames are throttled the same way as real ones.
+    def __init__(self, store=None, user_rate=None, user_burst=None, source_rate=None, source_burst=None,
+                 global_rate=None, global_burst=None, max_failures=None, failure_window=None, lockout_seconds=None):
+        path = os.getenv("LOGIN_THROTTLE_DB")
+        self.store = store or (SqliteThrottleStore(path) if path else MemoryThrottleStore())
+        self.user_rate = user_rate or float(os.getenv("LOGIN_USER_RATE", 0.2))  # Attempts per second, refilled
+        self.user_burst = user_burst or float(os.getenv("LOGIN_USER_BURST", 5))
+        self.source_rate = source_rate or float(os.getenv("LOGIN_SOURCE_RATE", 1))
+        self.source_burst = source_burst or float(os.getenv("LOGIN_SOURCE_BURST", 20))
+        self.global_rate = global_rate or float(os.getenv("LOGIN_GLOBAL_RATE", 50))
+        self.global_burst = global_burst or float(os.getenv("LOGIN_GLOBAL_BURST", 200))
+        self.max_failures = max_failures or int(os.getenv("LOGIN_MAX_FAILURES", 3))
+        self.failure_window = failure_window or float(os.getenv("LOGIN_FAILURE_WINDOW", 300))
+        self.lockout_seconds = lockout_seconds or float(os.getenv("LOGIN_LOCKOUT_SECONDS", 60))
+
+    def check(self, username, source="local", now=None):
+        # None if the attempt may go ahead, otherwise ("cooldown" or "rate_limited", seconds to wait)
+        now = now or time.time()
+        locked_until = self.locked_until(username, now)
+        if locked_until:
+            return "cooldown", locked_until - now
+        for key, rate, burst in ((f"user:{username}", self.user_rate, self.user_burst),
+                                 (f"source:{source}", self.source_rate, self.source_burst),
+                                 ("global", self.global_rate, self.global_burst)):
+            wait = self.store.update(key, take_token(rate, burst, now))
+            if wait:
+                return "rate_limited", wait
+        return None
+
+    def locked_until(self, username, now=None):
+        state = self.store.peek(f"failures:{username}")
+        now = now or time.time()
+        return state[3] if state and state[3] > now else 0.0
+
+    def record_failure(self, username, now=None):
+        # Returns when the lockout this failure triggered ends, or 0
+        now = now or time.time()
+        return self.store.update(f"failures:{username}",
+                                 failure_step(self.failure_window, self.max_failures, self.lockout_seconds, now))
+
+    def record_success(self, username):
+        self.store.delete(f"failures:{username}")
+
+
+_login_throttle = None
+
+
+def get_login_throttle():
+    global _login_throttle
+    if _login_throttle is None:
+        _login_throttle = LoginThrottle()
+    return _login_throttle
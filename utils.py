@@ -1,55 +1,141 @@
-import smtplib
 import os
-from dotenv import load_dotenv
+import queue
+import threading
+import time
 
-load_dotenv()
+_env_loaded = False
 
-def send_email():
-    toaddrs = input("To: ").split()
 
-    msg = f"From: \r\nTo: {', '.join(toaddrs)}\r\n\r\n"
+def load_env():
+    # Reads .env (mail credentials and settings) into the environment, once. Called by the mail and
+    # reset paths and the interactive menu rather than at import, so commands that never send mail
+    # don't load python-dotenv or smtplib.
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
 
-    print("Enter message, end with an empty line:")
 
-    while True:
+class MailDispatcher:
+    # Background sender for reset mail: one SMTP session is reused across messages,
+    # queued messages are drained in batches and failed sends are retried with backoff
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None,
+                 max_queue=1000, batch_size=50, max_retries=3, backoff=0.5, idle_timeout=30):
+        load_env()
+        self.host = host or os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.port = int(port or os.getenv("SMTP_PORT", 587))
+        self.username = username if username is not None else os.getenv("RESET_EMAIL")
+        self.password = password if password is not None else os.getenv("EMAIL_PASSWORD")
+        self.use_tls = use_tls if use_tls is not None else os.getenv("SMTP_STARTTLS", "1") == "1"
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.server = None
+        self.sent = 0
+        self.failed = 0
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, to_addr, subject, body):
+        # Returns False instead of blocking the caller when the queue is full
+        self._ensure_worker()
         try:
-            line = input()
-        except EOFError:
-            break
-        if not line:
-            break
-        msg += line + '\n'
-
-    print("Message length is", len(msg))
-
-    # Update SMTP server and port based on your configuration
-  
-    server = smtplib.SMTP("smtp.gmail.com", 587)
-    server.ehlo()
-    server.starttls()
-    server.ehlo()
-
-
-    # Provide your email credentials for authentication
-    username = os.getenv("RESET_EMAIL")
-    password = os.getenv("EMAIL_PASSWORD")
-    print(password,username)
-    try:
-        server.login(username, password)
-    except smtplib.SMTPAuthenticationError as e:
-        print(f"Authentication failed: {e}")
-        server.quit()
-        return
-
-    server.sendmail(username, toaddrs, msg)
-    server.quit()
-
-#  try:
-#         server = smtplib.SMTP("smtp.gmail.com", 587)
-#         server.starttls()
-#         server.login(user, pwd)
-#         server.sendmail(FROM, TO, message)
-#         server.close()
-#         print 'successfully sent the mail'
-#     except:
-#         print "failed to send mail"
\ No newline at end of file
+            self.queue.put_nowait((to_addr, subject, body))
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self, timeout=None):
+        # Wait until everything queued so far has been sent or given up on
+        with self.queue.all_tasks_done:
+            end = time.monotonic() + timeout if timeout is not None else None
+            while self.queue.unfinished_tasks:
+                remaining = end - time.monotonic() if end is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self):
+        self.flush()
+        self._disconnect()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                self._disconnect()  # Don't hold an idle session open on the server
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for message in batch:
+                self._deliver(message)
+                self.queue.task_done()
+
+    def _deliver(self, message):
+        import smtplib
+        to_addr, subject, body = message
+        sender = self.username or "library@localhost"
+        msg = f"From: {sender}\r\nTo: {to_addr}\r\nSubject: {subject}\r\n\r\n{body}"
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._connect().sendmail(sender, [to_addr], msg)
+                self.sent += 1
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                self._disconnect()  # Session is suspect after an error, start fresh on retry
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    print(f"Failed to send email to {to_addr}: {e}")
+                    return
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def _connect(self):
+        if self.server is not None:
+            return self.server
+
+        import smtplib
+        server = smtplib.SMTP(self.host, self.port, timeout=10)
+        server.ehlo()
+        if self.use_tls:
+            server.starttls()
+            server.ehlo()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        self.server = server
+        return server
+
+    def _disconnect(self):
+        if self.server is not None:
+            import smtplib
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+
+_mail_dispatcher = None
+
+
+def get_mail_dispatcher():
+    global _mail_dispatcher
+    if _mail_dispatcher is None:
+        _mail_dispatcher = MailDispatcher()
+    return _mail_dispatcher